@@ -1,10 +1,26 @@
 import json
-import base64
 import os
-from datetime import datetime
+import sys
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIStatusError, OpenAI
 from mcp.server import FastMCP
+from mcp.server.fastmcp import Context
+
+# 确保可以从项目根目录导入公共模块
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.image_jobs import (
+    ImageJobStore, JOB_RUNNING, JOB_SUCCESS, JOB_ERROR, FINISHED_STATUSES,
+    job_image_url, job_status_url
+)
+from utils.image_storage import store_base64_image, generate_thumbnails, thumbnail_filename, THUMBNAIL_DIR_NAME
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 # 加载环境变量
 load_dotenv()
@@ -18,64 +34,212 @@ doubao_client = OpenAI(
     api_key=os.getenv("DOUBAO_API_KEY")
 )
 
+# 图片生成任务目录（与Web服务共享，用于查询任务状态）
+IMAGE_JOBS_DIR = os.getenv("IMAGE_JOBS_DIR", "cache/image_jobs")
+if not os.path.isabs(IMAGE_JOBS_DIR):
+    IMAGE_JOBS_DIR = os.path.join(PROJECT_ROOT, IMAGE_JOBS_DIR)
+
+job_store = ImageJobStore(IMAGE_JOBS_DIR)
+JOB_POLL_INTERVAL = 1.0
+
+# 熔断状态与Web服务、图片生成进程共享
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "cache/shared_state.sqlite3")
+if not os.path.isabs(SHARED_STATE_DB):
+    SHARED_STATE_DB = os.path.join(PROJECT_ROOT, SHARED_STATE_DB)
+
+def is_seedream_failure(error: BaseException) -> bool:
+    """请求本身有误（如描述未通过审核，4xx，429除外）不计为文生图服务故障"""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+# 超过90秒的生成视为慢调用
+seedream_breaker = CircuitBreaker("seedream", SHARED_STATE_DB, slow_call_seconds=90,
+                                  is_failure=is_seedream_failure)
+
+# 图片质量档位对应的尺寸，默认档位可通过环境变量配置
+IMAGE_QUALITY_TIERS = {
+    "draft": "1024x1024",
+    "standard": "1536x1536",
+    "high": "2048x2048"
+}
+DEFAULT_QUALITY_TIER = os.getenv("IMAGE_QUALITY_TIER", "high")
+# 单次批量生成的图片数量上限及并发数
+MAX_BATCH_IMAGES = 8
+BATCH_CONCURRENCY = 4
+
+def generate_and_save_image(prompt: str, size: str = IMAGE_QUALITY_TIERS["high"], on_progress=None) -> dict:
+    """调用豆包文生图API生成图片并保存到本地，返回图片信息"""
+    def report(progress: float, message: str):
+        if on_progress:
+            on_progress(progress, message)
+    
+    # 调用豆包文生图API
+    print("📡 调用豆包文生图API...")
+    report(0.1, "调用豆包文生图API")
+    with seedream_breaker.guard():
+        response = doubao_client.images.generate(
+            model="doubao-seedream-3-0-t2i-250415",
+            prompt=prompt,
+            size=size,
+            response_format="b64_json"
+        )
+    print("✅ 豆包API响应成功，开始处理图片数据")
+    report(0.8, "处理图片数据")
+    
+    # 获取Base64编码的图像数据，释放响应对象以免重复持有图片数据
+    b64_image_data = response.data[0].b64_json
+    del response
+    print(f"📥 获取到Base64图片数据，大小: {len(b64_image_data)} 字符")
+    
+    # 确保生成的图片保存目录存在  
+    images_dir = os.getenv("GENERATED_IMAGES_PATH", "static/generated_images")
+    # 如果是相对路径，确保从项目根目录开始
+    if not os.path.isabs(images_dir):
+        images_dir = os.path.join(PROJECT_ROOT, images_dir)
+    print(f"📁 图片保存目录: {images_dir}")
+    
+    # 分块解码并按内容哈希保存
+    stored = store_base64_image(b64_image_data, images_dir)
+    del b64_image_data
+    filename = stored["filename"]
+    if stored["deduplicated"]:
+        print(f"♻️ 已存在相同图片，复用: {filename}")
+    else:
+        print(f"✅ 图片保存成功: {stored['filepath']} ({stored['size']} 字节)")
+    
+    return {
+        "filepath": stored["filepath"],
+        "filename": filename,
+        "web_path": f"/static/generated_images/{filename}"
+    }
+
+def attach_thumbnail(image_info: dict) -> dict:
+    """等待缩略图生成完成，返回缩略图的访问路径"""
+    future = generate_thumbnails(image_info["filepath"])
+    if future is None:
+        return {}
+    try:
+        future.result()
+    except Exception as e:
+        print(f"⚠️ 缩略图生成失败: {str(e)}")
+        return {}
+    thumbnail_name = thumbnail_filename(image_info["filename"])
+    print(f"🖼️ 缩略图生成完成: {thumbnail_name}")
+    return {"thumbnail_path": f"/static/generated_images/{THUMBNAIL_DIR_NAME}/{thumbnail_name}"}
+
+def run_image_job(job_id: str):
+    """在后台进程中执行图片生成任务，并把进度写入任务文件"""
+    job = job_store.get(job_id)
+    if job is None:
+        print(f"❌ 图片生成任务不存在: {job_id}")
+        return
+    
+    def on_progress(progress: float, message: str):
+        job_store.update(job_id, status=JOB_RUNNING, progress=progress, message=message)
+    
+    try:
+        size = job.get("params", {}).get("size", IMAGE_QUALITY_TIERS["high"])
+        image_info = generate_and_save_image(job["prompt"], size, on_progress)
+        job_store.update(job_id, status=JOB_SUCCESS, progress=1.0, message="图片生成成功", **image_info)
+        # 原图可用后再生成缩略图，不阻塞图片展示
+        thumbnail_info = attach_thumbnail(image_info)
+        if thumbnail_info:
+            job_store.update(job_id, **thumbnail_info)
+    except Exception as e:
+        print(f"❌ 图片生成失败: {str(e)}")
+        job_store.update(job_id, status=JOB_ERROR, message=f"图片生成失败: {str(e)}")
+
+def run_image_jobs(job_ids: List[str]):
+    """在同一个后台进程中并发执行一批图片生成任务"""
+    if len(job_ids) == 1:
+        run_image_job(job_ids[0])
+        return
+    with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(job_ids))) as pool:
+        list(pool.map(run_image_job, job_ids))
+
+def start_job_worker(job_ids: List[str]):
+    """启动独立的后台进程执行任务，MCP会话关闭后任务仍会继续"""
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--run-job", *job_ids],
+        cwd=PROJECT_ROOT,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def job_to_response(job: dict) -> dict:
+    """将任务信息转换为工具返回格式"""
+    job_id = job["job_id"]
+    response = {
+        "status": "pending" if job["status"] not in FINISHED_STATUSES else job["status"],
+        "job_id": job_id,
+        "job_status": job["status"],
+        "progress": job.get("progress", 0.0),
+        "message": job.get("message", ""),
+        "status_url": job_status_url(job_id),
+        "web_path": job.get("web_path") or job_image_url(job_id),
+        "prompt": job.get("prompt", "")
+    }
+    if job.get("filename"):
+        response["filename"] = job["filename"]
+    if job.get("thumbnail_path"):
+        response["thumbnail_path"] = job["thumbnail_path"]
+    return response
+
 @app.tool()
-async def generate_image(prompt: str) -> str:
+async def generate_image(ctx: Context, prompt: str = "", prompts: Optional[List[str]] = None,
+                         n: int = 1, quality: str = DEFAULT_QUALITY_TIER) -> str:
     """
-    使用豆包大模型生成图片
+    使用豆包大模型生成图片。图片在后台异步生成，工具会立即返回任务ID和图片占位地址，
+    占位地址可以直接以![描述](web_path)的格式放入回答中，图片生成完成后会自动显示
     
     Args:
         prompt: 图片生成的描述文本，详细描述想要生成的图片内容
+        prompts: 需要一次生成多张不同图片时使用的描述文本列表，与prompt二选一
+        n: 每个描述生成的图片数量（变体数），默认1
+        quality: 图片质量档位，可选值：draft(1024x1024), standard(1536x1536), high(2048x2048)
     
     Returns:
-        生成图片的本地保存路径的JSON字符串
+        图片生成任务信息的JSON字符串；单张图片时包含job_id和web_path，多张图片时包含images列表
     """
-    print(f"🎨 收到图片生成请求: {prompt[:100]}...")
+    prompt_list = [p for p in (prompts or [prompt]) if p and p.strip()]
+    if not prompt_list:
+        return json.dumps({"status": "error", "message": "图片描述不能为空"}, ensure_ascii=False)
+    
+    n = max(1, n)
+    if len(prompt_list) * n > MAX_BATCH_IMAGES:
+        return json.dumps({
+            "status": "error",
+            "message": f"单次最多生成 {MAX_BATCH_IMAGES} 张图片"
+        }, ensure_ascii=False)
+    
+    # 文生图服务熔断时不再提交注定失败的后台任务
     try:
-        # 调用豆包文生图API
-        print("📡 调用豆包文生图API...")
-        response = doubao_client.images.generate(
-            model="doubao-seedream-3-0-t2i-250415",
-            prompt=prompt,
-            size="2048x2048",
-            response_format="b64_json"
-        )
-        print("✅ 豆包API响应成功，开始处理图片数据")
-        
-        # 获取Base64编码的图像数据
-        b64_image_data = response.data[0].b64_json
-        print(f"📥 获取到Base64图片数据，大小: {len(b64_image_data)} 字符")
-        
-        # 解码Base64数据
-        image_data = base64.b64decode(b64_image_data)
-        print(f"🔄 解码完成，图片大小: {len(image_data)} 字节")
-        
-        # 确保生成的图片保存目录存在  
-        images_dir = os.getenv("GENERATED_IMAGES_PATH", "static/generated_images")
-        # 如果是相对路径，确保从项目根目录开始
-        if not os.path.isabs(images_dir):
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            images_dir = os.path.join(project_root, images_dir)
-        os.makedirs(images_dir, exist_ok=True)
-        print(f"📁 图片保存目录: {images_dir}")
-        
-        # 生成文件名（使用时间戳避免重复）
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"generated_image_{timestamp}.png"
-        filepath = os.path.join(images_dir, filename)
-        print(f"💾 准备保存图片: {filename}")
-        
-        # 保存图片
-        with open(filepath, "wb") as f:
-            f.write(image_data)
-        print(f"✅ 图片保存成功: {filepath}")
+        seedream_breaker.check()
+    except CircuitOpenError as e:
+        print(f"⚡ 豆包文生图已熔断，直接返回: {str(e)}")
+        return seedream_breaker.error_response(e)
+    
+    if quality not in IMAGE_QUALITY_TIERS:
+        quality = DEFAULT_QUALITY_TIER
+    size = IMAGE_QUALITY_TIERS[quality]
+    
+    print(f"🎨 收到图片生成请求: {len(prompt_list)} 个描述 x {n} 张, 尺寸: {size}, 首个描述: {prompt_list[0][:100]}...")
+    try:
+        jobs = [job_store.create(p, size=size, quality=quality) for p in prompt_list for _ in range(n)]
+        start_job_worker([job["job_id"] for job in jobs])
+        print(f"🚀 图片生成任务已提交: {[job['job_id'] for job in jobs]}")
+        await ctx.report_progress(0, len(jobs), f"已提交 {len(jobs)} 个图片生成任务")
         
+        responses = [dict(job_to_response(job), message="图片生成任务已提交") for job in jobs]
+        if len(responses) == 1:
+            return json.dumps(responses[0], ensure_ascii=False)
         return json.dumps({
-            "status": "success",
-            "message": "图片生成成功",
-            "filepath": filepath,
-            "filename": filename,
-            "web_path": f"/static/generated_images/{filename}",
-            "prompt": prompt
+            "status": "pending",
+            "message": f"已提交 {len(responses)} 个图片生成任务",
+            "images": responses
         }, ensure_ascii=False)
         
     except Exception as e:
@@ -85,5 +249,34 @@ async def generate_image(prompt: str) -> str:
             "message": f"图片生成失败: {str(e)}"
         }, ensure_ascii=False)
 
+@app.tool()
+async def get_image_job(job_id: str, ctx: Context, wait_seconds: int = 0) -> str:
+    """
+    查询图片生成任务的状态，可选择等待任务完成
+    
+    Args:
+        job_id: generate_image返回的任务ID
+        wait_seconds: 最多等待任务完成的秒数，默认0表示立即返回当前状态
+    
+    Returns:
+        任务状态的JSON字符串，完成后包含图片的web_path
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return json.dumps({"status": "error", "message": f"图片生成任务不存在: {job_id}"}, ensure_ascii=False)
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(wait_seconds, 0)
+    while job["status"] not in FINISHED_STATUSES and loop.time() < deadline:
+        await ctx.report_progress(job.get("progress", 0.0), 1, job.get("message"))
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        job = job_store.get(job_id) or job
+    
+    await ctx.report_progress(job.get("progress", 0.0), 1, job.get("message"))
+    return json.dumps(job_to_response(job), ensure_ascii=False)
+
 if __name__ == "__main__":
-    app.run(transport='stdio')
\ No newline at end of file
+    if len(sys.argv) >= 3 and sys.argv[1] == "--run-job":
+        run_image_jobs(sys.argv[2:])
+    else:
+        app.run(transport='stdio')
@@ -1,10 +1,18 @@
 import json
 import os
+import sys
 import httpx
 from datetime import datetime
 from dotenv import load_dotenv
 from mcp.server import FastMCP
 
+# 确保可以从项目根目录导入公共模块
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
 # 加载环境变量
 load_dotenv()
 
@@ -14,6 +22,15 @@ app = FastMCP('text-generator-server')
 # 高德天气API配置
 GAODE_API_KEY = os.getenv("GAODE_API_KEY")
 WEATHER_URL = os.getenv("GAODE_WEATHER_URL", "https://restapi.amap.com/v3/weather/weatherInfo")
+GAODE_TIMEOUT_SECONDS = float(os.getenv("GAODE_TIMEOUT_SECONDS", 5))
+
+# 熔断状态与Web服务共享（与tools.py中的天气查询使用同一个熔断器），高德故障时天气查询立即返回错误而不是等待超时
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "cache/shared_state.sqlite3")
+if not os.path.isabs(SHARED_STATE_DB):
+    SHARED_STATE_DB = os.path.join(PROJECT_ROOT, SHARED_STATE_DB)
+
+# 超过3秒的天气查询视为慢调用
+weather_breaker = CircuitBreaker("gaode_weather", SHARED_STATE_DB, slow_call_seconds=3)
 
 @app.tool()
 async def get_weather(location: str) -> str:
@@ -35,30 +52,35 @@ async def get_weather(location: str) -> str:
     
     try:
         print(f"📡 调用高德天气API，查询城市: {location}")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(WEATHER_URL, params=params)
-            result = response.json()
-            print(f"✅ 高德API响应成功，状态: {result.get('status')}")
-            
-            if result.get("status") == "1" and result.get("count") != "0":
-                weather_data = result["lives"][0]
-                print(f"🌤️ 天气查询成功: {weather_data['province']}{weather_data['city']} - {weather_data['weather']}")
-                return json.dumps({
-                    "status": "success",
-                    "location": f"{weather_data['province']}{weather_data['city']}",
-                    "weather": weather_data["weather"],
-                    "temperature": weather_data["temperature"],
-                    "wind": f"{weather_data['winddirection']}风{weather_data['windpower']}级",
-                    "humidity": f"{weather_data['humidity']}%",
-                    "report_time": weather_data["reporttime"]
-                }, ensure_ascii=False)
-            else:
-                print(f"❌ 未找到城市天气信息: {location}")
-                return json.dumps({
-                    "status": "error", 
-                    "message": "未找到该城市天气信息"
-                }, ensure_ascii=False)
-                
+        with weather_breaker.guard():
+            async with httpx.AsyncClient(timeout=GAODE_TIMEOUT_SECONDS) as client:
+                response = await client.get(WEATHER_URL, params=params)
+                response.raise_for_status()
+        result = response.json()
+        print(f"✅ 高德API响应成功，状态: {result.get('status')}")
+        
+        if result.get("status") == "1" and result.get("count") != "0":
+            weather_data = result["lives"][0]
+            print(f"🌤️ 天气查询成功: {weather_data['province']}{weather_data['city']} - {weather_data['weather']}")
+            return json.dumps({
+                "status": "success",
+                "location": f"{weather_data['province']}{weather_data['city']}",
+                "weather": weather_data["weather"],
+                "temperature": weather_data["temperature"],
+                "wind": f"{weather_data['winddirection']}风{weather_data['windpower']}级",
+                "humidity": f"{weather_data['humidity']}%",
+                "report_time": weather_data["reporttime"]
+            }, ensure_ascii=False)
+        else:
+            print(f"❌ 未找到城市天气信息: {location}")
+            return json.dumps({
+                "status": "error", 
+                "message": "未找到该城市天气信息"
+            }, ensure_ascii=False)
+
+    except CircuitOpenError as e:
+        print(f"⚡ 高德天气熔断中，跳过请求: {e}")
+        return weather_breaker.error_response(e)
     except Exception as e:
         print(f"❌ 天气API请求失败: {str(e)}")
         return json.dumps({
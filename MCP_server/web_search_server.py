@@ -1,9 +1,20 @@
 import json
 import os
-import requests
+import sys
+import httpx
 from dotenv import load_dotenv
 from mcp.server import FastMCP
 
+# 确保可以从项目根目录导入公共模块
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.search_cache import SearchCache
+from utils.page_fetcher import PageCache, PageFetcher
+from utils.search_rerank import rerank_results
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
 # 加载环境变量
 load_dotenv()
 
@@ -12,8 +23,117 @@ app = FastMCP('web-search-server')
 BOCHA_API_KEY = os.getenv("BOCHA_API_KEY")
 BOCHA_API_URL = os.getenv("BOCHA_API_URL", "https://api.bochaai.com/v1/ai-search")
 
+# 搜索缓存目录（各个MCP服务器进程共享，用于跨任务去重）
+SEARCH_CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", "cache/web_search")
+if not os.path.isabs(SEARCH_CACHE_DIR):
+    SEARCH_CACHE_DIR = os.path.join(PROJECT_ROOT, SEARCH_CACHE_DIR)
+
+search_cache = SearchCache(SEARCH_CACHE_DIR)
+
+# 深度搜索的页面正文缓存目录（按内容哈希存储）
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "cache/pages")
+if not os.path.isabs(PAGE_CACHE_DIR):
+    PAGE_CACHE_DIR = os.path.join(PROJECT_ROOT, PAGE_CACHE_DIR)
+
+page_cache = PageCache(PAGE_CACHE_DIR)
+MAX_DEEP_TOP_K = 5
+
+# 熔断状态与Web服务共享，博查AI故障时搜索立即返回错误而不是等待超时
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "cache/shared_state.sqlite3")
+if not os.path.isabs(SHARED_STATE_DB):
+    SHARED_STATE_DB = os.path.join(PROJECT_ROOT, SHARED_STATE_DB)
+
+# 复用连接的异步HTTP客户端，在事件循环中首次使用时创建
+_http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的异步HTTP客户端"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _http_client
+
+class SearchRequestError(Exception):
+    """博查AI搜索返回非200状态码"""
+
+    def __init__(self, status_code: int, details: str):
+        super().__init__(f"搜索请求失败，状态码: {status_code}")
+        self.status_code = status_code
+        self.details = details
+
+def is_search_failure(error: BaseException) -> bool:
+    """请求本身有误（4xx，429除外）不计为博查AI故障"""
+    if isinstance(error, SearchRequestError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+# 超过10秒的搜索视为慢调用
+search_breaker = CircuitBreaker("bocha_search", SHARED_STATE_DB, slow_call_seconds=10,
+                                is_failure=is_search_failure)
+
+async def fetch_bocha_results(query: str, freshness: str) -> list:
+    """调用博查AI搜索API，返回解析后的全部网页结果"""
+    data = {
+        "query": query,
+        "freshness": freshness,
+        "answer": False,
+        "stream": False
+    }
+    
+    print(f"📡 调用博查AI搜索API...")
+    with search_breaker.guard():
+        response = await get_http_client().post(
+            BOCHA_API_URL,
+            headers={"Authorization": f"Bearer {BOCHA_API_KEY}"},
+            json=data
+        )
+        
+        print(f"✅ 博查AI API响应，状态码: {response.status_code}")
+        if response.status_code != 200:
+            raise SearchRequestError(response.status_code, response.text)
+    
+    result = response.json()
+    parsed_results = []
+    
+    for message in result.get("messages", []):
+        if message.get("content_type") == "webpage":
+            content = json.loads(message.get("content", "{}"))
+            web_results = content.get("value", [])
+            
+            for item in web_results:
+                parsed_results.append({
+                    "id": item.get("id", ""),
+                    "title": item.get("name", ""),
+                    "url": item.get("url", ""),
+                    "snippet": item.get("snippet", ""),
+                    "summary": item.get("summary", ""),
+                    "site_name": item.get("siteName", ""),
+                    "date_published": item.get("datePublished")
+                })
+    
+    return parsed_results
+
+async def attach_page_contents(results: list, top_k: int):
+    """并发抓取前top_k个结果的网页正文，写入page_content字段"""
+    urls = [item.get("url", "") for item in results[:top_k]]
+    print(f"📄 深度搜索：并发抓取 {len(urls)} 个网页正文...")
+    fetcher = PageFetcher(get_http_client(), page_cache)
+    pages = await fetcher.fetch_all(urls)
+    
+    fetched_count = 0
+    for item in results[:top_k]:
+        page = pages.get(item.get("url", ""))
+        if page and page.get("text"):
+            item["page_content"] = page["text"]
+            fetched_count += 1
+    print(f"📄 网页正文抓取完成，成功 {fetched_count}/{len(urls)} 个")
+
 @app.tool()
-async def web_search(query: str, freshness: str = "noLimit", max_results: int = 10) -> str:
+async def web_search(query: str, freshness: str = "noLimit", max_results: int = 10,
+                     deep: bool = False, deep_top_k: int = 3) -> str:
     """
     使用博查AI搜索引擎进行网络搜索
     
@@ -21,67 +141,48 @@ async def web_search(query: str, freshness: str = "noLimit", max_results: int =
         query: 搜索查询关键词
         freshness: 搜索结果的时效性限制，可选值：noLimit, pastDay, pastWeek, pastMonth, pastYear
         max_results: 返回的最大结果数量，默认10个，最大50个
+        deep: 是否开启深度搜索，开启后会并发抓取排名靠前的网页正文，适合需要详细资料的调研类任务
+        deep_top_k: 深度搜索时抓取正文的网页数量，默认3个，最大5个
     
     Returns:
-        搜索结果的JSON字符串，包含snippet和summary字段
+        搜索结果的JSON字符串，包含snippet和summary字段，深度搜索时额外包含page_content字段
     """
-    print(f"🔍 收到网页搜索请求: {query} (时效性: {freshness}, 最大结果: {max_results})")
+    print(f"🔍 收到网页搜索请求: {query} (时效性: {freshness}, 最大结果: {max_results}, 深度: {deep})")
     try:
-        data = {
-            "query": query,
-            "freshness": freshness,
-            "answer": False,
-            "stream": False
-        }
-        
-        print(f"📡 调用博查AI搜索API...")
-        response = requests.post(
-            BOCHA_API_URL,
-            headers={"Authorization": f"Bearer {BOCHA_API_KEY}"},
-            json=data,
-            timeout=30
+        all_results, source = await search_cache.get_or_fetch(
+            query, freshness, lambda: fetch_bocha_results(query, freshness)
         )
+        if source == "cache":
+            print(f"♻️ 命中搜索缓存: {query}")
+        elif source == "coalesced":
+            print(f"🔗 复用进行中的相同搜索: {query}")
         
-        print(f"✅ 博查AI API响应，状态码: {response.status_code}")
-        if response.status_code == 200:
-            result = response.json()
-            
-            parsed_results = []
-            
-            for message in result.get("messages", []):
-                if message.get("content_type") == "webpage":
-                    content = json.loads(message.get("content", "{}"))
-                    web_results = content.get("value", [])
-                    
-                    for item in web_results[:max_results]:
-                        search_result = {
-                            "id": item.get("id", ""),
-                            "title": item.get("name", ""),
-                            "url": item.get("url", ""),
-                            "snippet": item.get("snippet", ""),
-                            "summary": item.get("summary", ""),
-                            "site_name": item.get("siteName", ""),
-                            "date_published": item.get("datePublished")
-                        }
-                        parsed_results.append(search_result)
-            
-            print(f"🔍 搜索完成，找到 {len(parsed_results)} 个结果")
-            return json.dumps({
-                "status": "success",
-                "query": query,
-                "total_results": len(parsed_results),
-                "results": parsed_results
-            }, ensure_ascii=False)
-            
-        else:
-            print(f"❌ 搜索请求失败，状态码: {response.status_code}")
-            return json.dumps({
-                "status": "error",
-                "message": f"搜索请求失败，状态码: {response.status_code}",
-                "details": response.text
-            }, ensure_ascii=False)
+        # 按与查询的相关性重排并去除近重复结果
+        ranked_results = rerank_results(query, all_results)
+        if len(ranked_results) < len(all_results):
+            print(f"🧹 去除 {len(all_results) - len(ranked_results)} 个重复结果")
+        parsed_results = [dict(item) for item in ranked_results[:max_results]]
+        if deep and parsed_results:
+            await attach_page_contents(parsed_results, min(max(deep_top_k, 1), MAX_DEEP_TOP_K))
+        print(f"🔍 搜索完成，找到 {len(parsed_results)} 个结果")
+        return json.dumps({
+            "status": "success",
+            "query": query,
+            "total_results": len(parsed_results),
+            "results": parsed_results
+        }, ensure_ascii=False)
             
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError as e:
+        print(f"⚡ 博查AI搜索已熔断，直接返回: {str(e)}")
+        return search_breaker.error_response(e)
+    except SearchRequestError as e:
+        print(f"❌ 搜索请求失败，状态码: {e.status_code}")
+        return json.dumps({
+            "status": "error",
+            "message": str(e),
+            "details": e.details
+        }, ensure_ascii=False)
+    except httpx.HTTPError as e:
         print(f"❌ 网络请求异常: {str(e)}")
         return json.dumps({
             "status": "error",
@@ -95,4 +196,4 @@ async def web_search(query: str, freshness: str = "noLimit", max_results: int =
         }, ensure_ascii=False)
 
 if __name__ == "__main__":
-    app.run(transport='stdio')
\ No newline at end of file
+    app.run(transport='stdio')
@@ -1,22 +1,24 @@
+import asyncio
 import json
 import uuid
 import threading
 import time
 from datetime import datetime
-from config import get_openai_client, DOUBAO_MODEL, SYSTEM_PROMPT, MAX_CONVERSATION_ROUNDS
+from config import get_openai_client, get_async_openai_client, DOUBAO_MODEL, SYSTEM_PROMPT, MAX_CONVERSATION_ROUNDS
 from tools import tools, execute_tool_call
 from conversation import (
     load_conversation, save_conversation, limit_conversation_history,
-    generate_conversation_summary, conversation_summary_cache
+    generate_conversation_summary, conversation_summary_cache, mark_summary_pending
 )
 from utils.timestamp_utils import get_current_timestamp
 from utils.message_utils import create_user_message, create_assistant_message, create_tool_message, create_system_message
 from utils.log_manager import log_info, log_success, log_error, log_agent
 
-def run_agent(user_input, conversation_id=None, mode=None):
-    """运行智能体对话"""
-    client = get_openai_client()
-    
+# 每次对话最多调用模型的轮数，避免无限循环
+MAX_AGENT_ITERATIONS = 10
+
+def _prepare_messages(user_input, conversation_id):
+    """加载对话历史并添加用户消息，新对话立即保存并在后台生成总结，返回（对话ID, 消息列表）"""
     if conversation_id:
         messages = load_conversation(conversation_id)
         # 确保有系统消息
@@ -37,7 +39,7 @@ def run_agent(user_input, conversation_id=None, mode=None):
     
     # 如果是新对话，立即保存并启动总结生成
     if is_new_conversation:
-        conversation_summary_cache[conversation_id] = "..."
+        mark_summary_pending(conversation_id)
         save_conversation(conversation_id, messages)
         
         # 启动异步生成总结
@@ -60,99 +62,144 @@ def run_agent(user_input, conversation_id=None, mode=None):
         thread.daemon = True
         thread.start()
     
-    # 限制最大循环次数，避免无限循环
-    max_iterations = 10
-    iteration_count = 0
+    return conversation_id, messages
+
+def _agent_request(messages):
+    """智能体每一轮的模型请求参数"""
+    return dict(
+        model=DOUBAO_MODEL,
+        messages=messages,
+        tools=tools,
+        tool_choice="auto"
+    )
+
+def _append_response(messages, message):
+    """把模型的回复（及其中的工具调用）添加到消息历史"""
+    # 将OpenAI message对象转换为字典格式，自动添加时间戳
+    # 如果content为空且有工具调用，暂时不创建assistant消息
+    if not message.content and message.tool_calls:
+        # 只有工具调用没有内容时，先不添加assistant消息，等工具执行完再添加
+        pass
+    else:
+        message_dict = create_assistant_message(message.content or "正在处理您的请求...")
     
-    while iteration_count < max_iterations:
-        iteration_count += 1
+    # 如果有工具调用，添加工具调用信息
+    if hasattr(message, 'tool_calls') and message.tool_calls:
+        # 如果content为空，创建带工具调用的assistant消息
+        if not message.content:
+            message_dict = create_assistant_message("")
+        
+        # 将tool_calls对象转换为可序列化的字典格式
+        tool_calls_dict = []
+        for tool_call in message.tool_calls:
+            # 验证工具调用信息是否完整
+            if tool_call.function.name and tool_call.function.name.strip():
+                tool_calls_dict.append({
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments
+                    }
+                })
+        
+        if tool_calls_dict:  # 只有在有有效工具调用时才添加
+            message_dict["tool_calls"] = tool_calls_dict
+            messages.append(message_dict)
+    elif message.content:  # 只有在有内容时才添加普通消息
+        messages.append(message_dict)
+
+def _valid_tool_calls(message):
+    """需要执行的工具调用，跳过工具名为空的调用"""
+    for tool_call in message.tool_calls:
+        # 验证工具调用信息是否完整
+        if not tool_call.function.name or not tool_call.function.name.strip():
+            log_error(f"跳过无效的工具调用，工具名为空: {tool_call.id}")
+            continue
+        yield tool_call
+
+def _tool_error(e):
+    """工具调用失败时返回给模型的错误信息"""
+    return json.dumps({"status": "error", "message": f"工具调用失败: {str(e)}"})
+
+def _finish(conversation_id, messages, message, mode):
+    """保存对话并返回最终回复"""
+    # 如果这是新对话的第一轮，生成AI总结
+    user_messages = [msg for msg in messages if msg['role'] == 'user']
+    if len(user_messages) == 1 and conversation_id not in conversation_summary_cache:
+        first_user_message = user_messages[0]['content']
+        print(f"为新对话生成总结: {conversation_id}")
+        summary = generate_conversation_summary(first_user_message)
+        conversation_summary_cache[conversation_id] = summary
+        save_conversation(conversation_id, messages, summary, mode)
+    else:
+        save_conversation(conversation_id, messages, mode=mode)
+    
+    return {"response": message.content.strip(), "conversation_id": conversation_id, "mode": mode}
+
+def _unavailable(conversation_id, messages, e):
+    save_conversation(conversation_id, messages)
+    return {"response": f"抱歉，AI服务暂时不可用：{str(e)}", "conversation_id": conversation_id}
+
+def _too_many_iterations(conversation_id, messages):
+    save_conversation(conversation_id, messages)
+    return {"response": "抱歉，处理您的请求时出现了问题，请稍后再试。", "conversation_id": conversation_id}
+
+def run_agent(user_input, conversation_id=None, mode=None):
+    """运行智能体对话"""
+    client = get_openai_client()
+    conversation_id, messages = _prepare_messages(user_input, conversation_id)
+    
+    # 限制最大循环次数，避免无限循环
+    for _ in range(MAX_AGENT_ITERATIONS):
         try:
             # 调用模型获取响应
-            response = client.chat.completions.create(
-                model=DOUBAO_MODEL,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto"
-            )
+            response = client.chat.completions.create(**_agent_request(messages))
         except Exception as e:
-            save_conversation(conversation_id, messages)
-            return {"response": f"抱歉，AI服务暂时不可用：{str(e)}", "conversation_id": conversation_id}
+            return _unavailable(conversation_id, messages, e)
         
         message = response.choices[0].message
-        # 将OpenAI message对象转换为字典格式，自动添加时间戳
-        # 如果content为空且有工具调用，暂时不创建assistant消息
-        if not message.content and message.tool_calls:
-            # 只有工具调用没有内容时，先不添加assistant消息，等工具执行完再添加
-            pass
-        else:
-            message_dict = create_assistant_message(message.content or "正在处理您的请求...")
-        
-        # 如果有工具调用，添加工具调用信息
-        if hasattr(message, 'tool_calls') and message.tool_calls:
-            # 如果content为空，创建带工具调用的assistant消息
-            if not message.content:
-                message_dict = create_assistant_message("")
-            
-            # 将tool_calls对象转换为可序列化的字典格式
-            tool_calls_dict = []
-            for tool_call in message.tool_calls:
-                # 验证工具调用信息是否完整
-                if tool_call.function.name and tool_call.function.name.strip():
-                    tool_calls_dict.append({
-                        "id": tool_call.id,
-                        "type": tool_call.type,
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    })
-            
-            if tool_calls_dict:  # 只有在有有效工具调用时才添加
-                message_dict["tool_calls"] = tool_calls_dict
-                messages.append(message_dict)
-        elif message.content:  # 只有在有内容时才添加普通消息
-            messages.append(message_dict)
+        _append_response(messages, message)
         
         # 检查是否需要调用工具
-        if message.tool_calls:
-            for tool_call in message.tool_calls:
-                # 验证工具调用信息是否完整
-                if not tool_call.function.name or not tool_call.function.name.strip():
-                    log_error(f"跳过无效的工具调用，工具名为空: {tool_call.id}")
-                    continue
-                    
-                try:
-                    # 执行工具调用
-                    tool_result = execute_tool_call(tool_call)
-                    
-                    # 添加工具响应到消息历史（自动添加时间戳）
-                    messages.append(create_tool_message(
-                        tool_call.id,
-                        tool_call.function.name,
-                        tool_result
-                    ))
-                except Exception as e:
-                    # 工具调用失败时添加错误信息（自动添加时间戳）
-                    messages.append(create_tool_message(
-                        tool_call.id,
-                        tool_call.function.name,
-                        json.dumps({"status": "error", "message": f"工具调用失败: {str(e)}"})
-                    ))
-        else:
+        if not message.tool_calls:
             # 没有工具调用时返回最终回复
-            # 如果这是新对话的第一轮，生成AI总结
-            user_messages = [msg for msg in messages if msg['role'] == 'user']
-            if len(user_messages) == 1 and conversation_id not in conversation_summary_cache:
-                first_user_message = user_messages[0]['content']
-                print(f"为新对话生成总结: {conversation_id}")
-                summary = generate_conversation_summary(first_user_message)
-                conversation_summary_cache[conversation_id] = summary
-                save_conversation(conversation_id, messages, summary, mode)
-            else:
-                save_conversation(conversation_id, messages, mode=mode)
-            
-            return {"response": message.content.strip(), "conversation_id": conversation_id, "mode": mode}
+            return _finish(conversation_id, messages, message, mode)
+        for tool_call in _valid_tool_calls(message):
+            try:
+                # 执行工具调用
+                tool_result = execute_tool_call(tool_call)
+            except Exception as e:
+                # 工具调用失败时添加错误信息
+                tool_result = _tool_error(e)
+            # 添加工具响应到消息历史（自动添加时间戳）
+            messages.append(create_tool_message(tool_call.id, tool_call.function.name, tool_result))
     
     # 如果超过最大迭代次数，返回错误信息
-    save_conversation(conversation_id, messages)
-    return {"response": "抱歉，处理您的请求时出现了问题，请稍后再试。", "conversation_id": conversation_id}
\ No newline at end of file
+    return _too_many_iterations(conversation_id, messages)
+
+async def run_agent_async(user_input, conversation_id=None, mode=None):
+    """运行智能体对话（ASGI部署）：模型调用在事件循环中通过共享的异步客户端完成，
+    对话文件读写和工具调用（同步的HTTP请求）放到线程池中执行"""
+    client = get_async_openai_client()
+    conversation_id, messages = await asyncio.to_thread(_prepare_messages, user_input, conversation_id)
+    
+    for _ in range(MAX_AGENT_ITERATIONS):
+        try:
+            response = await client.chat.completions.create(**_agent_request(messages))
+        except Exception as e:
+            return await asyncio.to_thread(_unavailable, conversation_id, messages, e)
+        
+        message = response.choices[0].message
+        _append_response(messages, message)
+        
+        if not message.tool_calls:
+            return await asyncio.to_thread(_finish, conversation_id, messages, message, mode)
+        for tool_call in _valid_tool_calls(message):
+            try:
+                tool_result = await asyncio.to_thread(execute_tool_call, tool_call)
+            except Exception as e:
+                tool_result = _tool_error(e)
+            messages.append(create_tool_message(tool_call.id, tool_call.function.name, tool_result))
+    
+    return await asyncio.to_thread(_too_many_iterations, conversation_id, messages)
@@ -0,0 +1,160 @@
+"""
+ASGI部署入口
+在一个长期运行的事件循环中提供与main.py相同的接口：SSE进度推送和日志长轮询以协程实现，不占用线程；
+聊天接口的问题类型判断和智能体模型调用通过进程内共享的异步客户端完成，并发由各服务商的限流器而不是线程数限制；
+其余同步调用（任务拆解、工具调用、数据库读写）放到有上限的线程池中执行；其余接口（页面、静态文件、对话管理等）交给Flask应用处理
+
+运行方式：python asgi.py 或 uvicorn asgi:app --host 0.0.0.0 --port 8070
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import anyio
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from a2wsgi import WSGIMiddleware
+
+from config import ASGI_THREAD_LIMIT, FLASK_DEBUG, FLASK_HOST, FLASK_PORT, PLAN_WORKER_COUNT
+from main import (
+    app as flask_app, handle_chat_async, submit_plan_job, wants_event_stream, plan_job_status, retry_after_headers,
+    plan_job_queue, log_capture, PLAN_JOB_EVENT_POLL_INTERVAL
+)
+from utils.plan_jobs import PlanJobEventCursor
+from utils.task_events import RunningTasks, format_sse, EVENT_HEARTBEAT, HEARTBEAT_INTERVAL
+from utils.log_manager import log_info
+
+# 日志长轮询中检查新日志的间隔（秒）
+LOG_POLL_INTERVAL = 0.1
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 阻塞调用通过anyio或asyncio.to_thread的默认线程池执行，由这里统一限制数量
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_THREAD_LIMIT
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(ASGI_THREAD_LIMIT))
+    log_info(f"ASGI服务已启动，阻塞调用上限: {ASGI_THREAD_LIMIT}")
+    yield
+
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return {}
+
+
+async def plan_job_event_source(job_id: str, after_id: int = 0, cancel_on_disconnect: bool = False):
+    """以SSE格式逐条输出任务进度事件，无新事件时发送心跳，任务结束后关闭；
+    cancel_on_disconnect为True时，客户端在任务结束前断开连接会取消任务"""
+    cursor = PlanJobEventCursor(plan_job_queue, job_id, after_id)
+    running = RunningTasks()
+    idle_seconds = 0.0
+    finished = False
+    try:
+        while True:
+            events, finished = await anyio.to_thread.run_sync(cursor.poll)
+            for item in events:
+                running.track(item['event'], item['data'])
+                yield format_sse(item['event'], item['data'], item['event_id'])
+            if finished:
+                return
+            if events:
+                idle_seconds = 0.0
+                continue
+            await asyncio.sleep(PLAN_JOB_EVENT_POLL_INTERVAL)
+            idle_seconds += PLAN_JOB_EVENT_POLL_INTERVAL
+            if idle_seconds >= HEARTBEAT_INTERVAL:
+                idle_seconds = 0.0
+                yield format_sse(EVENT_HEARTBEAT, running.heartbeat())
+    finally:
+        # 连接断开时协程已被取消，不能再等待线程池，直接写入取消请求
+        if not finished and cancel_on_disconnect and plan_job_queue.request_cancel(job_id):
+            log_info(f"客户端已断开，取消任务 {job_id}")
+
+
+def event_stream_response(job_id: str, after_id: int = 0, cancel_on_disconnect: bool = False) -> StreamingResponse:
+    return StreamingResponse(plan_job_event_source(job_id, after_id, cancel_on_disconnect),
+                             media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def chat(request: Request):
+    """聊天接口：问题类型判断和智能体的模型调用在事件循环中等待，不占用线程；
+    任务拆解和工具调用仍是同步实现，在线程池中执行"""
+    result, status = await handle_chat_async(await read_json(request), request.headers.get('idempotency-key'))
+    return JSONResponse(result, status_code=status, headers=retry_after_headers(result))
+
+
+async def confirm_tasks(request: Request):
+    """确认任务分解结果：提交到后台执行队列，按需直接以SSE推送执行进度，连接断开时取消任务"""
+    data = await read_json(request)
+    result, status = await anyio.to_thread.run_sync(submit_plan_job, data, request.headers.get('idempotency-key'))
+    if status == 202 and wants_event_stream(data, request.headers.get('accept')):
+        # 重复提交的请求接入同一个任务的进度，只有第一次提交的连接断开时取消任务
+        return event_stream_response(result['job_id'], cancel_on_disconnect=not result.get('replayed'))
+    return JSONResponse(result, status_code=status, headers=retry_after_headers(result))
+
+
+async def get_plan_job(request: Request):
+    """查询任务规划的执行状态、已完成的子任务和最终结果"""
+    status = await anyio.to_thread.run_sync(plan_job_status, request.path_params['job_id'])
+    if status is None:
+        return JSONResponse({'status': 'error', 'message': '任务不存在'}, status_code=404)
+    return JSONResponse(status)
+
+
+async def get_plan_job_events(request: Request):
+    """以SSE推送任务规划的执行进度，支持通过Last-Event-ID或after参数断点续传"""
+    job_id = request.path_params['job_id']
+    if await anyio.to_thread.run_sync(plan_job_queue.get, job_id) is None:
+        return JSONResponse({'status': 'error', 'message': '任务不存在'}, status_code=404)
+    try:
+        after_id = int(request.headers.get('last-event-id') or request.query_params.get('after', 0))
+    except ValueError:
+        after_id = 0
+    return event_stream_response(job_id, after_id)
+
+
+async def stream_logs(request: Request):
+    """流式获取新日志（长轮询），等待期间不占用线程，after为客户端已收到的最后一条日志的id"""
+    try:
+        timeout = float(request.query_params.get('timeout', 30.0))
+        after_id = int(request.query_params['after']) if request.query_params.get('after') else None
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        new_logs = await anyio.to_thread.run_sync(log_capture.drain_new_logs, after_id)
+        if new_logs or loop.time() >= deadline:
+            return JSONResponse({'logs': new_logs})
+        await asyncio.sleep(LOG_POLL_INTERVAL)
+
+
+app = Starlette(
+    debug=FLASK_DEBUG,
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/confirm-tasks', confirm_tasks, methods=['POST']),
+        Route('/api/plan-jobs/{job_id}', get_plan_job, methods=['GET']),
+        Route('/api/plan-jobs/{job_id}/events', get_plan_job_events, methods=['GET']),
+        Route('/api/logs/stream', stream_logs, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    if PLAN_WORKER_COUNT > 0:
+        from plan_worker import start_plan_workers
+        start_plan_workers(PLAN_WORKER_COUNT)
+    uvicorn.run(app, host=FLASK_HOST, port=FLASK_PORT)
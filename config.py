@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from utils.llm_governor import AsyncGovernedClient, GovernedClient, get_governor
+from utils.model_router import AsyncRoutedClient, ModelRouter, RoutedClient
+from utils.llm_cache import AsyncCachedClient, LLMResponseCache, CachedClient
 
 # 加载环境变量
 load_dotenv()
@@ -20,9 +23,37 @@ DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL")
 
+# 各模型服务商的限流：每分钟请求数、每分钟token数、同时进行的请求数上限（每个进程单独计算）
+DOUBAO_RPM = int(os.getenv("DOUBAO_RPM", 300))
+DOUBAO_TPM = int(os.getenv("DOUBAO_TPM", 300000))
+DOUBAO_MAX_IN_FLIGHT = int(os.getenv("DOUBAO_MAX_IN_FLIGHT", 20))
+QWEN_RPM = int(os.getenv("QWEN_RPM", 300))
+QWEN_TPM = int(os.getenv("QWEN_TPM", 300000))
+QWEN_MAX_IN_FLIGHT = int(os.getenv("QWEN_MAX_IN_FLIGHT", 10))
+DEEPSEEK_RPM = int(os.getenv("DEEPSEEK_RPM", 300))
+DEEPSEEK_TPM = int(os.getenv("DEEPSEEK_TPM", 300000))
+DEEPSEEK_MAX_IN_FLIGHT = int(os.getenv("DEEPSEEK_MAX_IN_FLIGHT", 10))
+
+# 模型路由：各服务商出错或性能下降时按顺序切换到的等价服务商（逗号分隔，留空则不切换）
+MODEL_FAILOVER_DOUBAO = os.getenv("MODEL_FAILOVER_DOUBAO", "deepseek,qwen")
+MODEL_FAILOVER_QWEN = os.getenv("MODEL_FAILOVER_QWEN", "deepseek,doubao")
+MODEL_FAILOVER_DEEPSEEK = os.getenv("MODEL_FAILOVER_DEEPSEEK", "doubao,qwen")
+# 最近调用的p95延迟超过该值（秒）时视为性能下降，优先使用等价服务商
+MODEL_DEGRADED_P95_SECONDS = float(os.getenv("MODEL_DEGRADED_P95_SECONDS", 30))
+# 支持response_format为json_schema的服务商（逗号分隔），切换或对冲到其他服务商时改用json_object并在提示中给出schema
+MODEL_JSON_SCHEMA_PROVIDERS = os.getenv("MODEL_JSON_SCHEMA_PROVIDERS", "doubao")
+
+# 大模型响应缓存（只缓存低温度、短输出的调用）：内存中的最大条数、有效期（秒）、
+# 磁盘缓存目录（多个工作进程共享，留空则只使用内存）及磁盘中的最大条数
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2048))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 24 * 60 * 60))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "cache/llm_responses")
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", 20000))
+
 # 高德天气API配置
 GAODE_API_KEY = os.getenv("GAODE_API_KEY")
 GAODE_WEATHER_URL = os.getenv("GAODE_WEATHER_URL", "https://restapi.amap.com/v3/weather/weatherInfo")
+GAODE_TIMEOUT_SECONDS = float(os.getenv("GAODE_TIMEOUT_SECONDS", 5))
 
 # 博查AI搜索API配置
 BOCHA_API_KEY = os.getenv("BOCHA_API_KEY")
@@ -31,11 +62,63 @@ BOCHA_API_URL = os.getenv("BOCHA_API_URL", "https://api.bochaai.com/v1/ai-search
 # 生成图片保存路径
 GENERATED_IMAGES_PATH = os.getenv("GENERATED_IMAGES_PATH", "static/generated_images")
 
+# 图片生成任务状态目录
+IMAGE_JOBS_DIR = os.getenv("IMAGE_JOBS_DIR", "cache/image_jobs")
+
+# 任务规划执行队列（SQLite）与后台工作进程数量
+PLAN_JOBS_DB = os.getenv("PLAN_JOBS_DB", "cache/plan_jobs.sqlite3")
+PLAN_WORKER_COUNT = int(os.getenv("PLAN_WORKER_COUNT", 2))
+# 已结束任务的保留时间（秒），超过后由工作进程删除任务及其进度事件
+PLAN_JOB_RETENTION_SECONDS = float(os.getenv("PLAN_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+# 相似计划索引（SQLite）：新问题与已确认计划的问题相似度（0-1）不低于阈值时直接返回该计划，设为0时不使用
+PLAN_INDEX_DB = os.getenv("PLAN_INDEX_DB", "cache/plan_index.sqlite3")
+PLAN_SUGGEST_THRESHOLD = float(os.getenv("PLAN_SUGGEST_THRESHOLD", 0.8))
+
+# 任务执行结果存储：内存上限（字节）、有效期（秒）、内存不足时的落盘目录（留空则不落盘）
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_STORE_TTL = int(os.getenv("RESULT_STORE_TTL", 3600))
+RESULT_STORE_SPILL_DIR = os.getenv("RESULT_STORE_SPILL_DIR", "cache/task_results")
+
+# 任务汇总的时间预算（秒），超时后先返回备用格式的报告，模型汇总完成后再替换；设为0时不限制
+SUMMARY_DEADLINE_SECONDS = float(os.getenv("SUMMARY_DEADLINE_SECONDS", 20))
+
+# 任务规划请求的截止时间（秒，从提交时开始计算，请求中的deadline_seconds只能更短）；设为0时不限制
+PLAN_JOB_DEADLINE_SECONDS = float(os.getenv("PLAN_JOB_DEADLINE_SECONDS", 600))
+# 单个子任务的最长执行时间（秒），超时的子任务标记为timeout，其余任务继续执行
+TASK_TIMEOUT_SECONDS = float(os.getenv("TASK_TIMEOUT_SECONDS", 180))
+
 # Flask应用配置
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "True").lower() == "true"
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", 8070))
 
+# ASGI部署（python asgi.py）：同时执行的阻塞调用（如同步的模型调用）上限
+ASGI_THREAD_LIMIT = int(os.getenv("ASGI_THREAD_LIMIT", 200))
+
+# 请求准入控制：所有请求合计的最大并发数，以及各类别（聊天、任务规划）的并发上限、排队上限和排队超时（秒）
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 32))
+ADMISSION_CHAT_LIMIT = int(os.getenv("ADMISSION_CHAT_LIMIT", 32))
+ADMISSION_CHAT_QUEUE = int(os.getenv("ADMISSION_CHAT_QUEUE", 64))
+ADMISSION_CHAT_TIMEOUT = float(os.getenv("ADMISSION_CHAT_TIMEOUT", 10))
+ADMISSION_PLANNING_LIMIT = int(os.getenv("ADMISSION_PLANNING_LIMIT", 4))
+ADMISSION_PLANNING_QUEUE = int(os.getenv("ADMISSION_PLANNING_QUEUE", 16))
+ADMISSION_PLANNING_TIMEOUT = float(os.getenv("ADMISSION_PLANNING_TIMEOUT", 30))
+# 任务执行的准入：排队中和执行中的任务总数上限，以及单个对话的上限
+PLAN_JOB_MAX_ACTIVE = int(os.getenv("PLAN_JOB_MAX_ACTIVE", 50))
+PLAN_JOB_MAX_PER_CONVERSATION = int(os.getenv("PLAN_JOB_MAX_PER_CONVERSATION", 2))
+
+# 请求幂等：客户端指定Idempotency-Key时保存响应的时间（秒）、由对话ID和请求内容生成键时合并重复提交的时间（秒），
+# 以及重复请求等待第一次请求完成的最长时间（秒）
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 600))
+IDEMPOTENCY_AUTO_TTL = int(os.getenv("IDEMPOTENCY_AUTO_TTL", 30))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 120))
+
+# 生产部署（python serve.py）的Web工作进程数量，默认与CPU核数相同
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", os.cpu_count() or 1))
+# 多进程共享状态（对话标题缓存、日志缓冲区）的SQLite数据库
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "cache/shared_state.sqlite3")
+
 # 对话历史配置
 CONVERSATIONS_DIR = "conversations"
 MAX_CONVERSATION_ROUNDS = 3
@@ -44,31 +127,96 @@ MAX_CONVERSATION_ROUNDS = 3
 SYSTEM_PROMPT = "你是由郭桓君同学开发的通用AI智能体，你的名字是Wynna。你的人设是一个讲话活泼可爱、情商高的小妹妹。你既可以与用户闲聊，也可以进行复杂任务的规划、分配、执行和汇总。你会最大程度的理解用户需求，并尽量满足用户的需求。"
 
 # 初始化OpenAI客户端
-def get_openai_doubao_client():
-    """获取OpenAI客户端实例（豆包）"""
-    return OpenAI(
-        base_url=DOUBAO_BASE_URL,
-        api_key=DOUBAO_API_KEY
+# 客户端经过服务商的限流器，429等错误由限流器重试，因此关闭客户端自身的重试
+def _governed_doubao_client():
+    return GovernedClient(
+        OpenAI(base_url=DOUBAO_BASE_URL, api_key=DOUBAO_API_KEY, max_retries=0),
+        get_governor("doubao", DOUBAO_RPM, DOUBAO_TPM, DOUBAO_MAX_IN_FLIGHT)
     )
 
-def get_openai_qwen_client():
-    """获取OpenAI客户端实例（Qwen）"""
-    return OpenAI(
-        base_url=QWEN_BASE_URL,
-        api_key=QWEN_API_KEY
+def _governed_qwen_client():
+    return GovernedClient(
+        OpenAI(base_url=QWEN_BASE_URL, api_key=QWEN_API_KEY, max_retries=0),
+        get_governor("qwen", QWEN_RPM, QWEN_TPM, QWEN_MAX_IN_FLIGHT)
     )
 
-def get_openai_deepseek_client():
-    """获取OpenAI客户端实例（DeepSeek）"""
-    return OpenAI(
-        base_url=DEEPSEEK_BASE_URL,
-        api_key=DEEPSEEK_API_KEY
+def _governed_deepseek_client():
+    return GovernedClient(
+        OpenAI(base_url=DEEPSEEK_BASE_URL, api_key=DEEPSEEK_API_KEY, max_retries=0),
+        get_governor("deepseek", DEEPSEEK_RPM, DEEPSEEK_TPM, DEEPSEEK_MAX_IN_FLIGHT)
     )
 
+# 异步客户端（ASGI部署的事件循环中使用）与同步客户端共用服务商的限流器
+def _async_governed_doubao_client():
+    return AsyncGovernedClient(
+        AsyncOpenAI(base_url=DOUBAO_BASE_URL, api_key=DOUBAO_API_KEY, max_retries=0),
+        get_governor("doubao", DOUBAO_RPM, DOUBAO_TPM, DOUBAO_MAX_IN_FLIGHT)
+    )
 
-def get_openai_client():
+def _async_governed_qwen_client():
+    return AsyncGovernedClient(
+        AsyncOpenAI(base_url=QWEN_BASE_URL, api_key=QWEN_API_KEY, max_retries=0),
+        get_governor("qwen", QWEN_RPM, QWEN_TPM, QWEN_MAX_IN_FLIGHT)
+    )
+
+def _async_governed_deepseek_client():
+    return AsyncGovernedClient(
+        AsyncOpenAI(base_url=DEEPSEEK_BASE_URL, api_key=DEEPSEEK_API_KEY, max_retries=0),
+        get_governor("deepseek", DEEPSEEK_RPM, DEEPSEEK_TPM, DEEPSEEK_MAX_IN_FLIGHT)
+    )
+
+def _failover_list(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+# 只有配置了API Key的服务商参与路由
+model_router = ModelRouter(
+    providers={
+        name: provider for name, provider, api_key in (
+            ("doubao", (_governed_doubao_client, DOUBAO_MODEL), DOUBAO_API_KEY),
+            ("qwen", (_governed_qwen_client, QWEN_MODEL), QWEN_API_KEY),
+            ("deepseek", (_governed_deepseek_client, DEEPSEEK_MODEL), DEEPSEEK_API_KEY),
+        ) if api_key
+    },
+    failover={
+        "doubao": _failover_list(MODEL_FAILOVER_DOUBAO),
+        "qwen": _failover_list(MODEL_FAILOVER_QWEN),
+        "deepseek": _failover_list(MODEL_FAILOVER_DEEPSEEK),
+    },
+    degraded_p95_seconds=MODEL_DEGRADED_P95_SECONDS,
+    json_schema_providers=_failover_list(MODEL_JSON_SCHEMA_PROVIDERS),
+    async_providers={
+        name: factory for name, factory, api_key in (
+            ("doubao", _async_governed_doubao_client, DOUBAO_API_KEY),
+            ("qwen", _async_governed_qwen_client, QWEN_API_KEY),
+            ("deepseek", _async_governed_deepseek_client, DEEPSEEK_API_KEY),
+        ) if api_key
+    }
+)
+
+llm_cache = LLMResponseCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_DIR or None,
+                             LLM_CACHE_DISK_MAX_ENTRIES)
+
+# 调用先经过响应缓存，未命中时再按服务商路由
+def get_openai_doubao_client(hedge=False):
+    """获取OpenAI客户端实例（豆包），hedge为True时对延迟敏感的调用发起对冲请求"""
+    return CachedClient(RoutedClient(model_router, "doubao", hedge), llm_cache)
+
+def get_openai_qwen_client(hedge=False):
+    """获取OpenAI客户端实例（Qwen）"""
+    return CachedClient(RoutedClient(model_router, "qwen", hedge), llm_cache)
+
+def get_openai_deepseek_client(hedge=False):
+    """获取OpenAI客户端实例（DeepSeek）"""
+    return CachedClient(RoutedClient(model_router, "deepseek", hedge), llm_cache)
+
+
+def get_openai_client(hedge=False):
     """获取OpenAI客户端实例（默认豆包）"""
-    return get_openai_doubao_client()
+    return get_openai_doubao_client(hedge)
+
+def get_async_openai_client(hedge=False):
+    """获取异步客户端实例（默认豆包），各服务商的AsyncOpenAI连接池在进程内共享，只能在ASGI服务的事件循环中使用"""
+    return AsyncCachedClient(AsyncRoutedClient(model_router, "doubao", hedge), llm_cache)
 
 # 确保对话目录存在
 def ensure_conversations_dir():
@@ -1,13 +1,62 @@
 import json
 import os
 import threading
+import time
+import uuid
 from datetime import datetime
-from config import CONVERSATIONS_DIR, get_openai_client, DOUBAO_MODEL
+from config import CONVERSATIONS_DIR, SHARED_STATE_DB, get_openai_client, DOUBAO_MODEL
 from utils.message_utils import merge_messages_preserve_timestamps
 from utils.timestamp_utils import get_current_timestamp
+from utils.shared_state import SharedDict
+
+# 对话总结缓存（保存在共享数据库中，多个工作进程看到相同的标题）
+conversation_summary_cache = SharedDict(SHARED_STATE_DB, "conversation_summary")
+# 标题生成中时返回给前端的占位文本
+SUMMARY_PLACEHOLDER = "..."
+# 标题生成中的占位记录超过该时间（秒）仍未完成，视为生成失败（如进程已退出），下次请求时重新生成
+SUMMARY_PENDING_TIMEOUT = 60
+
+
+def _is_pending(value):
+    """缓存值是否为仍在有效期内的生成中占位记录"""
+    return isinstance(value, dict) and time.time() - value.get("pending_since", 0) < SUMMARY_PENDING_TIMEOUT
+
+
+def _is_summary(value):
+    """缓存值是否为已生成的标题（旧版本写入的占位文本不算）"""
+    return isinstance(value, str) and value != SUMMARY_PLACEHOLDER
+
+
+def get_cached_summary(conversation_id):
+    """读取缓存中已生成的对话标题，不存在或仍在生成时返回None"""
+    value = conversation_summary_cache.get(conversation_id)
+    return value if _is_summary(value) else None
+
+
+def mark_summary_pending(conversation_id):
+    """在缓存中记录标题正在生成（带开始时间），超过SUMMARY_PENDING_TIMEOUT仍未完成时视为未生成"""
+    conversation_summary_cache[conversation_id] = {"pending_since": time.time(), "token": uuid.uuid4().hex}
+
+
+def _claim_summary_generation(conversation_id):
+    """
+    原子地检查并占用标题生成：已有标题或其他请求正在生成时不占用
+
+    Returns:
+        tuple: (已有的标题或None, 是否由本次请求负责生成)
+    """
+    token = uuid.uuid4().hex
+
+    def claim(value):
+        if _is_summary(value) or _is_pending(value):
+            return value
+        return {"pending_since": time.time(), "token": token}
+
+    value = conversation_summary_cache.transform(conversation_id, claim)
+    if _is_summary(value):
+        return value, False
+    return None, value.get("token") == token
 
-# 对话总结缓存
-conversation_summary_cache = {}
 
 def save_conversation(conversation_id, messages, summary=None, mode=None):
     """保存对话历史到文件。保护已有的时间戳不被覆盖"""
@@ -36,11 +85,12 @@ def save_conversation(conversation_id, messages, summary=None, mode=None):
     }
     
     # 保留或更新总结
+    cached_summary = get_cached_summary(conversation_id)
     if summary:
         data["summary"] = summary
-    elif conversation_id in conversation_summary_cache:
-        data["summary"] = conversation_summary_cache[conversation_id]
-    elif "summary" in existing_data:
+    elif cached_summary:
+        data["summary"] = cached_summary
+    elif _is_summary(existing_data.get("summary") if isinstance(existing_data, dict) else None):
         data["summary"] = existing_data["summary"]
     
     # 保留或更新模式信息
@@ -49,9 +99,68 @@ def save_conversation(conversation_id, messages, summary=None, mode=None):
     elif "mode" in existing_data:
         data["mode"] = existing_data["mode"]
     
+    # 保留任务规划记忆
+    if isinstance(existing_data, dict) and "task_memory" in existing_data:
+        data["task_memory"] = existing_data["task_memory"]
+    
     with open(conversation_file, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+def load_task_memory(conversation_id):
+    """读取对话中保存的任务规划记忆（任务分类、依赖关系和执行结果）"""
+    conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
+    if os.path.exists(conversation_file):
+        try:
+            with open(conversation_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data.get("task_memory", {})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取任务记忆失败 {conversation_id}: {e}")
+    return {}
+
+def save_task_memory(conversation_id, task_memory):
+    """将任务规划记忆保存到对话文件中"""
+    conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
+    data = {"messages": []}
+    if os.path.exists(conversation_file):
+        try:
+            with open(conversation_file, 'r', encoding='utf-8') as f:
+                existing_data = json.load(f)
+            data = existing_data if isinstance(existing_data, dict) else {"messages": existing_data}
+        except (OSError, json.JSONDecodeError):
+            pass
+    data["task_memory"] = task_memory
+    
+    tmp_file = f"{conversation_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, conversation_file)
+
+def replace_assistant_message(conversation_id, old_content, new_content):
+    """将对话中最近一条内容为old_content的助手消息替换为new_content，找到并替换时返回True"""
+    conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
+    try:
+        with open(conversation_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"读取对话失败 {conversation_id}: {e}")
+        return False
+    
+    messages = data if isinstance(data, list) else data.get("messages", [])
+    for message in reversed(messages):
+        if message.get("role") == "assistant" and message.get("content") == old_content:
+            message["content"] = new_content
+            break
+    else:
+        return False
+    
+    tmp_file = f"{conversation_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, conversation_file)
+    return True
+
 def load_conversation(conversation_id):
     """从文件加载对话历史"""
     conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
@@ -65,7 +174,7 @@ def load_conversation(conversation_id):
                     return data  # 旧格式
                 elif isinstance(data, dict) and "messages" in data:
                     # 新格式，同时加载总结到缓存
-                    if "summary" in data and conversation_id not in conversation_summary_cache:
+                    if _is_summary(data.get("summary")) and get_cached_summary(conversation_id) is None:
                         conversation_summary_cache[conversation_id] = data["summary"]
                     return data["messages"]
                 else:
@@ -156,8 +265,11 @@ def generate_conversation_summary(user_message):
 def get_conversation_summary(conversation_id, first_user_message):
     """获取对话总结（统一入口）"""
     # 检查缓存
-    if conversation_id in conversation_summary_cache:
-        return conversation_summary_cache[conversation_id]
+    cached = conversation_summary_cache.get(conversation_id)
+    if _is_summary(cached):
+        return cached
+    if _is_pending(cached):
+        return SUMMARY_PLACEHOLDER
     
     # 尝试从文件中加载总结
     conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
@@ -165,14 +277,18 @@ def get_conversation_summary(conversation_id, first_user_message):
         try:
             with open(conversation_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                if isinstance(data, dict) and "summary" in data:
+                if isinstance(data, dict) and _is_summary(data.get("summary")):
                     conversation_summary_cache[conversation_id] = data["summary"]
                     return data["summary"]
         except:
             pass
     
-    # 对于没有总结的对话，返回加载中状态，并启动异步生成
-    conversation_summary_cache[conversation_id] = "..."
+    # 对于没有总结的对话，返回加载中状态，并启动异步生成（已有其他请求在生成时只返回加载中状态）
+    summary, claimed = _claim_summary_generation(conversation_id)
+    if summary:
+        return summary
+    if not claimed:
+        return SUMMARY_PLACEHOLDER
     
     # 异步生成总结
     def generate_summary_async():
@@ -203,7 +319,7 @@ def get_conversation_summary(conversation_id, first_user_message):
     thread.daemon = True
     thread.start()
     
-    return "..."
+    return SUMMARY_PLACEHOLDER
 
 def get_all_conversations():
     """获取所有对话列表"""
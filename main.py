@@ -1,100 +1,504 @@
 import os
+import asyncio
+import re
 import json
 import uuid
-import asyncio
-from functools import wraps
+import mimetypes
+import threading
+import time
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, redirect, Response
+from werkzeug.security import safe_join
 from flask_cors import CORS
 
 # 导入自定义模块
-from config import FLASK_DEBUG, FLASK_HOST, FLASK_PORT, CONVERSATIONS_DIR, ensure_conversations_dir
-from agent import run_agent
-from task_planning import judge_question_type, handle_task_planning, confirm_and_execute_tasks_new
+from config import (
+    FLASK_DEBUG, FLASK_HOST, FLASK_PORT, CONVERSATIONS_DIR, IMAGE_JOBS_DIR, PLAN_JOBS_DB, PLAN_WORKER_COUNT, SHARED_STATE_DB,
+    ADMISSION_MAX_CONCURRENT, ADMISSION_CHAT_LIMIT, ADMISSION_CHAT_QUEUE, ADMISSION_CHAT_TIMEOUT,
+    ADMISSION_PLANNING_LIMIT, ADMISSION_PLANNING_QUEUE, ADMISSION_PLANNING_TIMEOUT,
+    PLAN_JOB_MAX_ACTIVE, PLAN_JOB_MAX_PER_CONVERSATION, PLAN_JOB_DEADLINE_SECONDS, PLAN_INDEX_DB,
+    PLAN_SUGGEST_THRESHOLD, IDEMPOTENCY_TTL, IDEMPOTENCY_AUTO_TTL, IDEMPOTENCY_WAIT_SECONDS, ensure_conversations_dir
+)
+from agent import run_agent, run_agent_async
+from task_planning import judge_question_type, judge_question_type_async, handle_task_planning
 from conversation import (
     get_all_conversations, load_conversation, save_conversation, 
     delete_conversation_from_cache
 )
-from utils.log_manager import init_log_capture, get_log_capture
+from utils.log_manager import init_log_capture, get_log_capture, log_info, log_error
+from utils.shared_state import LogRing
+from utils.admission import AdmissionController, AdmissionRejected, CLASS_CHAT, CLASS_PLANNING
+from utils.llm_governor import get_governor_stats
+from config import model_router, llm_cache
+from utils.circuit_breaker import get_breaker_states
+from utils.image_jobs import ImageJobStore, JOB_SUCCESS, JOB_ERROR
+from utils.task_events import TaskEventStream, EVENT_JOB_QUEUED
+from utils.plan_jobs import PlanJobQueue, PlanJobEventCursor
+from utils.plan_index import PlanIndex
+from utils.idempotency import IdempotencyStore, IdempotencyConflict, IdempotencyKeyMismatch, derive_key, client_key, \
+    fingerprint
+from utils.asset_pipeline import build_assets, asset_url, DIST_DIR_NAME
 
-# 初始化Flask应用
-app = Flask(__name__)
+# 初始化Flask应用（静态文件由下方路由统一处理缓存策略）
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
+# 处理静态资源（内容哈希、预压缩、WebP），供模板通过asset_url引用
+try:
+    build_assets()
+except Exception as e:
+    log_error(f"静态资源处理失败，将使用原始文件: {e}")
+app.jinja_env.globals['asset_url'] = asset_url
+
+# 静态资源缓存策略
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+CONTENT_HASH_PATTERN = re.compile(r'(?:^|/|\.)([0-9a-f]{10,64})\.\w+$')
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
 # 确保对话目录存在
 ensure_conversations_dir()
 
 # 初始化日志捕获系统
-log_capture = init_log_capture()
+log_capture = init_log_capture(LogRing(SHARED_STATE_DB))
+
+# 图片生成任务存储
+image_job_store = ImageJobStore(IMAGE_JOBS_DIR)
 
-def async_route(f):
-    """装饰器：让Flask支持async路由"""
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-    return wrapper
+# 任务规划执行队列（由plan_worker中的工作进程执行）
+plan_job_queue = PlanJobQueue(PLAN_JOBS_DB)
+# 执行进度事件的轮询间隔（秒）
+PLAN_JOB_EVENT_POLL_INTERVAL = 0.5
+
+# 已确认计划的相似问题索引，相似的规划问题直接返回之前确认过的计划
+plan_index = PlanIndex(PLAN_INDEX_DB, PLAN_SUGGEST_THRESHOLD)
+
+# 请求幂等：重复提交的聊天消息和计划等待或直接返回第一次请求的响应
+idempotency = IdempotencyStore(SHARED_STATE_DB, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT_SECONDS)
+
+# 请求准入控制：聊天优先于任务规划，避免任务规划的突发请求拖慢聊天
+admission = AdmissionController(ADMISSION_MAX_CONCURRENT, [
+    {"name": CLASS_CHAT, "limit": ADMISSION_CHAT_LIMIT, "max_queue": ADMISSION_CHAT_QUEUE,
+     "queue_timeout": ADMISSION_CHAT_TIMEOUT},
+    {"name": CLASS_PLANNING, "limit": ADMISSION_PLANNING_LIMIT, "max_queue": ADMISSION_PLANNING_QUEUE,
+     "queue_timeout": ADMISSION_PLANNING_TIMEOUT},
+])
+
+# 图片生成中的占位图
+IMAGE_PENDING_SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="512" height="512" viewBox="0 0 512 512">
+<rect width="512" height="512" fill="#f3f4f6"/>
+<text x="256" y="256" font-size="28" text-anchor="middle" fill="#6b7280" font-family="sans-serif">{text}</text>
+</svg>"""
 
 # Flask路由定义
 @app.route('/')
 def home():
     return render_template('index.html')
 
+def send_static_asset(directory, filename, immutable=False):
+    """发送静态文件：优先使用预压缩版本，支持条件请求和Range请求"""
+    mimetype = mimetypes.guess_type(filename)[0]
+    etag = True
+    if immutable:
+        # 文件名包含内容哈希时直接用哈希作为强ETag
+        match = CONTENT_HASH_PATTERN.search(filename)
+        if match:
+            etag = match.group(1)
+    
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    has_variants = False
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        variant_path = safe_join(directory, filename + suffix)
+        if not variant_path or not os.path.isfile(variant_path):
+            continue
+        has_variants = True
+        if encoding in accept_encoding:
+            response = send_from_directory(
+                directory, filename + suffix, mimetype=mimetype, conditional=True,
+                etag=f"{etag}-{encoding}" if isinstance(etag, str) else True
+            )
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype, conditional=True, etag=etag)
+    
+    if has_variants:
+        response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    return response
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
-    return send_from_directory('static', filename)
+    # dist目录下的文件名包含内容哈希，可以长期缓存
+    return send_static_asset('static', filename, immutable=filename.startswith(f"{DIST_DIR_NAME}/"))
 
 @app.route('/static/generated_images/<path:filename>')
 def generated_images(filename):
-    return send_from_directory('static/generated_images', filename)
+    # 生成的图片写入后不会再修改
+    return send_static_asset('static/generated_images', filename, immutable=True)
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """聊天接口"""
-    data = request.json
-    user_input = data.get('message', '')
-    conversation_id = data.get('conversation_id')
+@app.route('/api/image-jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """查询图片生成任务状态"""
+    job = image_job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': '图片生成任务不存在'}), 404
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'progress': job.get('progress', 0.0),
+        'message': job.get('message', ''),
+        'web_path': job.get('web_path'),
+        'thumbnail_path': job.get('thumbnail_path'),
+        'filename': job.get('filename')
+    })
+
+@app.route('/api/image-jobs/<job_id>/image', methods=['GET'])
+def get_image_job_image(job_id):
+    """图片生成完成后重定向到图片文件，未完成时返回占位图"""
+    job = image_job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': '图片生成任务不存在'}), 404
+    if job['status'] == JOB_SUCCESS and job.get('web_path'):
+        return redirect(job['web_path'])
+    text = '图片生成失败' if job['status'] == JOB_ERROR else '图片生成中...'
+    response = Response(IMAGE_PENDING_SVG.format(text=text), mimetype='image/svg+xml')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def idempotency_key_for(scope, idempotency_key, payload, merge_identical):
+    """请求的幂等键和响应保存时间，不需要幂等处理时返回（None, None）"""
+    if idempotency_key:
+        return client_key(scope, idempotency_key), None
+    if merge_identical:
+        return derive_key(scope, *payload), IDEMPOTENCY_AUTO_TTL
+    return None, None
+
+def idempotent_response(key, result, status, replayed):
+    if replayed:
+        log_info(f"重复请求，返回已有的响应: {key}")
+        result = {**result, 'replayed': True}
+    return result, status
+
+def run_idempotent(scope, idempotency_key, payload, compute, merge_identical=True):
+    """按幂等键执行请求，返回（响应数据, HTTP状态码），重复请求的响应中replayed为true
+    
+    客户端指定了Idempotency-Key时使用该键，响应保存IDEMPOTENCY_TTL秒，同一个键用于内容不同的请求时返回422；
+    否则merge_identical为True时由payload（对话ID和请求内容）生成键，只在IDEMPOTENCY_AUTO_TTL秒内合并重复提交"""
+    key, ttl = idempotency_key_for(scope, idempotency_key, payload, merge_identical)
+    if key is None:
+        return compute()
+    
+    try:
+        return idempotent_response(key, *idempotency.run(key, compute, ttl, fingerprint(*payload)))
+    except IdempotencyConflict as e:
+        return {'error': str(e), 'retry_after': int(e.retry_after)}, 409
+    except IdempotencyKeyMismatch as e:
+        return {'error': str(e)}, 422
+
+async def run_idempotent_async(scope, idempotency_key, payload, compute, merge_identical=True):
+    """run_idempotent的异步版本，compute为协程函数"""
+    key, ttl = idempotency_key_for(scope, idempotency_key, payload, merge_identical)
+    if key is None:
+        return await compute()
     
+    try:
+        return idempotent_response(key, *await idempotency.run_async(key, compute, ttl, fingerprint(*payload)))
+    except IdempotencyConflict as e:
+        return {'error': str(e), 'retry_after': int(e.retry_after)}, 409
+    except IdempotencyKeyMismatch as e:
+        return {'error': str(e)}, 422
+
+def chat_request(data):
+    """聊天请求的（消息, 对话ID, 是否重新拆解），消息为空时返回None"""
+    user_input = data.get('message', '')
     if not user_input:
-        return jsonify({'error': '消息不能为空'}), 400
+        return None
+    # fresh_plan: 不使用相似问题的计划，重新拆解
+    return user_input, data.get('conversation_id'), bool(data.get('fresh_plan'))
+
+def handle_chat(data, idempotency_key=None):
+    """处理聊天请求，返回（响应数据, HTTP状态码）
     
+    同一对话中重复发送的相同消息（或相同的Idempotency-Key）只处理一次"""
+    chat_args = chat_request(data)
+    if chat_args is None:
+        return {'error': '消息不能为空'}, 400
+    user_input, conversation_id, fresh_plan = chat_args
+    
+    # 新对话没有对话ID，不同标签页的相同消息属于不同对话，不合并
+    return run_idempotent('chat', idempotency_key, (conversation_id, user_input, fresh_plan),
+                          lambda: process_chat(user_input, conversation_id, fresh_plan),
+                          merge_identical=bool(conversation_id))
+
+async def handle_chat_async(data, idempotency_key=None):
+    """handle_chat的异步版本，供ASGI部署的事件循环使用"""
+    chat_args = chat_request(data)
+    if chat_args is None:
+        return {'error': '消息不能为空'}, 400
+    user_input, conversation_id, fresh_plan = chat_args
+    
+    return await run_idempotent_async('chat', idempotency_key, (conversation_id, user_input, fresh_plan),
+                                      lambda: process_chat_async(user_input, conversation_id, fresh_plan),
+                                      merge_identical=bool(conversation_id))
+
+def process_chat(user_input, conversation_id, fresh_plan):
+    """判断问题类型并按聊天或任务规划模式处理，返回（响应数据, HTTP状态码）"""
     try:
-        # 首先判断问题类型
-        question_type = judge_question_type(user_input)
+        # 相似问题已有确认过的计划时直接进入任务规划模式，否则先判断问题类型
+        suggestion = None
+        if not fresh_plan and PLAN_SUGGEST_THRESHOLD > 0:
+            suggestion = plan_index.find(user_input)
+        question_type = "taskPlanning" if fresh_plan or suggestion else judge_question_type(user_input)
         
         if question_type == "taskPlanning":
             # 任务规划模式
-            result = handle_task_planning(user_input, conversation_id)
+            with admission.admit(CLASS_PLANNING, conversation_id):
+                result = handle_task_planning(user_input, conversation_id, suggestion)
         else:
             # chatBot模式
-            result = run_agent(user_input, conversation_id, mode=question_type)
+            with admission.admit(CLASS_CHAT, conversation_id):
+                result = run_agent(user_input, conversation_id, mode=question_type)
         
         # 添加模式信息到返回结果
         result['mode'] = question_type
-        return jsonify(result)
+        return result, 200
+    except AdmissionRejected as e:
+        return {'error': str(e), 'retry_after': e.retry_after}, e.status_code
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
-@app.route('/api/confirm-tasks', methods=['POST'])
-@async_route
-async def confirm_tasks():
-    """确认任务分解结果"""
-    data = request.json
+async def process_chat_async(user_input, conversation_id, fresh_plan):
+    """process_chat的异步版本：问题类型判断和智能体的模型调用通过共享的异步客户端在事件循环中完成，
+    任务拆解（handle_task_planning）仍是同步实现，放到线程池中执行"""
+    try:
+        suggestion = None
+        if not fresh_plan and PLAN_SUGGEST_THRESHOLD > 0:
+            suggestion = await asyncio.to_thread(plan_index.find, user_input)
+        question_type = "taskPlanning" if fresh_plan or suggestion else await judge_question_type_async(user_input)
+        
+        if question_type == "taskPlanning":
+            async with admission.admit_async(CLASS_PLANNING, conversation_id):
+                result = await asyncio.to_thread(handle_task_planning, user_input, conversation_id, suggestion)
+        else:
+            async with admission.admit_async(CLASS_CHAT, conversation_id):
+                result = await run_agent_async(user_input, conversation_id, mode=question_type)
+        
+        result['mode'] = question_type
+        return result, 200
+    except AdmissionRejected as e:
+        return {'error': str(e), 'retry_after': e.retry_after}, e.status_code
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+def retry_after_headers(result):
+    """被准入控制拒绝时告知客户端多久后重试"""
+    return {'Retry-After': str(result['retry_after'])} if 'retry_after' in result else {}
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """聊天接口"""
+    result, status = handle_chat(request.json, request.headers.get('Idempotency-Key'))
+    return jsonify(result), status, retry_after_headers(result)
+
+def stream_plan_job_events(job_id, after_id=0, cancel_on_disconnect=False):
+    """以SSE格式推送任务规划的执行进度，事件从队列数据库中读取，任务结束后关闭
+    
+    汇总超时先返回备用格式时，继续等待后台汇总完成的summary_ready事件；
+    cancel_on_disconnect为True时，客户端在任务结束前断开连接会取消任务"""
+    stream = TaskEventStream()
+    cursor = PlanJobEventCursor(plan_job_queue, job_id, after_id)
+    
+    def feed():
+        finished = False
+        while not stream.closed:
+            events, finished = cursor.poll()
+            for item in events:
+                stream.emit(item['event'], item['data'], item['event_id'])
+            if finished:
+                break
+            if not events:
+                time.sleep(PLAN_JOB_EVENT_POLL_INTERVAL)
+        if not finished and cancel_on_disconnect and plan_job_queue.request_cancel(job_id):
+            log_info(f"客户端已断开，取消任务 {job_id}")
+        stream.close()
+    
+    threading.Thread(target=feed, name=f'plan-job-events-{job_id[:8]}', daemon=True).start()
+    response = Response(stream.iter_sse(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def submit_plan_job(data, idempotency_key=None):
+    """提交确认后的任务到执行队列，返回（响应数据, HTTP状态码），提交成功时状态码为202
+    
+    重复提交的相同计划（或相同的Idempotency-Key）不再创建新任务，返回第一次提交的任务"""
+    conversation_id = data.get('conversation_id')
+    payload = (conversation_id, data.get('original_question', ''), data.get('tasks', []),
+               data.get('modified_todo_content'), bool(data.get('force_refresh')))
+    return run_idempotent('confirm-tasks', idempotency_key, payload, lambda: enqueue_plan_job(data),
+                          merge_identical=bool(conversation_id))
+
+def enqueue_plan_job(data):
+    """检查参数和排队的任务数量后写入执行队列，返回（响应数据, HTTP状态码）"""
     conversation_id = data.get('conversation_id')
     confirmed_tasks = data.get('tasks', [])
     original_question = data.get('original_question', '')
     modified_todo_content = data.get('modified_todo_content')  # 获取用户修改后的todo内容
+    force_refresh = bool(data.get('force_refresh'))  # 忽略之前的执行结果，全部重新执行
     
     if not conversation_id or not confirmed_tasks:
-        return jsonify({'error': '参数不完整'}), 400
+        return {'error': '参数不完整'}, 400
+    
+    # 请求的截止时间，客户端只能在配置的上限内缩短
+    try:
+        deadline_seconds = float(data.get('deadline_seconds') or PLAN_JOB_DEADLINE_SECONDS)
+    except (TypeError, ValueError):
+        return {'error': 'deadline_seconds参数无效'}, 400
+    if PLAN_JOB_DEADLINE_SECONDS > 0:
+        deadline_seconds = min(deadline_seconds, PLAN_JOB_DEADLINE_SECONDS)
+    deadline_at = time.time() + deadline_seconds if deadline_seconds > 0 else None
+    
+    # 任务执行由后台工作进程完成，这里限制排队的任务数量
+    if plan_job_queue.count_active(conversation_id) >= PLAN_JOB_MAX_PER_CONVERSATION:
+        return {'error': '该对话已有任务正在执行，请等待完成后再提交', 'retry_after': 10}, 429
+    if plan_job_queue.count_active() >= PLAN_JOB_MAX_ACTIVE:
+        return {'error': '服务繁忙，请稍后再试', 'retry_after': 30}, 503
     
     try:
-        result = await confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, original_question, modified_todo_content)
-        return jsonify(result)
+        job = plan_job_queue.enqueue(conversation_id, confirmed_tasks, original_question, modified_todo_content,
+                                     force_refresh, deadline_at)
     except Exception as e:
-        print(f"确认任务执行错误: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'确认任务时出现错误: {str(e)}'}), 500
+        log_error(f"提交任务执行错误: {e}")
+        return {'error': f'确认任务时出现错误: {str(e)}'}, 500
+    
+    job_id = job['job_id']
+    plan_job_queue.add_event(job_id, EVENT_JOB_QUEUED, {'job_id': job_id, 'task_count': len(confirmed_tasks)})
+    
+    # 用户确认（含编辑后确认）的计划加入相似计划索引
+    if PLAN_SUGGEST_THRESHOLD > 0 and original_question:
+        todo_content = modified_todo_content or "# TODO\n\n" + "".join(
+            f"{i}. {task}\n" for i, task in enumerate(confirmed_tasks, 1))
+        try:
+            plan_index.add(original_question, todo_content)
+        except Exception as e:
+            log_error(f"保存计划到相似计划索引失败: {e}")
+    return {
+        'job_id': job_id,
+        'conversation_id': conversation_id,
+        'mode': 'taskPlanning',
+        'status': job['status'],
+        'status_url': f'/api/plan-jobs/{job_id}',
+        'events_url': f'/api/plan-jobs/{job_id}/events',
+        'cancel_url': f'/api/plan-jobs/{job_id}/cancel',
+        'deadline_at': deadline_at
+    }, 202
+
+def wants_event_stream(data, accept):
+    """请求体中stream为true或Accept为text/event-stream时以SSE推送执行进度"""
+    return bool(data.get('stream')) or 'text/event-stream' in (accept or '')
+
+def plan_job_status(job_id):
+    """任务规划的执行状态、已完成的子任务和最终结果，任务不存在时返回None"""
+    job = plan_job_queue.get(job_id)
+    if job is None:
+        return None
+    
+    task_results = plan_job_queue.get_task_results(job_id)
+    return {
+        'job_id': job_id,
+        'conversation_id': job['conversation_id'],
+        'status': job['status'],
+        'cancel_requested': job['cancel_requested'],
+        'deadline_at': job['deadline_at'],
+        'attempts': job['attempts'],
+        'total_tasks': len(job['tasks']),
+        'completed_tasks': [
+            {'task_number': number, 'todo': result.get('todo', ''), 'status': result.get('status', '')}
+            for number, result in sorted(task_results.items())
+        ],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    }
+
+@app.route('/api/confirm-tasks', methods=['POST'])
+def confirm_tasks():
+    """确认任务分解结果：提交到后台执行队列并立即返回任务ID
+    
+    请求体中stream为true或Accept为text/event-stream时，直接以SSE推送执行进度，连接断开时取消任务"""
+    data = request.json
+    result, status = submit_plan_job(data, request.headers.get('Idempotency-Key'))
+    if status == 202 and wants_event_stream(data, request.headers.get('Accept')):
+        # 重复提交的请求接入同一个任务的进度，只有第一次提交的连接断开时取消任务
+        return stream_plan_job_events(result['job_id'], cancel_on_disconnect=not result.get('replayed'))
+    return jsonify(result), status, retry_after_headers(result)
+
+@app.route('/api/admission', methods=['GET'])
+def get_admission_stats():
+    """查询准入控制的执行、排队和拒绝情况"""
+    stats = admission.stats()
+    stats['plan_jobs'] = {'active': plan_job_queue.count_active(), 'max_active': PLAN_JOB_MAX_ACTIVE}
+    return jsonify(stats)
+
+@app.route('/api/llm/governors', methods=['GET'])
+def get_llm_governors():
+    """查询各模型服务商限流器的排队和限流情况（当前进程）"""
+    return jsonify(get_governor_stats())
+
+@app.route('/api/llm/routes', methods=['GET'])
+def get_llm_routes():
+    """查询各服务商和模型的延迟、错误率及是否性能下降（当前进程）"""
+    return jsonify(model_router.stats())
+
+@app.route('/api/llm/cache', methods=['GET'])
+def get_llm_cache_stats():
+    """查询大模型响应缓存的命中率、淘汰和跳过缓存的次数（当前进程）"""
+    return jsonify(llm_cache.stats())
+
+@app.route('/api/plan-index', methods=['GET'])
+def get_plan_index_stats():
+    """查询相似计划索引的计划数量和命中率（命中率为当前进程）"""
+    return jsonify(plan_index.stats())
+
+@app.route('/api/idempotency', methods=['GET'])
+def get_idempotency_stats():
+    """查询重复请求的合并情况：执行、直接返回保存的响应、等待执行中请求的次数（当前进程）"""
+    return jsonify(idempotency.stats())
+
+@app.route('/api/circuit-breakers', methods=['GET'])
+def get_circuit_breakers():
+    """查询外部依赖（高德天气、博查搜索、豆包文生图）的熔断状态，所有进程共享"""
+    return jsonify(get_breaker_states(SHARED_STATE_DB))
+
+@app.route('/api/plan-jobs/<job_id>', methods=['GET'])
+def get_plan_job(job_id):
+    """查询任务规划的执行状态、已完成的子任务和最终结果"""
+    status = plan_job_status(job_id)
+    if status is None:
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+    return jsonify(status)
+
+@app.route('/api/plan-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_plan_job(job_id):
+    """取消任务规划：未完成的子任务停止执行，已完成的结果仍会汇总返回"""
+    if plan_job_queue.get(job_id) is None:
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+    if not plan_job_queue.request_cancel(job_id):
+        return jsonify({'status': 'error', 'message': '任务已结束'}), 409
+    return jsonify({'status': 'success', 'job_id': job_id})
+
+@app.route('/api/plan-jobs/<job_id>/events', methods=['GET'])
+def get_plan_job_events(job_id):
+    """以SSE推送任务规划的执行进度，支持通过Last-Event-ID或after参数断点续传"""
+    if plan_job_queue.get(job_id) is None:
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+    try:
+        after_id = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after_id = 0
+    return stream_plan_job_events(job_id, after_id)
 
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
@@ -219,10 +623,11 @@ def get_recent_logs():
 
 @app.route('/api/logs/stream', methods=['GET'])
 def stream_logs():
-    """流式获取新日志（长轮询）"""
+    """流式获取新日志（长轮询），after为客户端已收到的最后一条日志的id"""
     try:
         timeout = float(request.args.get('timeout', 30.0))
-        new_logs = log_capture.get_new_logs(timeout)
+        after_id = request.args.get('after', type=int)
+        new_logs = log_capture.get_new_logs(timeout, after_id)
         return jsonify({'logs': new_logs})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -238,6 +643,10 @@ def clear_logs():
 
 # 运行Flask应用
 if __name__ == "__main__":
+    # 调试模式下只在重载后的子进程中启动工作进程，避免重复启动
+    if PLAN_WORKER_COUNT > 0 and (not FLASK_DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        from plan_worker import start_plan_workers
+        start_plan_workers(PLAN_WORKER_COUNT)
     app.run(
         debug=FLASK_DEBUG,
         host=FLASK_HOST,
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List
+
+from config import PLAN_JOBS_DB, PLAN_JOB_RETENTION_SECONDS, PLAN_WORKER_COUNT, SHARED_STATE_DB
+from task_planning import confirm_and_execute_tasks_new
+from utils.plan_jobs import PlanJobQueue, PLAN_JOB_SUCCESS, PLAN_JOB_ERROR
+from utils.task_events import EVENT_DONE, EVENT_ERROR, EVENT_SUMMARY_READY
+from utils.log_manager import init_log_capture, log_info, log_success, log_error, log_task
+from utils.shared_state import LogRing
+from utils.deadline import Deadline
+
+# 没有待执行任务时的轮询间隔（秒）
+PLAN_JOB_POLL_INTERVAL = 1.0
+# 执行任务期间发送心跳的间隔（秒），需明显小于队列的租约时间
+PLAN_JOB_HEARTBEAT_INTERVAL = 10.0
+# 执行任务期间检查取消请求的间隔（秒）
+PLAN_JOB_CANCEL_POLL_INTERVAL = 1.0
+# 清理已结束任务的间隔（秒）
+PLAN_JOB_PURGE_INTERVAL = 600.0
+
+
+def _start_heartbeat(queue: PlanJobQueue, job_id: str, worker_id: str, deadline: Deadline) -> threading.Event:
+    """在后台线程中定期刷新任务心跳，收到取消请求时取消deadline，返回用于停止心跳的事件"""
+    stop = threading.Event()
+
+    def beat():
+        last_beat = time.monotonic()
+        while not stop.wait(PLAN_JOB_CANCEL_POLL_INTERVAL):
+            if not deadline.cancelled and queue.is_cancel_requested(job_id):
+                log_info(f"任务 {job_id} 已被取消，停止未完成的子任务")
+                deadline.cancel()
+            if time.monotonic() - last_beat < PLAN_JOB_HEARTBEAT_INTERVAL:
+                continue
+            last_beat = time.monotonic()
+            if not queue.heartbeat(job_id, worker_id):
+                log_error(f"任务 {job_id} 已被其他工作进程接手")
+                return
+
+    threading.Thread(target=beat, name=f"heartbeat-{job_id[:8]}", daemon=True).start()
+    return stop
+
+
+def run_plan_job(queue: PlanJobQueue, job: Dict[str, Any], worker_id: str):
+    """
+    执行一个任务规划，已保存检查点的子任务直接复用结果
+
+    Args:
+        queue: 任务队列
+        job: 领取到的任务
+        worker_id: 工作进程标识
+    """
+    job_id = job["job_id"]
+    completed_results = queue.get_task_results(job_id)
+    if completed_results:
+        log_task(f"恢复执行任务 {job_id}，已完成 {len(completed_results)} 个子任务")
+    else:
+        log_task(f"开始执行任务 {job_id}，共 {len(job['tasks'])} 个子任务")
+
+    # 汇总超时后模型汇总在后台完成，需等任务结果写入后再替换
+    job_finished = threading.Event()
+    
+    def on_event(event, data):
+        if event == EVENT_SUMMARY_READY:
+            job_finished.wait(timeout=60)
+            task_summary = {**((queue.get(job_id) or {}).get("result") or {}).get("task_summary", {}),
+                            "summary_mode": "llm", "summary_seconds": data.get("summary_seconds")}
+            queue.update_result(job_id, {"response": data.get("response", ""), "summary_pending": False,
+                                         "task_summary": task_summary})
+        queue.add_event(job_id, event, data)
+    
+    # 截止时间从请求提交时开始计算，崩溃后由其他进程接手时同样适用
+    deadline = Deadline(job["deadline_at"])
+    if job["cancel_requested"]:
+        deadline.cancel()
+    stop_heartbeat = _start_heartbeat(queue, job_id, worker_id, deadline)
+    try:
+        result = asyncio.run(confirm_and_execute_tasks_new(
+            job["conversation_id"], job["tasks"], job["original_question"], job["modified_todo_content"],
+            on_event=on_event,
+            completed_results=completed_results,
+            on_result=lambda task_number, task_result: queue.save_task_result(job_id, task_number, task_result),
+            force_refresh=job["force_refresh"],
+            deadline=deadline
+        ))
+    except Exception as e:
+        log_error(f"任务 {job_id} 执行失败: {e}")
+        queue.finish(job_id, PLAN_JOB_ERROR, error=str(e))
+        queue.add_event(job_id, EVENT_ERROR, {"error": f"确认任务时出现错误: {str(e)}"})
+        return
+    finally:
+        stop_heartbeat.set()
+
+    if result.get("status") == "error":
+        queue.finish(job_id, PLAN_JOB_ERROR, result=result, error=result.get("response"))
+        queue.add_event(job_id, EVENT_ERROR, {"error": result.get("response", "执行任务失败")})
+    else:
+        queue.finish(job_id, PLAN_JOB_SUCCESS, result=result)
+        queue.add_event(job_id, EVENT_DONE, {**result, "job_id": job_id})
+        log_success(f"任务 {job_id} 执行完成")
+    job_finished.set()
+
+
+def purge_finished_jobs(queue: PlanJobQueue, retention_seconds: float = PLAN_JOB_RETENTION_SECONDS):
+    """删除保留时间已过的已结束任务，失败时只记录日志"""
+    try:
+        removed = queue.purge_finished(retention_seconds)
+    except Exception as e:
+        log_error(f"清理已结束任务失败: {e}")
+        return
+    if removed["jobs"] or removed["events"]:
+        log_info(f"已清理 {removed['jobs']} 个已结束任务、{removed['events']} 条进度事件")
+
+
+def worker_loop(db_path: str = PLAN_JOBS_DB):
+    """工作进程主循环：不断领取并执行任务"""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    # 工作进程的日志同样写入共享日志缓冲区，前端日志面板可以看到任务执行过程
+    init_log_capture(LogRing(SHARED_STATE_DB), worker_id)
+    queue = PlanJobQueue(db_path)
+    log_info(f"任务工作进程已启动: {worker_id}")
+    next_purge = 0.0
+    while True:
+        try:
+            job = queue.claim(worker_id)
+        except Exception as e:
+            log_error(f"领取任务失败: {e}")
+            job = None
+        if job is None:
+            # 空闲时定期清理过期的已结束任务
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + PLAN_JOB_PURGE_INTERVAL
+                purge_finished_jobs(queue)
+            time.sleep(PLAN_JOB_POLL_INTERVAL)
+            continue
+        run_plan_job(queue, job, worker_id)
+
+
+def start_plan_workers(count: int = PLAN_WORKER_COUNT, db_path: str = PLAN_JOBS_DB) -> List[multiprocessing.Process]:
+    """
+    启动多个任务工作进程
+
+    Args:
+        count: 工作进程数量
+        db_path: 任务队列数据库路径
+
+    Returns:
+        List[multiprocessing.Process]: 已启动的进程
+    """
+    # 使用spawn方式创建进程，避免继承Web服务的线程和连接
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(count):
+        process = context.Process(target=worker_loop, args=(db_path,), name=f"plan-worker-{i + 1}", daemon=True)
+        process.start()
+        workers.append(process)
+    log_success(f"已启动 {len(workers)} 个任务工作进程")
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="任务规划后台工作进程")
+    parser.add_argument("--workers", type=int, default=PLAN_WORKER_COUNT, help="工作进程数量")
+    args = parser.parse_args()
+
+    processes = start_plan_workers(args.workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log_info("任务工作进程已停止")
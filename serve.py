@@ -0,0 +1,36 @@
+"""
+生产部署入口
+启动多个Web工作进程（uvicorn + asgi.app）和任务规划后台工作进程：
+对话标题缓存和日志保存在共享的SQLite数据库中，任务规划通过SQLite队列执行，
+请求落到任何一个工作进程时行为一致
+
+运行方式：python serve.py --workers 4 --plan-workers 2
+"""
+import argparse
+
+import uvicorn
+
+from config import FLASK_HOST, FLASK_PORT, PLAN_WORKER_COUNT, WEB_WORKERS
+from utils.asset_pipeline import build_assets
+from utils.log_manager import log_info, log_error
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wynna生产部署入口")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="Web工作进程数量")
+    parser.add_argument("--plan-workers", type=int, default=PLAN_WORKER_COUNT, help="任务规划工作进程数量")
+    parser.add_argument("--host", default=FLASK_HOST)
+    parser.add_argument("--port", type=int, default=FLASK_PORT)
+    args = parser.parse_args()
+
+    # 在启动工作进程前处理好静态资源，避免多个进程同时写入
+    try:
+        build_assets()
+    except Exception as e:
+        log_error(f"静态资源处理失败，将使用原始文件: {e}")
+
+    if args.plan_workers > 0:
+        from plan_worker import start_plan_workers
+        start_plan_workers(args.plan_workers)
+
+    log_info(f"启动 {args.workers} 个Web工作进程: http://{args.host}:{args.port}")
+    uvicorn.run("asgi:app", host=args.host, port=args.port, workers=args.workers)
@@ -118,6 +118,14 @@ class ChatApp {
             // 立即刷新对话列表（显示新对话和加载动画）
             this.loadConversations();
 
+            // 请求较多被拒绝时直接提示服务端返回的原因
+            if (response.status === 429 || response.status === 503) {
+                const busy = await response.json();
+                this.removeTypingIndicator();
+                this.addMessage(busy.error || '当前请求较多，请稍后再试。', 'bot', true, null);
+                return;
+            }
+
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -177,6 +185,7 @@ class ChatApp {
         // 处理换行和特殊字符，并保存原始内容
         messageContent.innerHTML = this.formatMessage(content);
         messageContent.setAttribute('data-original-content', content);
+        this.watchImageJobs(messageContent);
         
         messageDiv.appendChild(messageContent);
         
@@ -206,6 +215,7 @@ class ChatApp {
         const formattedContent = this.formatHistoryMessage(content);
         messageContent.innerHTML = formattedContent;
         messageContent.setAttribute('data-original-content', content);
+        this.watchImageJobs(messageContent);
         
         messageDiv.appendChild(messageContent);
         
@@ -223,6 +233,60 @@ class ChatApp {
         this.scrollToBottom();
     }
 
+    // 获取生成图片对应的缩略图地址，非生成图片返回null
+    getThumbnailSrc(src) {
+        const match = (src || '').match(/^\/static\/generated_images\/([0-9a-f]{32})\.(png|jpg|webp)$/);
+        return match ? `/static/generated_images/thumbs/${match[1]}.webp` : null;
+    }
+
+    // 渲染图片：生成图片优先加载缩略图，点击查看原图，缩略图不存在时回退到原图
+    renderImage(alt, src) {
+        const thumbnail = this.getThumbnailSrc(src);
+        const onError = thumbnail
+            ? `this.onerror=function(){this.style.display='none';};this.src=this.dataset.fullSrc;`
+            : `this.style.display='none';`;
+        return `<div class="image-container">
+                    <img src="${thumbnail || src}" data-full-src="${src}" alt="${alt}" class="message-image" loading="lazy" onclick="window.open(this.dataset.fullSrc, '_blank')" onerror="${onError}">
+                    ${alt ? `<div class="image-caption">${alt}</div>` : ''}
+                </div>`;
+    }
+
+    // 轮询仍在生成中的图片任务，完成后替换为实际图片
+    watchImageJobs(container) {
+        const images = container.querySelectorAll('img[src^="/api/image-jobs/"]');
+        images.forEach(img => {
+            const match = img.getAttribute('src').match(/^\/api\/image-jobs\/([0-9a-f]+)\/image/);
+            if (!match) return;
+            const jobId = match[1];
+            
+            const poll = async () => {
+                try {
+                    const response = await fetch(`/api/image-jobs/${jobId}`);
+                    if (!response.ok) return;
+                    const job = await response.json();
+                    if (job.status === 'success' && job.web_path) {
+                        img.dataset.fullSrc = job.web_path;
+                        img.onerror = () => {
+                            img.onerror = null;
+                            img.src = job.web_path;
+                        };
+                        img.src = job.thumbnail_path || this.getThumbnailSrc(job.web_path) || job.web_path;
+                        return;
+                    }
+                    if (job.status === 'error') {
+                        img.src = `/api/image-jobs/${jobId}/image?t=${Date.now()}`;
+                        return;
+                    }
+                    setTimeout(poll, 2000);
+                } catch (error) {
+                    console.error('查询图片生成任务失败:', error);
+                    setTimeout(poll, 5000);
+                }
+            };
+            poll();
+        });
+    }
+
     // 格式化历史消息内容 - 处理已存储的消息格式
     formatHistoryMessage(content) {
         if (!content) return '';
@@ -301,12 +365,7 @@ class ChatApp {
         let cleaned = htmlContent;
         
         // 处理已经存在的markdown图片语法
-        cleaned = cleaned.replace(/!\[([^\]]*)\]\(([^)]+)\)/g, (match, alt, src) => {
-            return `<div class="image-container">
-                        <img src="${src}" alt="${alt}" class="message-image" loading="lazy" onerror="this.style.display='none';">
-                        ${alt ? `<div class="image-caption">${alt}</div>` : ''}
-                    </div>`;
-        });
+        cleaned = cleaned.replace(/!\[([^\]]*)\]\(([^)]+)\)/g, (match, alt, src) => this.renderImage(alt, src));
         
         // 处理可能存在的HTML图片标签，确保它们有正确的class
         cleaned = cleaned.replace(/<img([^>]*)>/g, (match, attrs) => {
@@ -350,12 +409,7 @@ class ChatApp {
         let formatted = content;
         
         // 首先处理图片 ![alt](src)
-        formatted = formatted.replace(/!\[([^\]]*)\]\(([^)]+)\)/g, (match, alt, src) => {
-            return `<div class="image-container">
-                        <img src="${src}" alt="${alt}" class="message-image" loading="lazy" onerror="this.style.display='none';">
-                        ${alt ? `<div class="image-caption">${alt}</div>` : ''}
-                    </div>`;
-        });
+        formatted = formatted.replace(/!\[([^\]]*)\]\(([^)]+)\)/g, (match, alt, src) => this.renderImage(alt, src));
         
         // 处理链接 [text](url) - 在处理标题之前，避免链接被误处理
         formatted = formatted.replace(/\[([^\]]+)\]\(([^)]+)\)/g, '<a href="$2" target="_blank" rel="noopener noreferrer">$1</a>');
@@ -888,7 +942,8 @@ class ChatApp {
         this.pendingTaskData = {
             conversation_id: data.conversation_id,
             original_question: data.original_question,
-            decomposed_tasks: data.decomposed_tasks
+            decomposed_tasks: data.decomposed_tasks,
+            plan_suggestion: data.plan_suggestion || null
         };
         
         // 添加确认按钮
@@ -899,12 +954,20 @@ class ChatApp {
     addTaskConfirmationButtons() {
         const buttonContainer = document.createElement('div');
         buttonContainer.className = 'task-confirmation-buttons';
+        // 计划来自相似问题时，允许重新拆解
+        const regenerateButton = this.pendingTaskData && this.pendingTaskData.plan_suggestion
+            ? '<button onclick="chatApp.regeneratePlan()" class="btn btn-secondary">重新拆解</button>'
+            : '';
         buttonContainer.innerHTML = `
             <div style="margin: 10px 0;">
                 <textarea id="task-editor" class="task-editor" placeholder="你可以编辑任务步骤..."></textarea>
                 <div class="task-buttons">
                     <button onclick="chatApp.confirmTasks()" class="btn btn-primary">确认并执行</button>
+                    ${regenerateButton}
                     <button onclick="chatApp.cancelTasks()" class="btn btn-secondary">取消</button>
+                    <label class="task-force-refresh" title="默认复用之前执行过且未修改的任务结果">
+                        <input type="checkbox" id="task-force-refresh"> 全部重新执行
+                    </label>
                 </div>
             </div>
         `;
@@ -949,6 +1012,8 @@ class ChatApp {
         if (!this.pendingTaskData) return;
         
         const taskEditor = document.getElementById('task-editor');
+        const forceRefreshInput = document.getElementById('task-force-refresh');
+        const forceRefresh = forceRefreshInput ? forceRefreshInput.checked : false;
         const confirmedTasks = taskEditor.value.trim().split('\n')
             .filter(task => task.trim())
             .filter((task, index) => {
@@ -979,18 +1044,31 @@ class ChatApp {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                 },
                 body: JSON.stringify({
                     conversation_id: this.pendingTaskData.conversation_id,
                     original_question: this.pendingTaskData.original_question,
                     tasks: confirmedTasks,
-                    modified_todo_content: taskEditor.value.trim()  // 添加用户修改后的原始todo内容
+                    modified_todo_content: taskEditor.value.trim(),  // 添加用户修改后的原始todo内容
+                    force_refresh: forceRefresh,  // 不复用之前的任务结果
+                    stream: true
                 })
             });
             
-            const data = await response.json();
+            // 以流式方式接收任务执行进度，服务端不支持时按普通JSON处理
+            const isStream = (response.headers.get('Content-Type') || '').includes('text/event-stream');
+            // 汇总超时时先显示备用格式的报告，后台汇总完成后重新加载对话
+            const data = isStream
+                ? await this.readTaskEventStream(response, summary => {
+                    if (summary.conversation_id === this.currentConversationId) {
+                        this.reloadCurrentConversation();
+                    }
+                })
+                : await response.json();
             
             this.removeTypingIndicator();
+            this.removeTaskProgress();
             
             if (data.error) {
                 throw new Error(data.error);
@@ -1010,10 +1088,163 @@ class ChatApp {
         } catch (error) {
             console.error('确认任务失败:', error);
             this.removeTypingIndicator();
+            this.removeTaskProgress();
             this.addMessage('确认任务时出现错误，请稍后再试。', 'bot', true, null);
         }
     }
 
+    // 读取任务执行的SSE事件流，实时展示每个任务的进度，收到最终结果即返回
+    // 结果中summary_pending为true时继续读取，后台汇总完成后调用onSummaryReady
+    readTaskEventStream(response, onSummaryReady = null) {
+        return new Promise((resolve, reject) => {
+            let result = null;
+            this.consumeEventStream(response, (eventName, data) => {
+                if (eventName === 'done') {
+                    result = data;
+                    resolve(data);
+                } else if (eventName === 'summary_ready') {
+                    if (onSummaryReady) onSummaryReady(data);
+                } else if (eventName === 'error') {
+                    throw new Error(data.error);
+                } else if (!result) {
+                    this.handleTaskEvent(eventName, data);
+                }
+            }).then(() => {
+                if (!result) reject(new Error('任务执行进度连接中断'));
+            }, error => {
+                if (!result) reject(error);
+                else console.error('等待汇总结果失败:', error);
+            });
+        });
+    }
+
+    // 逐条解析SSE事件并回调，直到连接关闭
+    async consumeEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // SSE事件之间以空行分隔
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let dataText = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+                });
+                if (!dataText) continue;
+                
+                onEvent(eventName, JSON.parse(dataText));
+            }
+        }
+    }
+
+    // 获取（必要时创建）任务进度面板
+    getTaskProgressPanel() {
+        let panel = document.querySelector('.task-progress');
+        if (panel) return panel;
+        
+        this.removeTypingIndicator();
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message bot-message task-progress';
+        messageDiv.innerHTML = `
+            <div class="message-content">
+                <div class="task-progress-list"></div>
+                <div class="task-progress-summary"></div>
+            </div>
+        `;
+        this.chatMessages.appendChild(messageDiv);
+        return messageDiv;
+    }
+
+    // 获取（必要时创建）某个任务的进度条目
+    getTaskProgressItem(taskNumber, todo = '') {
+        const panel = this.getTaskProgressPanel();
+        let item = panel.querySelector(`.task-progress-item[data-task="${taskNumber}"]`);
+        if (!item) {
+            item = document.createElement('div');
+            item.className = 'task-progress-item';
+            item.dataset.task = taskNumber;
+            item.innerHTML = `
+                <div class="task-progress-header">
+                    <span class="task-progress-status">⏳</span>
+                    <span class="task-progress-title"></span>
+                    <span class="task-progress-detail"></span>
+                </div>
+                <div class="task-progress-content"></div>
+            `;
+            item.querySelector('.task-progress-title').textContent = `${taskNumber}. ${todo}`;
+            
+            // 按任务序号排列
+            const list = panel.querySelector('.task-progress-list');
+            const next = Array.from(list.children).find(child => Number(child.dataset.task) > taskNumber);
+            list.insertBefore(item, next || null);
+        }
+        return item;
+    }
+
+    // 处理单个任务进度事件
+    handleTaskEvent(eventName, data) {
+        const agentNames = { photo: '图片', text: '文字', web_search: '搜索' };
+        
+        if (eventName === 'task_classified') {
+            const item = this.getTaskProgressItem(data.task_number, data.todo);
+            const dependsOn = data.depends_on && data.depends_on.length ? `，等待任务 ${data.depends_on.join('、')}` : '';
+            item.querySelector('.task-progress-detail').textContent = `${agentNames[data.agent_type] || data.agent_type}${dependsOn}`;
+        } else if (eventName === 'task_started') {
+            const item = this.getTaskProgressItem(data.task_number, data.todo);
+            item.classList.add('running');
+            item.querySelector('.task-progress-status').textContent = '🔄';
+            item.querySelector('.task-progress-detail').textContent = '执行中';
+        } else if (eventName === 'tool_called' && data.task_number) {
+            const item = this.getTaskProgressItem(data.task_number);
+            item.querySelector('.task-progress-detail').textContent = `调用工具 ${data.tool_name}`;
+        } else if (eventName === 'tool_progress' && data.task_number) {
+            const item = this.getTaskProgressItem(data.task_number);
+            const percent = data.total ? `${Math.round(data.progress / data.total * 100)}%` : '';
+            item.querySelector('.task-progress-detail').textContent = `${data.tool_name} ${percent} ${data.message || ''}`;
+        } else if (eventName === 'task_finished') {
+            const item = this.getTaskProgressItem(data.task_number, data.todo);
+            item.classList.remove('running', 'slow');
+            // 超过截止时间或请求取消的任务单独标记
+            const statusLabels = { success: ['✅', '已完成'], timeout: ['⏱️', '超时'], cancelled: ['⏹️', '已取消'] };
+            const [statusIcon, statusText] = statusLabels[data.status] || ['❌', '失败'];
+            item.querySelector('.task-progress-status').textContent = statusIcon;
+            item.querySelector('.task-progress-detail').textContent = statusText;
+            item.querySelector('.task-progress-content').textContent = data.content || '';
+        } else if (eventName === 'heartbeat') {
+            // 心跳中带有正在执行的任务，长时间未完成的任务高亮显示
+            (data.running_tasks || []).forEach(task => {
+                const item = this.getTaskProgressItem(task.task_number, task.todo);
+                item.classList.toggle('slow', task.elapsed_seconds >= 30);
+                item.querySelector('.task-progress-status').textContent = `🔄 ${Math.round(task.elapsed_seconds)}s`;
+            });
+        } else if (eventName === 'summary_delta') {
+            const summary = this.getTaskProgressPanel().querySelector('.task-progress-summary');
+            const content = (summary.getAttribute('data-original-content') || '') + data.delta;
+            summary.setAttribute('data-original-content', content);
+            summary.innerHTML = this.formatMessage(content);
+        }
+        this.scrollToBottom();
+    }
+
+    // 移除任务进度面板
+    removeTaskProgress() {
+        const panel = document.querySelector('.task-progress');
+        if (panel) {
+            panel.remove();
+        }
+    }
+
     // 更新显示的TODO内容
     updateDisplayedTodoContent(updatedTodoContent) {
         // 找到所有bot消息
@@ -1085,6 +1316,46 @@ class ChatApp {
         return processedLines.join('\n');
     }
 
+    // 不使用相似问题的计划，重新拆解任务
+    async regeneratePlan() {
+        if (!this.pendingTaskData || this.isLoading) return;
+        
+        const { conversation_id, original_question } = this.pendingTaskData;
+        this.removeTaskButtons();
+        this.addTypingIndicator();
+        this.isLoading = true;
+        
+        try {
+            const response = await fetch('/api/chat', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    message: original_question,
+                    conversation_id: conversation_id,
+                    fresh_plan: true
+                })
+            });
+            const data = await response.json();
+            if (!response.ok || data.error) {
+                throw new Error(data.error || `HTTP error! status: ${response.status}`);
+            }
+            
+            this.removeTypingIndicator();
+            this.handleTaskPlanningResponse(data);
+        } catch (error) {
+            console.error('重新拆解任务失败:', error);
+            this.removeTypingIndicator();
+            this.addMessage('抱歉，重新拆解任务时出现错误，请稍后再试。', 'bot', true, null);
+            // 恢复原来的计划，用户仍可确认执行
+            this.addTaskConfirmationButtons();
+        } finally {
+            this.isLoading = false;
+            this.updateSendButtonState();
+        }
+    }
+
     // 取消任务
     cancelTasks() {
         this.removeTaskButtons();
@@ -1240,7 +1511,9 @@ class ChatApp {
         if (!this.logPollingActive || !this.isLogPanelVisible) return;
 
         try {
-            const response = await fetch('/api/logs/stream?timeout=10');
+            // 带上已收到的最后一条日志id，请求落到任何一个工作进程都能接着读取
+            const after = this.lastLogId !== undefined ? `&after=${this.lastLogId}` : '';
+            const response = await fetch(`/api/logs/stream?timeout=10${after}`);
             const data = await response.json();
             
             if (data.logs && data.logs.length > 0) {
@@ -1260,6 +1533,9 @@ class ChatApp {
     }
 
     appendLogMessage(log) {
+        if (log.id !== undefined) {
+            this.lastLogId = log.id;
+        }
         const logDiv = document.createElement('div');
         logDiv.className = 'log-message';
         
@@ -1,14 +1,28 @@
 import asyncio
 import json
-from typing import List, Dict, Any, Optional
+from datetime import timedelta
+from typing import List, Dict, Any, Optional, Callable
 from contextlib import AsyncExitStack
-from datetime import datetime
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from config import get_openai_client, DOUBAO_MODEL
+from config import (
+    get_openai_client, DOUBAO_MODEL, RESULT_STORE_MAX_BYTES, RESULT_STORE_TTL, RESULT_STORE_SPILL_DIR,
+    TASK_TIMEOUT_SECONDS
+)
 from utils.timestamp_utils import get_current_timestamp
 from utils.log_manager import log_info, log_success, log_error, log_agent, log_task
+from utils.result_store import ResultStore
+from utils.plan_memory import PlanMemory, compute_fingerprints
+from utils.deadline import Deadline, DeadlineExceeded, TASK_CANCELLED
+from utils.task_events import (
+    EventCallback, emit_event, partial_content, EVENT_TASK_CLASSIFIED, EVENT_TASK_STARTED,
+    EVENT_TOOL_CALLED, EVENT_TOOL_PROGRESS, EVENT_TASK_FINISHED
+)
+from task_scheduler import DAGScheduler, TaskNode, build_task_graph
+
+# 传递给下游任务的每个上游结果的最大字符数
+UPSTREAM_CONTENT_MAX_CHARS = 1500
 
 class MCPAgentClient:
     """MCP协议的Agent客户端"""
@@ -40,8 +54,47 @@ class MCPAgentClient:
         await session.initialize()
         return session, exit_stack
     
-    async def process_task(self, original_question: str, todo_content: str, single_todo: str) -> Dict[str, Any]:
-        """处理单个任务"""
+    @property
+    def agent_type(self) -> str:
+        """根据服务器脚本确定agent类型"""
+        if "photo_generator" in self.server_script:
+            return "photo"
+        elif "web_search" in self.server_script:
+            return "web_search"
+        return "text"
+    
+    @staticmethod
+    def _make_progress_logger(tool_name: str, on_event: Optional[EventCallback] = None,
+                              task_number: Optional[int] = None):
+        """生成MCP进度通知的回调，将工具进度写入日志并发送进度事件"""
+        async def log_progress(progress: float, total: Optional[float], message: Optional[str]):
+            percent = f"{progress / total:.0%}" if total else f"{progress}"
+            log_info(f"MCP工具进度 {tool_name}: {percent} {message or ''}")
+            emit_event(on_event, EVENT_TOOL_PROGRESS, task_number=task_number, tool_name=tool_name,
+                       progress=progress, total=total, message=message or "")
+        return log_progress
+    
+    @staticmethod
+    def _format_upstream_results(upstream_results: List[Dict[str, Any]]) -> str:
+        """将上游任务的结果整理为提示词片段"""
+        sections = []
+        for result in upstream_results:
+            if result.get("status") != "success":
+                continue
+            content = (result.get("content") or "").strip()
+            if len(content) > UPSTREAM_CONTENT_MAX_CHARS:
+                content = content[:UPSTREAM_CONTENT_MAX_CHARS] + "…"
+            sections.append(f"【{result.get('todo', '')}】\n{content}")
+        return "\n\n".join(sections)
+    
+    async def process_task(self, original_question: str, todo_content: str, single_todo: str,
+                           upstream_results: Optional[List[Dict[str, Any]]] = None,
+                           on_event: Optional[EventCallback] = None,
+                           task_number: Optional[int] = None,
+                           deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """处理单个任务，upstream_results为该任务依赖的前置任务的执行结果，on_event用于发送工具调用事件，
+        模型调用和工具调用的超时不超过deadline"""
+        deadline = deadline or Deadline()
         log_agent(f"开始处理任务: {single_todo[:50]}...")
         # 为每个任务创建独立的会话
         log_info(f"创建MCP会话: {self.server_script}")
@@ -61,6 +114,12 @@ class MCPAgentClient:
 
             请根据你拥有的工具来完成这个任务。如果需要调用工具，请直接调用。如果不需要工具，请直接给出答案。
             """
+            upstream_text = self._format_upstream_results(upstream_results or [])
+            if upstream_text:
+                system_prompt += f"""
+            以下是前置任务已经得到的结果，请直接在此基础上完成任务，不要重复前置任务已经完成的工作：
+            {upstream_text}
+            """
             
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -84,26 +143,22 @@ class MCPAgentClient:
             
             # 请求大模型
             log_info(f"调用豆包模型进行任务处理，可用工具数: {len(available_tools)}")
-            response = self.client.chat.completions.create(
+            # 模型调用放到线程中执行，截止时间到达时可以取消等待
+            response = await asyncio.to_thread(
+                self.client.chat.completions.create,
                 model=DOUBAO_MODEL,
                 messages=messages,
                 tools=available_tools,
-                tool_choice="auto"
+                tool_choice="auto",
+                **deadline.timeout_kwargs()
             )
             
             # 处理返回的内容
             content = response.choices[0]
-            # 确定agent类型
-            if "photo_generator" in self.server_script:
-                agent_type = "photo"
-            elif "web_search" in self.server_script:
-                agent_type = "web_search"
-            else:
-                agent_type = "text"
                 
             result_data = {
                 "todo": single_todo,
-                "agent_type": agent_type,
+                "agent_type": self.agent_type,
                 "timestamp": get_current_timestamp(),
                 "status": "success",
                 "content": "",
@@ -122,7 +177,14 @@ class MCPAgentClient:
                     
                     # 执行工具
                     log_agent(f"执行MCP工具: {tool_name}，参数: {tool_args}")
-                    tool_result = await session.call_tool(tool_name, tool_args)
+                    emit_event(on_event, EVENT_TOOL_CALLED, task_number=task_number,
+                               tool_name=tool_name, args=tool_args)
+                    remaining = deadline.remaining()
+                    tool_result = await session.call_tool(
+                        tool_name, tool_args,
+                        read_timeout_seconds=timedelta(seconds=remaining) if remaining is not None else None,
+                        progress_callback=self._make_progress_logger(tool_name, on_event, task_number)
+                    )
                     log_success(f"MCP工具执行完成: {tool_name}")
                     
                     # 收集工具调用信息
@@ -161,9 +223,11 @@ class MCPAgentClient:
                 
                 # 将上面的结果再返回给大模型用于生成最终的结果
                 log_info("调用豆包模型生成最终结果")
-                final_response = self.client.chat.completions.create(
+                final_response = await asyncio.to_thread(
+                    self.client.chat.completions.create,
                     model=DOUBAO_MODEL,
                     messages=messages,
+                    **deadline.timeout_kwargs()
                 )
                 result_data["content"] = final_response.choices[0].message.content
                 log_success(f"任务处理完成: {single_todo[:30]}...")
@@ -178,6 +242,89 @@ class MCPAgentClient:
             log_info("关闭MCP会话")
             await exit_stack.aclose()
 
+    def _write_image_prompts(self, original_question: str, todos: List[str],
+                             deadline: Optional[Deadline] = None) -> List[str]:
+        """一次性为多个图片任务生成图片描述，失败时直接使用任务文本"""
+        try:
+            todo_lines = "\n".join(f"{i}. {todo}" for i, todo in enumerate(todos, 1))
+            response = self.client.chat.completions.create(
+                model=DOUBAO_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": """你是一个文生图提示词专家。请为每个图片任务编写一段详细的中文图片描述，用于文生图模型。
+                        
+                        请以JSON格式输出，格式如下：
+                        {"prompts": ["任务1的图片描述", "任务2的图片描述"]}
+                        
+                        prompts的数量和顺序必须与任务列表完全一致。"""
+                    },
+                    {
+                        "role": "user",
+                        "content": f"用户的原始问题：{original_question}\n\n图片任务列表：\n{todo_lines}"
+                    }
+                ],
+                temperature=0.3,
+                response_format={"type": "json_object"},
+                **(deadline or Deadline()).timeout_kwargs()
+            )
+            prompts = json.loads(response.choices[0].message.content).get("prompts", [])
+            if len(prompts) == len(todos) and all(isinstance(p, str) and p.strip() for p in prompts):
+                return prompts
+            log_error(f"图片描述数量与任务数量不一致: {len(prompts)} != {len(todos)}")
+        except Exception as e:
+            log_error(f"生成图片描述失败: {e}")
+        return list(todos)
+    
+    async def process_photo_batch(self, original_question: str, todo_content: str, todos: List[str],
+                                  on_event: Optional[EventCallback] = None,
+                                  task_numbers: Optional[List[int]] = None,
+                                  deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """将同一计划中的多个图片任务合并为一次批量生成调用"""
+        deadline = deadline or Deadline()
+        log_agent(f"批量处理 {len(todos)} 个图片任务")
+        prompts = await asyncio.to_thread(self._write_image_prompts, original_question, todos, deadline)
+        
+        log_info(f"创建MCP会话: {self.server_script}")
+        session, exit_stack = await self._create_session()
+        try:
+            log_agent(f"执行MCP工具: generate_image，批量描述数: {len(prompts)}")
+            for task_number in task_numbers or []:
+                emit_event(on_event, EVENT_TOOL_CALLED, task_number=task_number,
+                           tool_name="generate_image", args={"prompts": prompts})
+            remaining = deadline.remaining()
+            tool_result = await session.call_tool(
+                "generate_image", {"prompts": prompts},
+                read_timeout_seconds=timedelta(seconds=remaining) if remaining is not None else None,
+                progress_callback=self._make_progress_logger("generate_image", on_event)
+            )
+            log_success("MCP工具执行完成: generate_image")
+        finally:
+            log_info("关闭MCP会话")
+            await exit_stack.aclose()
+        
+        result_json = json.loads(tool_result.content[0].text)
+        images = result_json.get("images") or [result_json]
+        
+        results = []
+        for i, (todo, prompt) in enumerate(zip(todos, prompts)):
+            image_json = images[i] if i < len(images) and result_json.get("status") != "error" else result_json
+            succeeded = image_json.get("status") in ["success", "pending"]
+            results.append({
+                "todo": todo,
+                "agent_type": self.agent_type,
+                "timestamp": get_current_timestamp(),
+                "status": "success" if succeeded else "error",
+                "content": f"已根据任务生成图片：{prompt}" if succeeded else image_json.get("message", "图片生成失败"),
+                "tool_results": [{
+                    "tool_name": "generate_image",
+                    "args": {"prompt": prompt},
+                    "result": json.dumps(image_json, ensure_ascii=False)
+                }]
+            })
+        log_success(f"批量图片任务提交完成: {len(results)} 个")
+        return results
+
 class TaskDispatcher:
     """任务分配与执行节点"""
     
@@ -188,14 +335,15 @@ class TaskDispatcher:
             "web_search": MCPAgentClient("MCP_server/web_search_server.py")
         }
         self.client = get_openai_client()
-        self.task_cache = {}  # 用于存储子Agent的输出
+        # 用于存储子Agent的输出，容量和有效期受限，超出容量的结果写入磁盘
+        self.task_cache = ResultStore(RESULT_STORE_MAX_BYTES, RESULT_STORE_TTL, RESULT_STORE_SPILL_DIR)
     
     async def initialize_agents(self):
         """初始化所有Agent连接"""
         # 不再需要预连接，每个任务都会创建独立会话
         log_success("所有Agent初始化完成")
     
-    def classify_todo_item(self, todo_item: str) -> str:
+    def classify_todo_item(self, todo_item: str, deadline: Optional[Deadline] = None) -> str:
         """使用豆包大模型分类TODO项"""
         try:
             response = self.client.chat.completions.create(
@@ -218,7 +366,8 @@ class TaskDispatcher:
                     }
                 ],
                 max_tokens=10,
-                temperature=0.1
+                temperature=0.1,
+                **(deadline or Deadline()).timeout_kwargs()
             )
             
             result = response.choices[0].message.content.strip().lower()
@@ -253,8 +402,162 @@ class TaskDispatcher:
         
         return todo_items
     
-    async def dispatch_and_execute_tasks(self, original_question: str, todo_content: str) -> str:
-        """分配并执行所有任务"""
+    def infer_dependencies(self, todo_items: List[str],
+                           deadline: Optional[Deadline] = None) -> Optional[List[List[int]]]:
+        """使用豆包大模型推断任务之间的依赖关系，返回每个任务依赖的前置任务序号（从0开始），失败时返回None"""
+        if len(todo_items) < 2:
+            return [[] for _ in todo_items]
+        try:
+            todo_lines = "\n".join(f"{i}. {todo}" for i, todo in enumerate(todo_items, 1))
+            response = self.client.chat.completions.create(
+                model=DOUBAO_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": """
+                        你是一个任务依赖分析专家。请判断每个任务是否必须使用前面某些任务的结果才能完成。
+                        例如"分析财报数据"依赖"搜索财报"，而互不相关的任务之间没有依赖。
+                        只有确实需要使用前置任务的输出时才算依赖，任务只能依赖编号比自己小的任务。
+
+                        请以JSON格式输出，格式如下：
+                        {"dependencies": {"2": [1], "3": []}}
+
+                        键为任务编号，值为它依赖的任务编号列表。"""
+                    },
+                    {
+                        "role": "user",
+                        "content": f"任务列表：\n{todo_lines}"
+                    }
+                ],
+                max_tokens=300,
+                temperature=0.1,
+                response_format={"type": "json_object"},
+                **(deadline or Deadline()).timeout_kwargs()
+            )
+            raw = json.loads(response.choices[0].message.content).get("dependencies", {})
+            dependencies = []
+            for i in range(len(todo_items)):
+                deps = raw.get(str(i + 1), []) if isinstance(raw, dict) else []
+                # 只保留指向更早任务的依赖，保证依赖图无环
+                dependencies.append(sorted({int(d) - 1 for d in deps
+                                            if str(d).isdigit() and 0 < int(d) <= i}))
+            return dependencies
+        except Exception as e:
+            log_error(f"任务依赖分析失败，按无依赖处理: {e}")
+            return None
+    
+    @staticmethod
+    def _interrupted_result(todo: str, agent_type: str, reason: str) -> Dict[str, Any]:
+        """子任务被截止时间或取消中断时的结果，status为timeout或cancelled"""
+        return {
+            "todo": todo,
+            "agent_type": agent_type,
+            "timestamp": get_current_timestamp(),
+            "status": reason,
+            "content": "请求已取消，任务未完成" if reason == TASK_CANCELLED else "任务执行超时，已停止",
+            "tool_results": []
+        }
+    
+    @staticmethod
+    def _emit_task_finished(on_event: Optional[EventCallback], task_number: int, result: Dict[str, Any],
+                            restored: bool = False):
+        """发送任务完成事件，携带部分结果内容，restored表示结果来自之前的执行记录"""
+        emit_event(on_event, EVENT_TASK_FINISHED, task_number=task_number,
+                   todo=result.get("todo", ""), agent_type=result.get("agent_type", ""),
+                   status=result.get("status", ""), content=partial_content(result.get("content")),
+                   tools=[tr.get("tool_name", "") for tr in result.get("tool_results", [])],
+                   restored=restored)
+    
+    async def execute_node(self, node: TaskNode, original_question: str, todo_content: str,
+                           upstream_results: List[Dict[str, Any]],
+                           on_event: Optional[EventCallback] = None,
+                           completed_results: Optional[Dict[int, Dict[str, Any]]] = None,
+                           on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                           deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """执行依赖图中的一个节点，completed_results中已成功的任务直接复用，不再重复执行；
+        每个子任务最多执行TASK_TIMEOUT_SECONDS秒且不超过deadline，超时或取消的子任务标记为timeout或cancelled"""
+        agent = self.agents[node.agent_type]
+        deadline = deadline or Deadline()
+        completed_results = completed_results or {}
+        task_numbers = [index + 1 for index in node.indexes]
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = []
+        for task_number, todo in zip(task_numbers, node.todos):
+            checkpoint = completed_results.get(task_number)
+            if checkpoint and checkpoint.get("todo") == todo and checkpoint.get("status") == "success":
+                log_info(f"任务 {task_number} 已有执行结果，跳过执行")
+                results[task_number] = checkpoint
+                self._emit_task_finished(on_event, task_number, checkpoint, restored=True)
+            else:
+                pending.append((task_number, todo))
+                emit_event(on_event, EVENT_TASK_STARTED, task_number=task_number, todo=todo,
+                           agent_type=node.agent_type)
+        
+        def finish(task_number: int, result: Dict[str, Any]):
+            results[task_number] = result
+            self._emit_task_finished(on_event, task_number, result)
+            if on_result is not None:
+                on_result(task_number, result)
+        
+        # 同一计划中的多个图片任务合并为一次批量生成
+        if len(pending) > 1 and node.agent_type == "photo":
+            try:
+                batch_numbers = [task_number for task_number, _ in pending]
+                batch_deadline = deadline.child(TASK_TIMEOUT_SECONDS)
+                batch_results = await batch_deadline.run(
+                    agent.process_photo_batch(original_question, todo_content, [todo for _, todo in pending],
+                                              on_event, batch_numbers, batch_deadline)
+                )
+                for task_number, result in zip(batch_numbers, batch_results):
+                    finish(task_number, result)
+                pending = []
+            except DeadlineExceeded as e:
+                log_error(f"批量图片任务未完成: {e}")
+                for task_number, todo in pending:
+                    finish(task_number, self._interrupted_result(todo, node.agent_type, e.reason))
+                pending = []
+            except Exception as e:
+                log_error(f"批量图片任务执行失败，改为逐个执行: {e}")
+        
+        async def execute_single_task(task, task_number):
+            task_deadline = deadline.child(TASK_TIMEOUT_SECONDS)
+            try:
+                result = await task_deadline.run(
+                    agent.process_task(original_question, todo_content, task, upstream_results,
+                                       on_event, task_number, task_deadline)
+                )
+            except DeadlineExceeded as e:
+                log_error(f"任务未完成: {task[:30]}... - {e}")
+                result = self._interrupted_result(task, node.agent_type, e.reason)
+            except Exception as e:
+                log_error(f"任务执行失败: {task[:30]}... - {e}")
+                result = {
+                    "todo": task,
+                    "agent_type": node.agent_type,
+                    "timestamp": get_current_timestamp(),
+                    "status": "error",
+                    "content": f"任务执行失败: {str(e)}",
+                    "tool_results": []
+                }
+            finish(task_number, result)
+        
+        await asyncio.gather(*(execute_single_task(task, task_number) for task_number, task in pending))
+        return [results[task_number] for task_number in task_numbers]
+    
+    async def dispatch_and_execute_tasks(self, original_question: str, todo_content: str,
+                                         on_event: Optional[EventCallback] = None,
+                                         completed_results: Optional[Dict[int, Dict[str, Any]]] = None,
+                                         on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                                         plan_memory: Optional[PlanMemory] = None,
+                                         force_refresh: bool = False,
+                                         deadline: Optional[Deadline] = None) -> str:
+        """分配并执行所有任务：按依赖关系调度，独立任务并发执行，下游任务可使用上游结果
+        
+        on_event用于接收任务分类、开始、工具调用和完成等进度事件；
+        completed_results为之前已完成的任务结果（按任务序号），恢复执行时直接复用；
+        on_result在每个任务完成后回调，用于保存检查点；
+        plan_memory为对话中之前执行过的任务记录，指纹未变的任务直接复用结果，force_refresh为True时全部重新执行；
+        deadline为整个请求的截止时间，超时或取消后未完成的任务直接结束，已完成的结果照常返回"""
         # 解析TODO项
         todo_items = self.parse_todo_content(todo_content)
         log_task(f"解析出 {len(todo_items)} 个任务项")
@@ -262,63 +565,89 @@ class TaskDispatcher:
         if not todo_items:
             return "没有找到有效的任务项"
         
-        # 分类任务
-        classified_tasks = {}
-        for todo_item in todo_items:
-            agent_type = self.classify_todo_item(todo_item)
-            if agent_type not in classified_tasks:
-                classified_tasks[agent_type] = []
-            classified_tasks[agent_type].append(todo_item)
-            log_task(f"任务 '{todo_item[:30]}...' 分配给 {agent_type} Agent")
+        memory = plan_memory if plan_memory is not None else PlanMemory()
+        use_memory = plan_memory is not None and not force_refresh
+        deadline = deadline or Deadline()
         
-        # 并行执行任务
-        all_results = []
+        # 并发进行任务分类和依赖分析，之前分析过的任务直接复用；
+        # 超过截止时间或取消时不再等待模型返回，按默认分类和无依赖处理，随后的子任务直接标记为timeout或cancelled
+        async def classify(todo_item: str) -> str:
+            agent_type = memory.get_agent_type(original_question, todo_item) if use_memory else None
+            if agent_type is None:
+                try:
+                    agent_type = await deadline.run(asyncio.to_thread(self.classify_todo_item, todo_item, deadline))
+                except DeadlineExceeded as e:
+                    log_error(f"任务分类未完成: {todo_item[:30]}... - {e}")
+                    return "text"
+                memory.set_agent_type(original_question, todo_item, agent_type)
+            return agent_type
         
-        # 使用asyncio.gather来并行执行不同类型的任务
-        async def execute_agent_tasks(agent_type: str, tasks: List[str]):
-            agent = self.agents[agent_type]
-            results = []
-            
-            # 为同一类型的任务创建并发任务
-            async def execute_single_task(task):
+        async def analyze_dependencies() -> List[List[int]]:
+            dependencies = memory.get_dependencies(original_question, todo_items) if use_memory else None
+            if dependencies is None:
                 try:
-                    return await agent.process_task(original_question, todo_content, task)
-                except Exception as e:
-                    log_error(f"任务执行失败: {task[:30]}... - {e}")
-                    return {
-                        "todo": task,
-                        "agent_type": agent_type,
-                        "timestamp": get_current_timestamp(),
-                        "status": "error",
-                        "content": f"任务执行失败: {str(e)}",
-                        "tool_results": []
-                    }
-            
-            # 并行执行同类型的所有任务
-            tasks_coroutines = [execute_single_task(task) for task in tasks]
-            results = await asyncio.gather(*tasks_coroutines)
-            return results
+                    dependencies = await deadline.run(asyncio.to_thread(self.infer_dependencies, todo_items, deadline))
+                except DeadlineExceeded as e:
+                    log_error(f"任务依赖分析未完成，按无依赖处理: {e}")
+                    return [[] for _ in todo_items]
+                if dependencies is None:
+                    return [[] for _ in todo_items]
+                memory.set_dependencies(original_question, todo_items, dependencies)
+            return dependencies
+        
+        *agent_types, dependencies = await asyncio.gather(
+            *(classify(todo_item) for todo_item in todo_items),
+            analyze_dependencies()
+        )
+        for i, (todo_item, agent_type, deps) in enumerate(zip(todo_items, agent_types, dependencies), 1):
+            dep_text = f"，依赖任务 {[d + 1 for d in deps]}" if deps else ""
+            log_task(f"任务 '{todo_item[:30]}...' 分配给 {agent_type} Agent{dep_text}")
+            emit_event(on_event, EVENT_TASK_CLASSIFIED, task_number=i, todo=todo_item,
+                       agent_type=agent_type, depends_on=[d + 1 for d in deps])
         
-        # 为每种Agent类型创建执行协程
-        agent_coroutines = []
-        for agent_type, tasks in classified_tasks.items():
-            agent_coroutines.append(execute_agent_tasks(agent_type, tasks))
+        # 指纹未变的任务复用之前的结果（检查点中的结果优先）
+        fingerprints = compute_fingerprints(original_question, todo_items, agent_types, dependencies)
+        completed_results = dict(completed_results or {})
+        if use_memory:
+            for i, (todo_item, fingerprint) in enumerate(zip(todo_items, fingerprints), 1):
+                remembered = memory.get_result(fingerprint)
+                if i not in completed_results and remembered:
+                    completed_results[i] = {**remembered, "todo": todo_item}
+                    memory.set_result(fingerprint, remembered)
+        reused_tasks = sum(1 for result in completed_results.values() if result.get("status") == "success")
+        if reused_tasks:
+            log_info(f"复用 {reused_tasks} 个未改变任务的结果，执行其余 {len(todo_items) - reused_tasks} 个任务")
         
-        # 并行执行所有Agent类型的任务
-        agent_results = await asyncio.gather(*agent_coroutines)
+        def save_result(task_number: int, result: Dict[str, Any]):
+            memory.set_result(fingerprints[task_number - 1], result)
+            if on_result is not None:
+                on_result(task_number, result)
         
-        # 合并所有结果
-        for results in agent_results:
-            all_results.extend(results)
+        # 构建依赖图并调度执行
+        nodes = build_task_graph(todo_items, agent_types, dependencies)
+        
+        async def execute(node: TaskNode, upstream_results: List[Dict[str, Any]]):
+            return await self.execute_node(node, original_question, todo_content, upstream_results,
+                                           on_event, completed_results, save_result, deadline)
+        
+        timing = await DAGScheduler().run(nodes, execute)
+        
+        # 按TODO顺序整理结果
+        ordered_results = [None] * len(todo_items)
+        for node in nodes:
+            for index, result in zip(node.indexes, node.results):
+                ordered_results[index] = result
+        all_results = [result for result in ordered_results if result is not None]
         
         # 缓存结果用于汇总
-        cache_key = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        self.task_cache[cache_key] = {
+        cache_key = self.task_cache.put({
             "original_question": original_question,
             "todo_content": todo_content,
             "results": all_results,
+            "timing": timing,
+            "reused_tasks": reused_tasks,
             "timestamp": get_current_timestamp()
-        }
+        })
         
         return cache_key
     
@@ -341,6 +670,6 @@ async def get_task_dispatcher():
 def get_task_results(cache_key: str) -> Dict[str, Any]:
     """从缓存获取任务结果"""
     global _task_dispatcher
-    if _task_dispatcher and cache_key in _task_dispatcher.task_cache:
-        return _task_dispatcher.task_cache[cache_key]
+    if _task_dispatcher:
+        return _task_dispatcher.task_cache.get(cache_key)
     return None
\ No newline at end of file
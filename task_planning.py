@@ -1,24 +1,28 @@
 import json
+import threading
 import uuid
 from datetime import datetime
-from config import get_openai_client, get_openai_deepseek_client, DOUBAO_MODEL, DEEPSEEK_MODEL, SYSTEM_PROMPT
-from conversation import save_conversation, load_conversation
+from config import get_openai_client, get_async_openai_client, get_openai_deepseek_client, DOUBAO_MODEL, DEEPSEEK_MODEL, SYSTEM_PROMPT, \
+    SUMMARY_DEADLINE_SECONDS
+from conversation import save_conversation, load_conversation, load_task_memory, save_task_memory, \
+    replace_assistant_message
 from task_dispatcher import get_task_dispatcher, get_task_results
 from task_summarizer import TaskSummarizer
 from utils.timestamp_utils import get_current_timestamp
 from utils.message_utils import create_user_message, create_assistant_message, create_system_message
 from utils.log_manager import log_info, log_success, log_error, log_task
+from utils.task_events import emit_event, EVENT_SUMMARY_DELTA, EVENT_SUMMARY_READY
+from utils.plan_memory import PlanMemory
+from utils.deadline import Deadline, TASK_CANCELLED, TASK_TIMEOUT
 
-def judge_question_type(user_message):
-    """判断用户问题类型：chatbot模式 vs 任务规划模式"""
-    try:
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model=DOUBAO_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """
+def _question_type_request(user_message):
+    """问题类型判断的模型调用参数，同步和异步版本共用"""
+    return dict(
+        model=DOUBAO_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": """
                 你是一个问题类型判断专家。请判断用户的问题属于以下哪种类型：
                 1. chatBot模式：简单且常规的聊天类问题，如"现在几点了"、"杭州天气如何"、"你叫什么名字"、"你好"、"帮我写个故事"、"解释一下人工智能"等日常对话或简单咨询。
                 2. taskPlanning模式：复杂的任务规划类问题，需要多步骤完成，如"为我制定8月份去杭州的旅游攻略"、"为我调研快手2024年的财报"、"帮我分析市场趋势并制定商业计划"等。
@@ -38,58 +42,77 @@ def judge_question_type(user_message):
                 }
                 
                 其中type只能是"chatBot"或"taskPlanning"，confidence为0-1之间的置信度，reason为判断理由。"""
-                },
-                {
-                    "role": "user", 
-                    "content": user_message
-                }
-            ],
-            max_tokens=150,
-            temperature=0.1,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "question_type_judgment",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "type": {
-                                "type": "string",
-                                "enum": ["chatBot", "taskPlanning"],
-                                "description": "问题类型，只能是chatBot或taskPlanning"
-                            },
-                            "confidence": {
-                                "type": "number",
-                                "description": "判断的置信度，范围0-1"
-                            },
-                            "reason": {
-                                "type": "string",
-                                "description": "判断理由"
-                            }
+            },
+            {
+                "role": "user", 
+                "content": user_message
+            }
+        ],
+        max_tokens=150,
+        temperature=0.1,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "question_type_judgment",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "type": {
+                            "type": "string",
+                            "enum": ["chatBot", "taskPlanning"],
+                            "description": "问题类型，只能是chatBot或taskPlanning"
                         },
-                        "required": ["type", "confidence", "reason"],
-                        "additionalProperties": False
+                        "confidence": {
+                            "type": "number",
+                            "description": "判断的置信度，范围0-1"
+                        },
+                        "reason": {
+                            "type": "string",
+                            "description": "判断理由"
+                        }
                     },
-                    "strict": True
-                }
+                    "required": ["type", "confidence", "reason"],
+                    "additionalProperties": False
+                },
+                "strict": True
             }
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        question_type = result.get("type", "chatBot")
-        confidence = result.get("confidence", 0.5)
-        reason = result.get("reason", "")
-        
-        # 记录判断结果
-        log_info(f"使用豆包模型进行问题类型判断: {question_type}, 置信度: {confidence}, 理由: {reason}")
-        
-        return question_type
-            
+        }
+    )
+
+def _parse_question_type(response):
+    """从模型响应中解析问题类型"""
+    result = json.loads(response.choices[0].message.content)
+    question_type = result.get("type", "chatBot")
+    confidence = result.get("confidence", 0.5)
+    reason = result.get("reason", "")
+    
+    # 记录判断结果
+    log_info(f"使用豆包模型进行问题类型判断: {question_type}, 置信度: {confidence}, 理由: {reason}")
+    
+    return question_type
+
+def judge_question_type(user_message):
+    """判断用户问题类型：chatbot模式 vs 任务规划模式"""
+    try:
+        # 问题类型判断在每次聊天的关键路径上，超过p95延迟时向备选服务商发起对冲请求
+        client = get_openai_client(hedge=True)
+        response = client.chat.completions.create(**_question_type_request(user_message))
+        return _parse_question_type(response)
     except Exception as e:
         log_error(f"判断问题类型失败: {e}")
         # 失败时默认为chatBot模式
         return "chatBot"
 
+async def judge_question_type_async(user_message):
+    """与judge_question_type相同，通过共享的异步客户端在事件循环中调用模型"""
+    try:
+        client = get_async_openai_client(hedge=True)
+        response = await client.chat.completions.create(**_question_type_request(user_message))
+        return _parse_question_type(response)
+    except Exception as e:
+        log_error(f"判断问题类型失败: {e}")
+        return "chatBot"
+
 def decompose_task(user_message):
     """任务拆解函数"""
     try:
@@ -164,34 +187,58 @@ def decompose_task(user_message):
         return f"任务拆解失败：{str(e)}"
 
 
-def handle_task_planning(user_input, conversation_id=None):
-    """处理任务规划模式"""
+def handle_task_planning(user_input, conversation_id=None, suggestion=None):
+    """处理任务规划模式
+    
+    suggestion为相似计划索引中找到的已确认计划（PlanIndex.find的结果），提供时直接使用该计划，不再调用模型拆解"""
     if conversation_id is None:
         conversation_id = str(uuid.uuid4())
     
-    # 任务拆解
-    decomposed_tasks = decompose_task(user_input)
+    if suggestion:
+        # 相似问题已有确认过的计划，直接作为建议返回
+        decomposed_tasks = suggestion["markdown"]
+        log_task(f"复用相似问题的计划（相似度 {suggestion['similarity']}）: {suggestion['question']}")
+        response = f"这个问题和之前的「{suggestion['question']}」很像，我先参考之前确认过的计划拆解成了以下几个步骤：\n\n{decomposed_tasks}\n\n请确认这些步骤是否合适，你可以编辑后提交，也可以让我重新拆解。确认后我会逐步为你完成每个任务哦！"
+    else:
+        # 任务拆解
+        decomposed_tasks = decompose_task(user_input)
+        response = f"我来帮你分析这个任务～这是一个比较复杂的问题，我把它拆解成了以下几个步骤：\n\n{decomposed_tasks}\n\n请确认这些步骤是否合适，或者你可以编辑后提交。确认后我会逐步为你完成每个任务哦！"
     
     # 保存初始对话（使用工具函数创建消息）
     messages = [
         create_system_message(SYSTEM_PROMPT),
         create_user_message(user_input),
-        create_assistant_message(f"我来帮你分析这个任务～这是一个比较复杂的问题，我把它拆解成了以下几个步骤：\n\n{decomposed_tasks}\n\n请确认这些步骤是否合适，或者你可以编辑后提交。确认后我会逐步为你完成每个任务哦！")
+        create_assistant_message(response)
     ]
     
     save_conversation(conversation_id, messages, mode="taskPlanning")
     
-    return {
-        "response": f"我来帮你分析这个任务～这是一个比较复杂的问题，我把它拆解成了以下几个步骤：\n\n{decomposed_tasks}\n\n请确认这些步骤是否合适，或者你可以编辑后提交。确认后我会逐步为你完成每个任务哦！",
+    result = {
+        "response": response,
         "conversation_id": conversation_id,
         "mode": "taskPlanning",
         "decomposed_tasks": decomposed_tasks,
         "original_question": user_input,
         "status": "waiting_confirmation"
     }
+    if suggestion:
+        result["plan_suggestion"] = {
+            "question": suggestion["question"],
+            "similarity": suggestion["similarity"]
+        }
+    return result
 
-async def confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, original_question, modified_todo_content=None):
-    """使用新的任务分配器确认并执行任务"""
+async def confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, original_question, modified_todo_content=None,
+                                        on_event=None, completed_results=None, on_result=None, force_refresh=False,
+                                        deadline=None):
+    """使用新的任务分配器确认并执行任务
+    
+    on_event用于接收执行进度事件；completed_results为已保存的子任务结果（恢复执行时复用），
+    on_result在每个子任务完成后回调，用于保存检查点；
+    同一对话中未修改的任务会复用之前的结果，force_refresh为True时全部重新执行；
+    汇总超过时间预算时先返回备用格式的报告，模型汇总完成后替换对话记录并发送summary_ready事件；
+    deadline为请求的截止时间（Deadline），超时或取消时停止未完成的任务，用已完成的结果生成报告"""
+    deadline = deadline or Deadline()
     try:
         # 重构任务为markdown格式
         todo_content = "# TODO\n\n"
@@ -202,7 +249,11 @@ async def confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, origin
         
         # 获取任务分配器并执行任务
         dispatcher = await get_task_dispatcher()
-        cache_key = await dispatcher.dispatch_and_execute_tasks(original_question, todo_content)
+        plan_memory = PlanMemory(load_task_memory(conversation_id))
+        cache_key = await dispatcher.dispatch_and_execute_tasks(original_question, todo_content, on_event,
+                                                                completed_results, on_result,
+                                                                plan_memory, force_refresh, deadline)
+        save_task_memory(conversation_id, plan_memory.to_dict())
         
         log_success(f"所有任务执行完成，缓存键: {cache_key}")
         
@@ -213,7 +264,34 @@ async def confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, origin
         
         # 使用任务汇总器生成最终响应
         summarizer = TaskSummarizer()
-        final_response = summarizer.generate_final_response(cache_data)
+        on_delta = None
+        if on_event is not None:
+            on_delta = lambda delta: emit_event(on_event, EVENT_SUMMARY_DELTA, delta=delta)
+        # 对话记录保存后才能替换其中的报告
+        conversation_saved = threading.Event()
+        
+        def on_upgrade(content, summary_seconds):
+            if not conversation_saved.wait(timeout=60):
+                log_error("对话记录未保存，放弃替换汇总内容")
+                return
+            replace_assistant_message(conversation_id, final_response["response"], content)
+            emit_event(on_event, EVENT_SUMMARY_READY, response=content, conversation_id=conversation_id,
+                       summary_seconds=summary_seconds)
+        
+        if deadline.expired:
+            # 请求已超时或取消，不再等待模型，直接用备用格式整理已完成的结果
+            interrupted = TASK_CANCELLED if deadline.cancelled else TASK_TIMEOUT
+            log_info(f"请求未在截止时间内完成（{interrupted}），返回部分结果")
+            final_response = summarizer.generate_final_response(cache_data, on_delta, fallback_only=True)
+        else:
+            interrupted = None
+            # 汇总的时间预算不超过请求的剩余时间
+            remaining = deadline.remaining()
+            summary_deadline = SUMMARY_DEADLINE_SECONDS
+            if remaining is not None:
+                summary_deadline = min(summary_deadline, remaining) if summary_deadline > 0 else remaining
+            final_response = summarizer.generate_final_response(cache_data, on_delta, summary_deadline, on_upgrade)
+        final_response["interrupted"] = interrupted
         
         # 更新对话记录（使用工具函数创建消息）
         messages = load_conversation(conversation_id)
@@ -230,6 +308,7 @@ async def confirm_and_execute_tasks_new(conversation_id, confirmed_tasks, origin
         messages.append(create_user_message(user_confirmation_content))
         messages.append(create_assistant_message(final_response["response"]))
         save_conversation(conversation_id, messages)
+        conversation_saved.set()
         
         # 添加对话ID到响应
         final_response["conversation_id"] = conversation_id
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.log_manager import log_success, log_task
+
+# 全局最大并发任务数
+MAX_CONCURRENT_TASKS = 6
+# 每种Agent的最大并发任务数
+AGENT_CONCURRENCY_LIMITS = {
+    "photo": 2,
+    "text": 4,
+    "web_search": 4
+}
+DEFAULT_AGENT_CONCURRENCY = 4
+
+
+class TaskNode:
+    """依赖图中的任务节点"""
+
+    def __init__(self, node_id: str, agent_type: str, todos: List[str], indexes: List[int],
+                 depends_on: Optional[List[str]] = None):
+        self.node_id = node_id
+        self.agent_type = agent_type
+        self.todos = todos            # 节点包含的任务（批量图片节点包含多个）
+        self.indexes = indexes        # 任务在计划中的序号（从0开始）
+        self.depends_on = depends_on or []
+        self.results: List[Dict[str, Any]] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+def build_task_graph(todo_items: List[str], agent_types: List[str],
+                     dependencies: List[List[int]]) -> List[TaskNode]:
+    """
+    根据任务、分类和依赖关系构建任务依赖图
+
+    没有前置依赖的多个图片任务会合并为一个批量节点，其余任务各自成为一个节点
+
+    Args:
+        todo_items: 任务列表
+        agent_types: 与任务一一对应的Agent类型
+        dependencies: 每个任务依赖的前置任务序号（从0开始，只能指向更早的任务）
+
+    Returns:
+        List[TaskNode]: 任务节点列表
+    """
+    batch_photo_indexes = [i for i, agent_type in enumerate(agent_types)
+                           if agent_type == "photo" and not dependencies[i]]
+    if len(batch_photo_indexes) < 2:
+        batch_photo_indexes = []
+
+    nodes = []
+    node_of_index = {}
+    if batch_photo_indexes:
+        batch_node = TaskNode("photo_batch", "photo",
+                              [todo_items[i] for i in batch_photo_indexes], batch_photo_indexes)
+        nodes.append(batch_node)
+        for i in batch_photo_indexes:
+            node_of_index[i] = batch_node.node_id
+
+    for i, todo in enumerate(todo_items):
+        if i in node_of_index:
+            continue
+        node = TaskNode(f"task_{i + 1}", agent_types[i], [todo], [i])
+        node_of_index[i] = node.node_id
+        nodes.append(node)
+
+    for node in nodes:
+        upstream = []
+        for i in node.indexes:
+            for dep in dependencies[i]:
+                dep_node = node_of_index[dep]
+                if dep_node != node.node_id and dep_node not in upstream:
+                    upstream.append(dep_node)
+        node.depends_on = upstream
+
+    return nodes
+
+
+class DAGScheduler:
+    """按依赖关系调度任务：就绪的任务并发执行，受全局和每种Agent的并发上限约束"""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_TASKS,
+                 agent_limits: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max_concurrency
+        self.agent_limits = agent_limits or AGENT_CONCURRENCY_LIMITS
+
+    async def run(self, nodes: List[TaskNode],
+                  execute: Callable[[TaskNode, List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]) -> Dict[str, Any]:
+        """
+        执行任务依赖图
+
+        Args:
+            nodes: 任务节点列表
+            execute: 执行单个节点的协程函数，参数为节点和上游任务的结果，返回该节点的结果列表
+
+        Returns:
+            Dict[str, Any]: 执行耗时统计，包含关键路径
+        """
+        node_map = {node.node_id: node for node in nodes}
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        agent_limits = {}
+        done_events = {node.node_id: asyncio.Event() for node in nodes}
+        started = time.monotonic()
+
+        async def run_node(node: TaskNode):
+            # 等待所有上游任务完成
+            for dep in node.depends_on:
+                await done_events[dep].wait()
+            upstream_results = [result for dep in node.depends_on for result in node_map[dep].results]
+
+            agent_limit = agent_limits.setdefault(
+                node.agent_type,
+                asyncio.Semaphore(self.agent_limits.get(node.agent_type, DEFAULT_AGENT_CONCURRENCY))
+            )
+            try:
+                async with global_limit, agent_limit:
+                    node.started_at = time.monotonic()
+                    if node.depends_on:
+                        log_task(f"任务节点 {node.node_id} 的前置任务已完成，开始执行")
+                    node.results = await execute(node, upstream_results)
+            finally:
+                if node.started_at is not None:
+                    node.finished_at = time.monotonic()
+                done_events[node.node_id].set()
+
+        await asyncio.gather(*(run_node(node) for node in nodes))
+        return self._timing_report(node_map, started, time.monotonic())
+
+    @staticmethod
+    def _timing_report(node_map: Dict[str, TaskNode], started: float, finished: float) -> Dict[str, Any]:
+        """计算关键路径（按依赖关系累计耗时最长的链路）"""
+        path_cost = {}
+        path_prev = {}
+
+        def cost(node_id: str) -> float:
+            if node_id not in path_cost:
+                node = node_map[node_id]
+                best_prev, best_cost = None, 0.0
+                for dep in node.depends_on:
+                    if cost(dep) > best_cost:
+                        best_prev, best_cost = dep, cost(dep)
+                path_prev[node_id] = best_prev
+                path_cost[node_id] = best_cost + node.duration
+            return path_cost[node_id]
+
+        end_node = max(node_map, key=cost) if node_map else None
+        critical_path = []
+        while end_node:
+            critical_path.append(end_node)
+            end_node = path_prev[end_node]
+        critical_path.reverse()
+
+        report = {
+            "wall_seconds": round(finished - started, 3),
+            "critical_path": critical_path,
+            "critical_path_seconds": round(path_cost.get(critical_path[-1], 0.0), 3) if critical_path else 0.0,
+            "total_task_seconds": round(sum(node.duration for node in node_map.values()), 3),
+            "node_seconds": {node_id: round(node.duration, 3) for node_id, node in node_map.items()}
+        }
+        log_success(f"任务调度完成，总耗时 {report['wall_seconds']}s，关键路径 {' -> '.join(critical_path)} "
+                    f"({report['critical_path_seconds']}s)，任务累计耗时 {report['total_task_seconds']}s")
+        return report
@@ -1,13 +1,49 @@
 import json
-from typing import Dict, Any, List
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Callable, Optional
 from config import get_openai_qwen_client, QWEN_MODEL
 from utils.log_manager import log_info, log_success, log_error, log_task
+from utils.search_rerank import rerank_results, apply_budget, budget_to_chars
+from utils.token_utils import estimate_tokens
+from utils.prompt_encoder import encode_tasks
+from utils.deadline import TASK_CANCELLED, TASK_TIMEOUT
+
+# 每个任务中搜索结果文本的token预算
+SEARCH_TOKEN_BUDGET_PER_TASK = 2000
+
+# 汇总时每个任务结果的token预算
+PROMPT_TOKENS_PER_TASK = 2000
+
+# 输入超过该token数时改为分组汇总（map-reduce），否则一次性汇总
+SINGLE_SHOT_MAX_INPUT_TOKENS = 6000
+# 分组汇总时每组的输入token上限和任务数上限
+MAP_GROUP_MAX_TOKENS = 4000
+MAP_GROUP_MAX_TASKS = 3
+# 分组汇总的并发数和每组的输出token上限
+MAP_CONCURRENCY = 4
+MAP_MAX_OUTPUT_TOKENS = 1500
+
+CHINESE_DIGITS = "零一二三四五六七八九"
+
+
+def chinese_number(n: int) -> str:
+    """将1-99的数字转换为中文数字，用于报告的段落标题"""
+    if n < 1 or n > 99:
+        return str(n)
+    tens, ones = divmod(n, 10)
+    if tens == 0:
+        return CHINESE_DIGITS[ones]
+    prefix = "十" if tens == 1 else CHINESE_DIGITS[tens] + "十"
+    return prefix + (CHINESE_DIGITS[ones] if ones else "")
 
 class TaskSummarizer:
     """任务汇总与生成节点"""
     
     def __init__(self):
         self.client = get_openai_qwen_client()
+        self.input_tokens = 0  # 最近一次汇总的输入token估算
+        self.used_fallback = False  # 最近一次汇总是否使用了备用格式
     
     def format_results_for_display(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """整理任务结果数据，返回结构化数据供大模型处理"""
@@ -32,7 +68,7 @@ class TaskSummarizer:
                 "tool_results": []
             }
             
-            if status == "error":
+            if status in ("error", TASK_TIMEOUT, TASK_CANCELLED):
                 log_error(f"任务 {i} 执行失败: {content}")
                 task_data["error_message"] = content
                 structured_results.append(task_data)
@@ -47,23 +83,31 @@ class TaskSummarizer:
                 try:
                     result_json = json.loads(result_content)
                     
-                    if tool_name == "generate_image" and result_json.get("status") == "success":
-                        # 图片生成结果
-                        web_path = result_json.get("web_path", "")
-                        prompt = result_json.get("prompt", "")
-                        filename = result_json.get("filename", "")
-                        log_success(f"图片生成成功: {filename}")
-                        
-                        description = prompt if prompt else (filename if filename else "生成的图片")
-                        
-                        if web_path:
-                            task_data["tool_results"].append({
-                                "type": "image",
-                                "tool_name": tool_name,
-                                "path": web_path,
-                                "description": description,
-                                "filename": filename
-                            })
+                    if tool_name in ["generate_image", "get_image_job"] and result_json.get("status") in ["success", "pending"]:
+                        # 图片生成结果（批量生成时包含images列表）
+                        for image_json in result_json.get("images") or [result_json]:
+                            if image_json.get("status") not in ["success", "pending"]:
+                                log_error(f"图片生成失败: {image_json.get('message', '')}")
+                                continue
+                            web_path = image_json.get("web_path", "")
+                            prompt = image_json.get("prompt", "")
+                            filename = image_json.get("filename", "")
+                            if image_json.get("status") == "pending":
+                                # 图片仍在后台生成，web_path为占位地址，生成完成后自动显示
+                                log_info(f"图片生成中: {image_json.get('job_id', '')}")
+                            else:
+                                log_success(f"图片生成成功: {filename}")
+                            
+                            description = prompt if prompt else (filename if filename else "生成的图片")
+                            
+                            if web_path:
+                                task_data["tool_results"].append({
+                                    "type": "image",
+                                    "tool_name": tool_name,
+                                    "path": web_path,
+                                    "description": description,
+                                    "filename": filename
+                                })
                     elif tool_name in ["get_weather", "get_current_time"] and result_json.get("status") == "success":
                         # 文字工具结果
                         log_success(f"{tool_name} 工具调用成功")
@@ -76,6 +120,8 @@ class TaskSummarizer:
                         # 网页搜索结果
                         search_count = result_json.get("total_results", 0)
                         log_success(f"网页搜索成功，找到 {search_count} 个结果")
+                        result_json["results"] = rerank_results(result_json.get("query", ""),
+                                                                result_json.get("results", []))
                         task_data["tool_results"].append({
                             "type": "web_search",
                             "tool_name": tool_name,
@@ -89,14 +135,33 @@ class TaskSummarizer:
                         "content": result_content
                     })
             
+            self._apply_search_budget(task_data)
             structured_results.append(task_data)
         
         log_success(f"数据整理完成，共处理 {len(structured_results)} 个任务")
         return structured_results
     
-    def summarize_all_results(self, original_question: str, todo_content: str, results: List[Dict[str, Any]]) -> str:
-        """汇总所有子Agent的输出"""
+    def _apply_search_budget(self, task_data: Dict[str, Any]):
+        """按每个任务的token预算裁剪搜索结果，多次搜索平分预算"""
+        search_entries = [tr for tr in task_data["tool_results"] if tr.get("type") == "web_search"]
+        if not search_entries:
+            return
+        
+        tokens_per_search = SEARCH_TOKEN_BUDGET_PER_TASK // len(search_entries)
+        for entry in search_entries:
+            data = entry["data"]
+            results = data.get("results", [])
+            sample_text = "".join(str(r.get("snippet") or "") + str(r.get("summary") or "") for r in results)
+            char_budget = budget_to_chars(tokens_per_search, sample_text)
+            data["results"] = apply_budget(results, char_budget)
+            data["total_results"] = len(data["results"])
+        log_info(f"搜索结果已按预算裁剪，每次搜索约 {tokens_per_search} tokens")
+    
+    def summarize_all_results(self, original_question: str, todo_content: str, results: List[Dict[str, Any]],
+                              on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """汇总所有子Agent的输出，传入on_delta时以流式方式生成并逐段回调"""
         log_task("开始汇总所有任务结果")
+        self.used_fallback = False
         try:
             # 整理所有结果数据
             structured_results = self.format_results_for_display(results)
@@ -110,18 +175,16 @@ class TaskSummarizer:
                     if line and (line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')) or line[0].isdigit()):
                         todo_list.append(line)
             
-            # 构建结构化的输入数据
-            task_data_for_model = []
-            for i, task in enumerate(structured_results):
-                task_info = {
-                    "todo_number": task.get("task_number", i+1),
-                    "todo_content": task.get("todo", ""),
-                    "status": task.get("status", ""),
-                    "ai_generated_content": task.get("ai_content", ""),
-                    "tool_results": task.get("tool_results", []),
-                    "error_message": task.get("error_message", "")
-                }
-                task_data_for_model.append(task_info)
+            # 将任务结果编码为紧凑文本，只保留报告需要的字段并按任务预算截断
+            task_blocks, task_tokens = encode_tasks(structured_results, PROMPT_TOKENS_PER_TASK)
+            input_tokens = estimate_tokens(todo_content) + task_tokens
+            self.input_tokens = input_tokens
+            log_info(f"汇总输入约 {input_tokens} tokens（{len(task_blocks)} 个任务）")
+            
+            # 输入过长时分组汇总，避免超出上下文或截断报告
+            if input_tokens > SINGLE_SHOT_MAX_INPUT_TOKENS and len(task_blocks) > 1:
+                log_info("汇总输入较长，使用分组汇总")
+                return self._map_reduce_summary(original_question, structured_results, task_blocks, on_delta)
             
             # 构建强化的系统提示词
             system_prompt = """你是一个专业的任务报告生成专家。你的任务是根据TODO列表和对应的执行结果，生成一份完整的报告。
@@ -149,8 +212,8 @@ class TaskSummarizer:
 任务分解列表：
 {todo_content}
 
-任务执行结果数据：
-{json.dumps(task_data_for_model, ensure_ascii=False, indent=2)}
+任务执行结果：
+{chr(10).join(task_blocks)}
 
 请严格按照TODO顺序生成报告，每个TODO项必须有对应的输出段落。"""
             
@@ -162,15 +225,20 @@ class TaskSummarizer:
                     {"role": "user", "content": user_message}
                 ],
                 max_tokens=3000,
-                temperature=0.2
+                temperature=0.2,
+                stream=on_delta is not None
             )
             
-            summarized_content = response.choices[0].message.content.strip()
+            if on_delta is not None:
+                summarized_content = self._collect_stream(response, on_delta).strip()
+            else:
+                summarized_content = response.choices[0].message.content.strip()
             log_success(f"汇总完成，生成内容长度: {len(summarized_content)} 字符")
             
             # 如果汇总失败，返回简单的备用格式
             if not summarized_content:
                 log_error("汇总内容为空，返回备用格式")
+                self.used_fallback = True
                 return self._generate_fallback_summary(structured_results)
             
             return summarized_content
@@ -178,14 +246,131 @@ class TaskSummarizer:
         except Exception as e:
             log_error(f"汇总结果失败: {e}")
             # 如果汇总失败，返回备用格式
+            self.used_fallback = True
             return self._generate_fallback_summary(self.format_results_for_display(results))
     
-    def _generate_fallback_summary(self, structured_results: List[Dict[str, Any]]) -> str:
-        """生成备用汇总格式，确保按TODO顺序输出"""
+    @staticmethod
+    def _collect_stream(response, on_delta: Callable[[str], None]) -> str:
+        """读取流式响应，每收到一段内容就回调一次，返回完整内容"""
+        parts = []
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+        return "".join(parts)
+    
+    def _group_tasks(self, task_blocks: List[str]) -> List[List[int]]:
+        """按token预算将相邻任务分组，返回每组任务在列表中的下标"""
+        groups = []
+        current, current_tokens = [], 0
+        for i, block in enumerate(task_blocks):
+            tokens = estimate_tokens(block)
+            if current and (current_tokens + tokens > MAP_GROUP_MAX_TOKENS or len(current) >= MAP_GROUP_MAX_TASKS):
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+    
+    @staticmethod
+    def _heading(task: Dict[str, Any]) -> str:
+        return f"**{chinese_number(task['task_number'])}、"
+    
+    def _summarize_group(self, original_question: str, group_tasks: List[Dict[str, Any]], group_blocks: List[str]) -> str:
+        """为一组任务生成报告段落"""
+        headings = "\n".join(f"{self._heading(task)}{task.get('todo', '')}**" for task in group_tasks)
+        system_prompt = f"""你是一个专业的任务报告生成专家。你需要为完整报告中的一部分任务撰写段落。
+
+**严格要求**：
+1. 只为给定的任务撰写段落，按给定顺序输出，每个任务一个段落
+2. 每个段落必须以对应的标题开头，标题必须与下面给出的完全一致：
+{headings}
+3. **图片保留**：必须保持![description](path)格式不变，原样输出
+4. 不要添加总结、前言或其他标题，不使用#标题
+
+请直接输出段落内容。"""
+        user_message = f"""用户的原始问题：{original_question}
+
+任务执行结果：
+{chr(10).join(group_blocks)}"""
+        
+        response = self.client.chat.completions.create(
+            model=QWEN_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            max_tokens=MAP_MAX_OUTPUT_TOKENS,
+            temperature=0.2
+        )
+        return (response.choices[0].message.content or "").strip()
+    
+    def _merge_group_sections(self, text: str, group_tasks: List[Dict[str, Any]]) -> Optional[str]:
+        """校验分组段落的标题顺序并补回遗漏的图片，标题缺失或顺序错误时返回None"""
+        positions = []
+        search_from = 0
+        for task in group_tasks:
+            position = text.find(self._heading(task), search_from)
+            if position < 0:
+                return None
+            positions.append(position)
+            search_from = position + 1
+        
+        sections = []
+        for i, task in enumerate(group_tasks):
+            end = positions[i + 1] if i + 1 < len(positions) else len(text)
+            section = text[positions[i]:end].rstrip()
+            for tool_result in task.get("tool_results", []):
+                path = tool_result.get("path", "")
+                if tool_result.get("type") == "image" and path and f"]({path})" not in section:
+                    section += f"\n\n![{tool_result.get('description', '')}]({path})"
+            sections.append(section)
+        return "\n\n".join(sections)
+    
+    def _map_reduce_summary(self, original_question: str, structured_results: List[Dict[str, Any]],
+                            task_blocks: List[str], on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """分组并发汇总各任务，再按TODO顺序合并；单组失败时该组使用备用格式"""
+        groups = self._group_tasks(task_blocks)
+        log_info(f"分组汇总：{len(task_blocks)} 个任务分为 {len(groups)} 组")
+        
+        merged_sections = []
+        with ThreadPoolExecutor(max_workers=MAP_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(self._summarize_group, original_question,
+                                [structured_results[i] for i in group], [task_blocks[i] for i in group])
+                for group in groups
+            ]
+            # 按顺序等待各组结果，前面的组完成后即可流式输出
+            for group, future in zip(groups, futures):
+                group_tasks = [structured_results[i] for i in group]
+                section = None
+                try:
+                    section = self._merge_group_sections(future.result(), group_tasks)
+                    if section is None:
+                        log_error(f"第 {group[0] + 1} 个任务起的分组汇总标题不完整，使用备用格式")
+                except Exception as e:
+                    log_error(f"第 {group[0] + 1} 个任务起的分组汇总失败: {e}")
+                if not section:
+                    section = self._generate_fallback_summary(group_tasks, start_index=group[0]).strip()
+                
+                if on_delta is not None:
+                    on_delta(("\n\n" if merged_sections else "") + section)
+                merged_sections.append(section)
+        
+        summarized_content = "\n\n".join(merged_sections)
+        log_success(f"分组汇总完成，生成内容长度: {len(summarized_content)} 字符")
+        return summarized_content
+    
+    def _generate_fallback_summary(self, structured_results: List[Dict[str, Any]], start_index: int = 0) -> str:
+        """生成备用汇总格式，确保按TODO顺序输出，start_index为第一个任务在整个计划中的序号（从0开始）"""
         fallback_content = ""
-        chinese_numbers = ["一", "二", "三", "四", "五", "六", "七", "八", "九", "十"]
         
-        for i, task in enumerate(structured_results):
+        for i, task in enumerate(structured_results, start_index):
             todo = task.get("todo", "")
             status = task.get("status", "")
             ai_content = task.get("ai_content", "")
@@ -193,12 +378,14 @@ class TaskSummarizer:
             error_message = task.get("error_message", "")
             
             # 使用中文数字标题
-            number = chinese_numbers[i] if i < len(chinese_numbers) else str(i+1)
-            fallback_content += f"\n**{number}、{todo}**\n\n"
+            fallback_content += f"\n**{chinese_number(i + 1)}、{todo}**\n\n"
             
             if status == "error":
                 fallback_content += f"❌ {error_message}\n\n"
                 continue
+            if status in (TASK_TIMEOUT, TASK_CANCELLED):
+                fallback_content += f"⏱️ {error_message}\n\n"
+                continue
             
             # 添加AI生成的内容
             if ai_content:
@@ -228,24 +415,53 @@ class TaskSummarizer:
         
         return fallback_content
     
-    def generate_final_response(self, cache_data: Dict[str, Any]) -> Dict[str, Any]:
-        """生成最终的响应数据"""
+    def generate_final_response(self, cache_data: Dict[str, Any],
+                                on_delta: Optional[Callable[[str], None]] = None,
+                                deadline: Optional[float] = None,
+                                on_upgrade: Optional[Callable[[str, float], None]] = None,
+                                fallback_only: bool = False) -> Dict[str, Any]:
+        """
+        生成最终的响应数据
+        
+        Args:
+            cache_data: 任务执行结果
+            on_delta: 用于流式接收汇总内容
+            deadline: 汇总的时间预算（秒），超时后立即返回备用格式的报告，不设置时一直等待模型
+            on_upgrade: 超时后模型汇总完成时回调（汇总内容, 汇总耗时），用于替换备用格式的报告
+            fallback_only: 为True时不调用模型，直接返回备用格式的报告（请求已超时或取消时使用）
+            
+        Returns:
+            Dict[str, Any]: 响应数据，summary_pending为True表示模型汇总仍在进行
+        """
         log_task("开始生成最终响应数据")
         original_question = cache_data.get("original_question", "")
         todo_content = cache_data.get("todo_content", "")
         results = cache_data.get("results", [])
         
         # 汇总所有结果
-        final_content = self.summarize_all_results(original_question, todo_content, results)
+        started = time.monotonic()
+        timed_out = False
+        if fallback_only:
+            self.used_fallback = True
+            final_content = self._generate_fallback_summary(self.format_results_for_display(results))
+        elif deadline is None or deadline <= 0:
+            final_content = self.summarize_all_results(original_question, todo_content, results, on_delta)
+        else:
+            final_content, timed_out = self._summarize_with_deadline(
+                original_question, todo_content, results, on_delta, deadline, on_upgrade, started)
+        summary_pending = timed_out and on_upgrade is not None
+        summary_seconds = round(time.monotonic() - started, 3)
+        log_info(f"汇总耗时 {summary_seconds}s，输入约 {self.input_tokens} tokens")
         
         # 统计执行结果
         total_tasks = len(results)
         successful_tasks = len([r for r in results if r.get("status") == "success"])
         failed_tasks = total_tasks - successful_tasks
+        interrupted_tasks = len([r for r in results if r.get("status") in (TASK_TIMEOUT, TASK_CANCELLED)])
         
         # 检查是否有图片生成
         has_images = any(
-            any(tr.get("tool_name") == "generate_image" for tr in r.get("tool_results", []))
+            any(tr.get("tool_name") in ["generate_image", "get_image_job"] for tr in r.get("tool_results", []))
             for r in results
         )
         
@@ -265,9 +481,58 @@ class TaskSummarizer:
                 "total_tasks": total_tasks,
                 "successful_tasks": successful_tasks,
                 "failed_tasks": failed_tasks,
+                "interrupted_tasks": interrupted_tasks,
                 "has_images": has_images,
                 "has_web_search": has_web_search,
-                "execution_time": cache_data.get("timestamp", "")
+                "execution_time": cache_data.get("timestamp", ""),
+                "timing": cache_data.get("timing", {}),
+                "reused_tasks": cache_data.get("reused_tasks", 0),
+                "summary_input_tokens": self.input_tokens,
+                "summary_seconds": summary_seconds,
+                "summary_mode": "fallback" if timed_out or self.used_fallback else "llm"
             },
+            "summary_pending": summary_pending,
             "detailed_results": results
-        }
\ No newline at end of file
+        }
+    
+    def _summarize_with_deadline(self, original_question: str, todo_content: str, results: List[Dict[str, Any]],
+                                 on_delta: Optional[Callable[[str], None]], deadline: float,
+                                 on_upgrade: Optional[Callable[[str, float], None]], started: float):
+        """在后台线程中汇总，超过时间预算时返回备用格式，返回（汇总内容, 是否超时）"""
+        timed_out = False
+        
+        def forward_delta(delta: str):
+            # 超时后不再推送模型的流式内容，避免与备用格式的报告混在一起
+            if not timed_out:
+                on_delta(delta)
+        
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        future = executor.submit(self.summarize_all_results, original_question, todo_content, results,
+                                 forward_delta if on_delta is not None else None)
+        executor.shutdown(wait=False)
+        try:
+            return future.result(timeout=deadline), False
+        except FutureTimeoutError:
+            timed_out = True
+        
+        log_info(f"汇总超过时间预算 {deadline}s，先返回备用格式")
+        fallback_content = self._generate_fallback_summary(self.format_results_for_display(results))
+        
+        def upgrade(done_future):
+            try:
+                content = done_future.result()
+            except Exception as e:
+                log_error(f"后台汇总失败: {e}")
+                return
+            if self.used_fallback or not content:
+                return
+            summary_seconds = round(time.monotonic() - started, 3)
+            log_success(f"后台汇总完成，耗时 {summary_seconds}s")
+            try:
+                on_upgrade(content, summary_seconds)
+            except Exception as e:
+                log_error(f"替换汇总内容失败: {e}")
+        
+        if on_upgrade is not None:
+            future.add_done_callback(upgrade)
+        return fallback_content, True
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""测试公共夹具：本地HTTP服务器、按路径加载MCP服务器模块"""
+import importlib.util
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LocalServer:
+    """在后台线程中运行的HTTP服务器，routes为 路径 -> (状态码, 响应头, 响应体)"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                status, headers, body = server.routes.get(self.path.split("?")[0], (404, {}, b"not found"))
+                body = body.encode("utf-8") if isinstance(body, str) else body
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    servers = []
+
+    def start(routes):
+        server = LocalServer(routes)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def load_mcp_server(name):
+    """按文件路径导入MCP_server目录下的服务器模块（该目录不是包）"""
+    path = os.path.join(PROJECT_ROOT, "MCP_server", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(f"mcp_server_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,51 @@
+"""请求准入控制：事件循环中排队的请求与线程共用名额，超时或取消后移出排队"""
+import asyncio
+import threading
+
+import pytest
+
+from utils.admission import AdmissionController, AdmissionRejected, CLASS_CHAT
+
+
+def controller(queue_timeout=1.0):
+    return AdmissionController(1, [{"name": CLASS_CHAT, "limit": 1, "max_queue": 4, "queue_timeout": queue_timeout}])
+
+
+def test_async_waiter_is_granted_when_thread_releases():
+    admission = controller()
+    admission.acquire(CLASS_CHAT, "conv-1")
+    threading.Timer(0.1, admission.release, args=(CLASS_CHAT,)).start()
+
+    async def admitted():
+        async with admission.admit_async(CLASS_CHAT, "conv-2"):
+            return admission.stats()["running"]
+
+    assert asyncio.run(admitted()) == 1
+    assert admission.stats()["running"] == 0
+
+
+def test_async_queue_timeout_is_rejected():
+    admission = controller(queue_timeout=0.1)
+    admission.acquire(CLASS_CHAT)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(admission.acquire_async(CLASS_CHAT))
+    assert rejected.value.status_code == 503
+    assert admission.stats()["classes"][CLASS_CHAT]["queued"] == 0
+
+
+def test_cancelled_async_waiter_leaves_queue():
+    admission = controller()
+    admission.acquire(CLASS_CHAT)
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(admission.acquire_async(CLASS_CHAT))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel_waiter())
+
+    assert admission.stats()["classes"][CLASS_CHAT]["queued"] == 0
+    admission.release(CLASS_CHAT)
+    assert admission.stats()["running"] == 0
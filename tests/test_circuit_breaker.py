@@ -0,0 +1,71 @@
+"""外部依赖熔断：状态转换，以及MCP天气工具在熔断时立即返回错误"""
+import asyncio
+import json
+
+import pytest
+
+from conftest import load_mcp_server
+from utils import circuit_breaker
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, \
+    get_breaker_states
+
+
+def open_breaker(breaker):
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.acquire()
+        breaker.record(0.01, True)
+
+
+def test_opens_after_failure_rate_threshold(tmp_path):
+    db_path = str(tmp_path / "state.sqlite3")
+    breaker = CircuitBreaker("stub", db_path, slow_call_seconds=3)
+    open_breaker(breaker)
+
+    assert get_breaker_states(db_path)["stub"]["state"] == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_half_open_probe_closes_breaker(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "state.sqlite3")
+    breaker = CircuitBreaker("stub", db_path, slow_call_seconds=3)
+    open_breaker(breaker)
+    monkeypatch.setattr(circuit_breaker, "OPEN_SECONDS", 0)
+
+    assert get_breaker_states(db_path)["stub"]["state"] == STATE_HALF_OPEN
+    breaker.acquire()
+    # 探测请求进行中时其他请求被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    breaker.record(0.01, False)
+    assert get_breaker_states(db_path)["stub"]["state"] == STATE_CLOSED
+
+
+def test_slow_calls_count_as_failures(tmp_path):
+    db_path = str(tmp_path / "state.sqlite3")
+    breaker = CircuitBreaker("stub", db_path, slow_call_seconds=1)
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.acquire()
+        breaker.record(2.0, False)
+
+    assert get_breaker_states(db_path)["stub"]["state"] == STATE_OPEN
+
+
+def test_mcp_weather_tool_uses_breaker(tmp_path, local_server, monkeypatch):
+    server = local_server({"/weather": (500, {}, "error")})
+    weather_server = load_mcp_server("text_generator_server")
+    monkeypatch.setattr(weather_server, "WEATHER_URL", f"{server.url}/weather")
+    monkeypatch.setattr(weather_server, "weather_breaker",
+                        CircuitBreaker("gaode_weather", str(tmp_path / "state.sqlite3"), slow_call_seconds=3))
+
+    for _ in range(circuit_breaker.MIN_CALLS):
+        result = json.loads(asyncio.run(weather_server.get_weather("杭州")))
+        assert result["status"] == "error"
+    assert len(server.requests) == circuit_breaker.MIN_CALLS
+
+    # 熔断打开后不再请求高德API
+    result = json.loads(asyncio.run(weather_server.get_weather("杭州")))
+    assert result["circuit"] == "gaode_weather"
+    assert len(server.requests) == circuit_breaker.MIN_CALLS
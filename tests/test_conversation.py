@@ -0,0 +1,78 @@
+"""对话标题缓存：生成中的占位记录带开始时间，过期后重新生成，不会写入对话文件"""
+import json
+import threading
+import time
+
+import pytest
+
+import conversation
+from utils.shared_state import SharedDict
+
+
+@pytest.fixture
+def summaries(tmp_path, monkeypatch):
+    cache = SharedDict(str(tmp_path / "state.sqlite3"), "conversation_summary")
+    monkeypatch.setattr(conversation, "conversation_summary_cache", cache)
+    monkeypatch.setattr(conversation, "CONVERSATIONS_DIR", str(tmp_path))
+    return cache
+
+
+def blocking_generator(monkeypatch, calls):
+    release = threading.Event()
+
+    def generate(message):
+        calls.append(message)
+        release.wait(5)
+        return "杭州旅游"
+    monkeypatch.setattr(conversation, "generate_conversation_summary", generate)
+    return release
+
+
+def wait_for_summary(conversation_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while conversation.get_cached_summary(conversation_id) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return conversation.get_cached_summary(conversation_id)
+
+
+def test_generates_summary_once_while_pending(summaries, monkeypatch):
+    calls = []
+    release = blocking_generator(monkeypatch, calls)
+
+    assert conversation.get_conversation_summary("conv", "杭州有什么好玩的") == conversation.SUMMARY_PLACEHOLDER
+    assert conversation.get_conversation_summary("conv", "杭州有什么好玩的") == conversation.SUMMARY_PLACEHOLDER
+    release.set()
+
+    assert wait_for_summary("conv") == "杭州旅游"
+    assert calls == ["杭州有什么好玩的"]
+
+
+def test_stale_placeholder_is_regenerated(summaries, monkeypatch):
+    calls = []
+    blocking_generator(monkeypatch, calls).set()
+    # 上次生成时进程已退出，只留下过期的占位记录
+    summaries["conv"] = {"pending_since": time.time() - conversation.SUMMARY_PENDING_TIMEOUT - 1, "token": "old"}
+
+    conversation.get_conversation_summary("conv", "杭州有什么好玩的")
+
+    assert wait_for_summary("conv") == "杭州旅游"
+    assert calls == ["杭州有什么好玩的"]
+
+
+def test_legacy_placeholder_is_treated_as_missing(summaries, monkeypatch):
+    calls = []
+    blocking_generator(monkeypatch, calls).set()
+    summaries["conv"] = conversation.SUMMARY_PLACEHOLDER
+
+    conversation.get_conversation_summary("conv", "杭州有什么好玩的")
+
+    assert wait_for_summary("conv") == "杭州旅游"
+
+
+def test_placeholder_is_not_saved_to_conversation_file(summaries, tmp_path):
+    conversation.mark_summary_pending("conv")
+
+    conversation.save_conversation("conv", [{"role": "user", "content": "你好"}])
+
+    with open(tmp_path / "conv.json", encoding="utf-8") as f:
+        assert "summary" not in json.load(f)
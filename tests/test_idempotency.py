@@ -0,0 +1,66 @@
+"""请求幂等：相同的键只执行一次，用于内容不同的请求时拒绝"""
+import asyncio
+
+import pytest
+
+from utils.idempotency import IdempotencyKeyMismatch, IdempotencyStore, client_key, fingerprint
+
+
+def counting(calls, result):
+    def compute():
+        calls.append(result)
+        return {"response": result}, 200
+    return compute
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / "state.sqlite3"), ttl=60, wait_seconds=1)
+
+
+def test_replays_same_key_and_payload(store):
+    calls = []
+    key, request_hash = client_key("chat", "abc"), fingerprint("conv", "你好", False)
+
+    first = store.run(key, counting(calls, "第一次"), request_hash=request_hash)
+    second = store.run(key, counting(calls, "第二次"), request_hash=request_hash)
+
+    assert first == ({"response": "第一次"}, 200, False)
+    assert second == ({"response": "第一次"}, 200, True)
+    assert calls == ["第一次"]
+
+
+def test_rejects_same_key_with_different_payload(store):
+    calls = []
+    key = client_key("chat", "abc")
+    store.run(key, counting(calls, "你好"), request_hash=fingerprint("conv", "你好", False))
+
+    with pytest.raises(IdempotencyKeyMismatch):
+        store.run(key, counting(calls, "再见"), request_hash=fingerprint("conv", "再见", False))
+    assert calls == ["你好"]
+    assert store.stats()["mismatches"] == 1
+
+
+def test_fingerprint_is_canonical():
+    assert fingerprint("conv", {"b": 1, "a": [1, 2]}) == fingerprint("conv", {"a": [1, 2], "b": 1})
+    assert fingerprint("conv", ["任务一"]) != fingerprint("conv", ["任务二"])
+
+
+def test_async_run_coalesces_concurrent_requests(store):
+    calls = []
+    key, request_hash = client_key("chat", "abc"), fingerprint("conv", "你好", False)
+
+    async def compute():
+        calls.append("你好")
+        await asyncio.sleep(0.3)
+        return {"response": "你好"}, 200
+
+    async def run_twice():
+        return await asyncio.gather(store.run_async(key, compute, request_hash=request_hash),
+                                    store.run_async(key, compute, request_hash=request_hash))
+
+    results = asyncio.run(run_twice())
+    assert sorted(replayed for _, _, replayed in results) == [False, True]
+    assert calls == ["你好"]
+    # 同步和异步请求共用记录
+    assert store.run(key, counting(calls, "再次"), request_hash=request_hash)[2] is True
@@ -0,0 +1,91 @@
+"""大模型响应缓存：切换到等价服务商后得到的响应不作为所请求模型的结果缓存"""
+import asyncio
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+
+from utils.llm_cache import AsyncCachedClient, CachedClient, LLMResponseCache
+from utils.model_router import AsyncRoutedClient, ModelRouter, RoutedClient
+
+_REQUEST = httpx.Request("POST", "http://stub.local/v1/chat/completions")
+REQUEST = {"model": "doubao-model", "messages": [{"role": "user", "content": "你好"}],
+           "temperature": 0.1, "max_tokens": 10}
+
+
+def completion(model, content):
+    return ChatCompletion.model_validate({
+        "id": "stub", "object": "chat.completion", "created": 0, "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]
+    })
+
+
+class StubClient:
+    """按顺序返回预设结果的OpenAI客户端，结果为异常时抛出"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def cached_router_client(primary, backup):
+    router = ModelRouter({"doubao": (lambda: primary, "doubao-model"), "deepseek": (lambda: backup, "deepseek-model")},
+                         {"doubao": ["deepseek"]}, degraded_p95_seconds=30)
+    cache = LLMResponseCache(max_entries=10, ttl=60)
+    return CachedClient(RoutedClient(router, "doubao"), cache), cache
+
+
+def test_failover_responses_are_not_cached():
+    primary = StubClient(openai.APIConnectionError(request=_REQUEST), completion("doubao-model", "豆包"))
+    backup = StubClient(completion("deepseek-model", "DeepSeek"))
+    client, cache = cached_router_client(primary, backup)
+
+    first = client.chat.completions.create(**REQUEST)
+    second = client.chat.completions.create(**REQUEST)
+
+    assert first.choices[0].message.content == "DeepSeek"
+    assert second.choices[0].message.content == "豆包"
+    assert len(primary.calls) == 2
+    assert cache.stats()["bypassed"] == {"failover": 1}
+
+
+def test_primary_responses_are_cached_without_route_tags():
+    primary = StubClient(completion("doubao-model", "豆包"))
+    client, cache = cached_router_client(primary, StubClient())
+
+    first = client.chat.completions.create(**REQUEST)
+    second = client.chat.completions.create(**REQUEST)
+
+    assert first.routed_provider == "doubao"
+    assert second.choices[0].message.content == "豆包"
+    assert len(primary.calls) == 1
+    assert "routed_model" not in cache.get(cache.make_key(REQUEST))
+
+
+class AsyncStubClient(StubClient):
+    async def create(self, **kwargs):
+        return StubClient.create(self, **kwargs)
+
+
+def test_async_client_shares_cache_with_sync_client():
+    primary = AsyncStubClient(completion("doubao-model", "豆包"))
+    router = ModelRouter({"doubao": (lambda: None, "doubao-model")}, {}, degraded_p95_seconds=30,
+                         async_providers={"doubao": lambda: primary})
+    cache = LLMResponseCache(max_entries=10, ttl=60)
+    client = AsyncCachedClient(AsyncRoutedClient(router, "doubao"), cache)
+
+    first = asyncio.run(client.chat.completions.create(**REQUEST))
+    second = asyncio.run(client.chat.completions.create(**REQUEST))
+
+    assert first.choices[0].message.content == second.choices[0].message.content == "豆包"
+    assert len(primary.calls) == 1
+    assert cache.get(cache.make_key(REQUEST)) is not None
@@ -0,0 +1,181 @@
+"""大模型限流器：429、超时和连接错误的重试策略"""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from utils import llm_governor
+from utils.llm_governor import AsyncGovernedClient, GovernedClient, GovernorTimeoutError, ProviderGovernor
+from utils.model_router import ModelRouter
+
+_REQUEST = httpx.Request("POST", "http://stub.local/v1/chat/completions")
+
+
+def rate_limited():
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=_REQUEST), body=None)
+
+
+class StubClient:
+    """按顺序返回预设结果的OpenAI客户端，结果为异常时抛出"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_governor, "BASE_BACKOFF_SECONDS", 0.01)
+
+
+def governed(stub):
+    return GovernedClient(stub, ProviderGovernor("stub", 6000, 10 ** 7, 4))
+
+
+def test_retries_connection_errors():
+    stub = StubClient(openai.APIConnectionError(request=_REQUEST), "ok")
+
+    assert governed(stub).chat.completions.create(messages=[]) == "ok"
+    assert len(stub.calls) == 2
+
+
+def test_timeouts_are_not_retried():
+    stub = StubClient(openai.APITimeoutError(request=_REQUEST), "ok")
+
+    with pytest.raises(openai.APITimeoutError):
+        governed(stub).chat.completions.create(messages=[], timeout=5)
+    assert len(stub.calls) == 1
+
+
+def test_retries_stay_within_timeout_budget(monkeypatch):
+    monkeypatch.setattr(llm_governor, "BASE_BACKOFF_SECONDS", 0.2)
+    stub = StubClient(openai.APIConnectionError(request=_REQUEST), openai.APIConnectionError(request=_REQUEST), "ok")
+
+    started = time.monotonic()
+    with pytest.raises(openai.APIConnectionError):
+        governed(stub).chat.completions.create(messages=[], timeout=0.3)
+    assert time.monotonic() - started < 0.3
+    # 第二次请求的超时是剩余的时间预算
+    assert len(stub.calls) == 2
+    assert stub.calls[1]["timeout"] < 0.3
+
+
+def test_rate_limits_are_retried_by_default():
+    stub = StubClient(rate_limited(), "ok")
+
+    assert governed(stub).chat.completions.create(messages=[]) == "ok"
+    assert len(stub.calls) == 2
+
+
+def test_rate_limits_raise_when_router_can_fail_over():
+    primary = StubClient(rate_limited(), "primary")
+    backup = StubClient("backup")
+    router = ModelRouter({"doubao": (lambda: governed(primary), "m1"), "deepseek": (lambda: governed(backup), "m2")},
+                         {"doubao": ["deepseek"]}, degraded_p95_seconds=30)
+
+    assert router.create("doubao", {"messages": []}) == "backup"
+    assert len(primary.calls) == 1
+    # 最后一个服务商仍在限流器中重试429
+    assert "retry_rate_limits" not in backup.calls[0]
+
+
+def test_slot_wait_is_bounded_by_timeout():
+    governor = ProviderGovernor("stub", 6000, 10 ** 7, 1)
+    stub = StubClient("ok")
+    governor.acquire(10)
+
+    started = time.monotonic()
+    with pytest.raises(GovernorTimeoutError):
+        GovernedClient(stub, governor).chat.completions.create(messages=[], timeout=0.1)
+    assert time.monotonic() - started < 0.5
+    assert stub.calls == []
+    assert governor.stats()["waiting"] == 0
+
+
+def test_rate_wait_is_bounded_by_timeout():
+    governor = ProviderGovernor("stub", 1, 10 ** 7, 4)
+    stub = StubClient("ok", "ok")
+    client = GovernedClient(stub, governor)
+    assert client.chat.completions.create(messages=[]) == "ok"
+
+    started = time.monotonic()
+    with pytest.raises(GovernorTimeoutError):
+        client.chat.completions.create(messages=[], timeout=1)
+    assert time.monotonic() - started < 0.5
+    assert len(stub.calls) == 1
+    # 放弃的请求不占用名额
+    assert governor.stats()["in_flight"] == 0
+
+
+def test_governor_timeout_fails_over():
+    # 每分钟只允许一个请求且已用完，排队时间必然超过预算
+    saturated = ProviderGovernor("doubao", 1, 10 ** 7, 4)
+    saturated.acquire(10)
+    saturated.release()
+    primary = StubClient("primary")
+    backup = StubClient("backup")
+    router = ModelRouter({"doubao": (lambda: GovernedClient(primary, saturated), "m1"),
+                          "deepseek": (lambda: governed(backup), "m2")},
+                         {"doubao": ["deepseek"]}, degraded_p95_seconds=30)
+
+    assert router.create("doubao", {"messages": [], "timeout": 1}) == "backup"
+    assert primary.calls == []
+
+
+class AsyncStubClient(StubClient):
+    """StubClient的异步版本，每次请求前等待delay秒"""
+
+    def __init__(self, *outcomes, delay=0.0):
+        super().__init__(*outcomes)
+        self.delay = delay
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return StubClient.create(self, **kwargs)
+
+
+def test_async_client_retries_connection_errors():
+    stub = AsyncStubClient(openai.APIConnectionError(request=_REQUEST), "ok")
+    client = AsyncGovernedClient(stub, ProviderGovernor("stub", 6000, 10 ** 7, 4))
+
+    assert asyncio.run(client.chat.completions.create(messages=[])) == "ok"
+    assert len(stub.calls) == 2
+
+
+def test_async_slot_wait_is_bounded_by_timeout():
+    governor = ProviderGovernor("stub", 6000, 10 ** 7, 1)
+    stub = AsyncStubClient("ok")
+    governor.acquire(10)
+
+    with pytest.raises(GovernorTimeoutError):
+        asyncio.run(AsyncGovernedClient(stub, governor).chat.completions.create(messages=[], timeout=0.1))
+    assert stub.calls == []
+    assert governor.stats()["waiting"] == 0
+
+
+def test_cancelled_async_request_releases_slot():
+    governor = ProviderGovernor("stub", 6000, 10 ** 7, 1)
+    client = AsyncGovernedClient(AsyncStubClient("ok", delay=5), governor)
+
+    async def cancel_request():
+        task = asyncio.ensure_future(client.chat.completions.create(messages=[]))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel_request())
+
+    assert governor.stats()["in_flight"] == 0
+    # 名额已归还，下一个请求无需等待
+    governor.acquire(10, expires_at=time.monotonic() + 0.1)
@@ -0,0 +1,22 @@
+"""日志捕获：使用共享日志缓冲区时日志只写入缓冲区，不在本进程队列中堆积"""
+from utils.log_manager import LogCapture
+from utils.shared_state import LogRing
+
+
+def test_ring_backed_capture_does_not_fill_local_queue(tmp_path):
+    capture = LogCapture(LogRing(str(tmp_path / "state.sqlite3")), "worker-1")
+
+    for i in range(10):
+        capture.write(f"第{i}条日志\n")
+    capture.ship()
+
+    assert capture.log_queue.empty()
+    assert [entry["message"] for entry in capture.drain_new_logs()] == [f"第{i}条日志" for i in range(10)]
+
+
+def test_local_capture_queues_logs():
+    capture = LogCapture()
+
+    capture.write("本地日志\n")
+
+    assert [entry["message"] for entry in capture.drain_new_logs()] == ["本地日志"]
@@ -0,0 +1,224 @@
+"""模型路由：故障切换、对冲请求和服务商筛选"""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import config
+from utils import model_router
+from utils.model_router import ModelRouter
+
+_REQUEST = httpx.Request("POST", "http://stub.local/v1/chat/completions")
+
+JSON_SCHEMA_FORMAT = {"type": "json_schema", "json_schema": {"name": "x", "schema": {"type": "object"}}}
+
+
+def connection_error():
+    return openai.APIConnectionError(request=_REQUEST)
+
+
+def bad_request():
+    return openai.BadRequestError("bad request", response=httpx.Response(400, request=_REQUEST), body=None)
+
+
+class StubClient:
+    """按顺序返回预设结果的OpenAI客户端，结果为异常时抛出"""
+
+    def __init__(self, name, *outcomes, delay=0.0):
+        self.name = name
+        self.outcomes = list(outcomes) or ["ok"]
+        self.delay = delay
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(self.delay)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return f"{self.name}:{outcome}"
+
+
+def make_router(clients, failover, **kwargs):
+    providers = {name: (lambda client=client: client, f"{name}-model") for name, client in clients.items()}
+    return ModelRouter(providers, failover, degraded_p95_seconds=30, **kwargs)
+
+
+def test_fails_over_on_connection_error():
+    primary = StubClient("doubao", connection_error())
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    assert router.create("doubao", {"model": "doubao-model", "messages": []}) == "deepseek:ok"
+    assert backup.calls[0]["model"] == "deepseek-model"
+
+
+def test_request_errors_are_not_failed_over():
+    primary = StubClient("doubao", bad_request())
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    with pytest.raises(openai.BadRequestError):
+        router.create("doubao", {"messages": []})
+    assert backup.calls == []
+
+
+def test_providers_without_api_key_are_skipped():
+    backup = StubClient("deepseek")
+    router = make_router({"deepseek": backup}, {"doubao": ["qwen", "deepseek"]})
+
+    assert router.create("doubao", {"model": "doubao-model", "messages": []}) == "deepseek:ok"
+
+
+def test_no_available_provider_raises_value_error():
+    router = make_router({}, {"doubao": ["qwen"]})
+
+    with pytest.raises(ValueError):
+        router.create("doubao", {"messages": []})
+
+
+def test_json_schema_falls_back_to_json_object_on_unsupported_providers():
+    primary = StubClient("doubao", connection_error())
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]},
+                         json_schema_providers=["doubao"])
+    messages = [{"role": "system", "content": "判断问题类型"}, {"role": "user", "content": "你好"}]
+
+    assert router.create("doubao", {"messages": messages, "response_format": JSON_SCHEMA_FORMAT}) == "deepseek:ok"
+    assert primary.calls[0]["response_format"] == JSON_SCHEMA_FORMAT
+    assert backup.calls[0]["response_format"] == {"type": "json_object"}
+    assert backup.calls[0]["messages"][0]["content"].startswith("判断问题类型")
+    assert '"type": "object"' in backup.calls[0]["messages"][0]["content"]
+    assert backup.calls[0]["messages"][1:] == messages[1:]
+
+
+def test_hedges_json_schema_requests_with_default_config(monkeypatch):
+    monkeypatch.setattr(model_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    primary = StubClient("doubao", delay=1.0)
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["qwen", "deepseek"]},
+                         json_schema_providers=config.model_router.json_schema_providers)
+
+    started = time.monotonic()
+    assert router.create("doubao", {"messages": [], "response_format": JSON_SCHEMA_FORMAT}, hedge=True) == "deepseek:ok"
+    assert time.monotonic() - started < 0.8
+    assert backup.calls[0]["response_format"] == {"type": "json_object"}
+
+
+def test_failover_uses_remaining_timeout_budget():
+    primary = StubClient("doubao", connection_error(), delay=0.2)
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    assert router.create("doubao", {"messages": [], "timeout": 1.0}) == "deepseek:ok"
+    assert primary.calls[0]["timeout"] == 1.0
+    assert backup.calls[0]["timeout"] < 0.85
+
+
+def test_stops_failing_over_when_budget_is_spent():
+    primary = StubClient("doubao", connection_error(), delay=0.2)
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    with pytest.raises(openai.APIConnectionError):
+        router.create("doubao", {"messages": [], "timeout": 0.1})
+    assert backup.calls == []
+
+
+def test_hedge_returns_first_success(monkeypatch):
+    monkeypatch.setattr(model_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    primary = StubClient("doubao", delay=1.0)
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    started = time.monotonic()
+    assert router.create("doubao", {"messages": []}, hedge=True) == "deepseek:ok"
+    assert time.monotonic() - started < 0.8
+
+
+def test_hedge_failure_keeps_waiting_for_primary(monkeypatch):
+    monkeypatch.setattr(model_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    primary = StubClient("doubao", delay=0.3)
+    backup = StubClient("deepseek", bad_request())
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    assert router.create("doubao", {"messages": []}, hedge=True) == "doubao:ok"
+    assert len(backup.calls) == 1
+
+
+def test_hedge_raises_when_all_requests_fail(monkeypatch):
+    monkeypatch.setattr(model_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    primary = StubClient("doubao", connection_error(), delay=0.2)
+    backup = StubClient("deepseek", bad_request())
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    with pytest.raises(openai.BadRequestError):
+        router.create("doubao", {"messages": []}, hedge=True)
+
+
+def test_degraded_provider_is_tried_last():
+    primary = StubClient("doubao")
+    backup = StubClient("deepseek")
+    router = make_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+    for _ in range(model_router.MIN_SAMPLES):
+        router.stats_for("doubao", "doubao-model").record(1.0, True)
+
+    assert router.create("doubao", {"messages": []}) == "deepseek:ok"
+
+
+class AsyncStubClient(StubClient):
+    """StubClient的异步版本，记录被取消的请求"""
+
+    def __init__(self, name, *outcomes, delay=0.0):
+        super().__init__(name, *outcomes, delay=delay)
+        self.cancelled = 0
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return f"{self.name}:{outcome}"
+
+
+def make_async_router(clients, failover):
+    providers = {name: (lambda: None, f"{name}-model") for name in clients}
+    async_providers = {name: (lambda client=client: client) for name, client in clients.items()}
+    return ModelRouter(providers, failover, degraded_p95_seconds=30, async_providers=async_providers)
+
+
+def test_async_fails_over_on_connection_error():
+    primary = AsyncStubClient("doubao", connection_error())
+    backup = AsyncStubClient("deepseek")
+    router = make_async_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    assert asyncio.run(router.acreate("doubao", {"messages": []})) == "deepseek:ok"
+    assert backup.calls[0]["model"] == "deepseek-model"
+
+
+def test_async_hedge_cancels_slower_request(monkeypatch):
+    monkeypatch.setattr(model_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    primary = AsyncStubClient("doubao", delay=5)
+    backup = AsyncStubClient("deepseek")
+    router = make_async_router({"doubao": primary, "deepseek": backup}, {"doubao": ["deepseek"]})
+
+    async def hedged():
+        started = time.monotonic()
+        result = await router.acreate("doubao", {"messages": []}, hedge=True)
+        # 让被取消的请求处理取消
+        await asyncio.sleep(0)
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(hedged())
+    assert result == "deepseek:ok"
+    assert elapsed < 1
+    assert primary.cancelled == 1
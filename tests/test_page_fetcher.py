@@ -0,0 +1,124 @@
+"""网页正文抓取：本地HTTP服务器上的抓取、缓存、重定向和非公网地址拦截"""
+import asyncio
+import ipaddress
+import os
+import time
+
+import httpx
+
+from utils import page_fetcher
+from utils.page_fetcher import PageCache, PageFetcher, extract_main_text, is_public_address
+
+ARTICLE = ("<html><head><title>杭州旅游</title></head><body><nav>首页 | 攻略</nav>"
+           "<p>西湖是杭州最著名的景点，春天沿着苏堤散步可以看到桃花和柳树。</p>"
+           "<p>灵隐寺位于西湖西北面，是江南著名的古刹，建议早上前往避开人流。</p>"
+           "<script>var x = 1;</script></body></html>")
+HTML_HEADERS = {"Content-Type": "text/html; charset=utf-8"}
+
+
+def only_loopback(address):
+    """测试中只允许本地服务器所在的127.0.0.1"""
+    return address == ipaddress.ip_address("127.0.0.1")
+
+
+def fetch(urls, cache=None, **kwargs):
+    async def run():
+        async with httpx.AsyncClient(trust_env=False) as client:
+            return await PageFetcher(client, cache, **kwargs).fetch_all(urls, deadline=5)
+    return asyncio.run(run())
+
+
+def test_extract_main_text_skips_navigation_and_scripts():
+    page = extract_main_text(ARTICLE)
+
+    assert page["title"] == "杭州旅游"
+    assert "西湖" in page["text"] and "灵隐寺" in page["text"]
+    assert "首页" not in page["text"] and "var x" not in page["text"]
+
+
+def test_fetches_and_caches_pages(local_server, tmp_path):
+    server = local_server({"/article": (200, HTML_HEADERS, ARTICLE)})
+    cache = PageCache(str(tmp_path))
+    url = f"{server.url}/article"
+
+    first = fetch([url], cache, is_allowed_address=only_loopback)[url]
+    second = fetch([url], cache, is_allowed_address=only_loopback)[url]
+
+    assert first["status"] == "fetched" and "西湖" in first["text"]
+    assert second["status"] == "cached" and second["content_hash"] == first["content_hash"]
+    assert server.requests == ["/article"]
+
+
+def test_rejects_private_addresses_by_default(local_server):
+    server = local_server({"/article": (200, HTML_HEADERS, ARTICLE)})
+    url = f"{server.url}/article"
+
+    result = fetch([url])[url]
+
+    assert result["status"] == "error"
+    assert server.requests == []
+
+
+def test_rejects_redirects_to_private_addresses(local_server):
+    port = local_server({}).url.rsplit(":", 1)[1]
+    server = local_server({"/redirect": (302, {"Location": f"http://127.0.0.2:{port}/admin"}, "")})
+    url = f"{server.url}/redirect"
+
+    result = fetch([url], is_allowed_address=only_loopback)[url]
+
+    assert result["status"] == "error"
+    assert "127.0.0.2" in result["message"]
+    assert server.requests == ["/redirect"]
+
+
+def test_follows_redirects_up_to_limit(local_server):
+    server = local_server({
+        "/old": (301, {"Location": "/article"}, ""),
+        "/loop": (302, {"Location": "/loop"}, ""),
+        "/article": (200, HTML_HEADERS, ARTICLE),
+    })
+
+    redirected = fetch([f"{server.url}/old"], is_allowed_address=only_loopback)[f"{server.url}/old"]
+    looped = fetch([f"{server.url}/loop"], is_allowed_address=only_loopback, max_redirects=2)[f"{server.url}/loop"]
+
+    assert redirected["status"] == "fetched"
+    assert looped["status"] == "error"
+    assert server.requests.count("/loop") == 3
+
+
+def test_public_address_check():
+    assert is_public_address(ipaddress.ip_address("8.8.8.8"))
+    for address in ("127.0.0.1", "10.0.0.1", "192.168.1.1", "169.254.169.254", "::1", "fe80::1",
+                    "::ffff:127.0.0.1", "0.0.0.0"):
+        assert not is_public_address(ipaddress.ip_address(address)), address
+
+
+def test_page_cache_prunes_expired_and_excess_entries(tmp_path):
+    cache = PageCache(str(tmp_path), ttl=60, max_entries=2)
+    for i in range(3):
+        cache.put(f"https://example.com/{i}", "title", f"正文{i}")
+    # 第0个页面已过期
+    stale = time.time() - 120
+    os.utime(cache._index_path("https://example.com/0"), (stale, stale))
+    os.utime(cache._blob_path(cache.get("https://example.com/0")["content_hash"]), (stale, stale))
+    cache.put("https://example.com/3", "title", "正文3")
+    for i, age in ((1, 30), (2, 20)):
+        modified = time.time() - age
+        os.utime(cache._index_path(f"https://example.com/{i}"), (modified, modified))
+
+    cache.prune()
+
+    assert cache.get("https://example.com/0") is None
+    assert len(os.listdir(cache.index_dir)) == 2
+    assert len(os.listdir(cache.blob_dir)) == 3
+    assert cache.get("https://example.com/1") is None
+    assert cache.get("https://example.com/3")["text"] == "正文3"
+
+
+def test_page_cache_prunes_periodically(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_fetcher, "PAGE_CACHE_PRUNE_EVERY", 5)
+    cache = PageCache(str(tmp_path), max_entries=3)
+    for i in range(5):
+        cache.put(f"https://example.com/{i}", "title", f"正文{i}")
+
+    assert len(os.listdir(cache.index_dir)) == 3
@@ -0,0 +1,60 @@
+"""任务规划执行队列：已结束任务的保留与清理"""
+import sqlite3
+import time
+
+from utils.plan_jobs import PlanJobQueue, PLAN_JOB_SUCCESS
+from utils.task_events import EVENT_DONE, EVENT_SUMMARY_DELTA
+
+
+def finished_job(queue, finished_ago):
+    job = queue.enqueue("conv", ["任务一"], "问题")
+    queue.save_task_result(job["job_id"], 1, {"status": "success"})
+    for i in range(3):
+        queue.add_event(job["job_id"], EVENT_SUMMARY_DELTA, {"delta": str(i)})
+    queue.add_event(job["job_id"], EVENT_DONE, {"response": "汇总"})
+    queue.finish(job["job_id"], PLAN_JOB_SUCCESS, {"response": "汇总"})
+    with sqlite3.connect(queue.db_path) as conn:
+        conn.execute("UPDATE plan_jobs SET finished_at = ? WHERE job_id = ?",
+                     (time.time() - finished_ago, job["job_id"]))
+    return job["job_id"]
+
+
+def test_purges_jobs_past_retention(tmp_path):
+    queue = PlanJobQueue(str(tmp_path / "jobs.sqlite3"))
+    expired = finished_job(queue, finished_ago=7200)
+    recent = finished_job(queue, finished_ago=10)
+    running = queue.enqueue("conv", ["任务二"], "问题")["job_id"]
+
+    removed = queue.purge_finished(retention_seconds=3600, compact_after_seconds=300)
+
+    assert removed == {"jobs": 1, "events": 4}
+    assert queue.get(expired) is None
+    assert queue.get_events(expired) == [] and queue.get_task_results(expired) == {}
+    assert len(queue.get_events(recent)) == 4
+    assert queue.get(running) is not None
+
+
+def test_compacts_summary_deltas_of_finished_jobs(tmp_path):
+    queue = PlanJobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = finished_job(queue, finished_ago=600)
+
+    removed = queue.purge_finished(retention_seconds=3600, compact_after_seconds=300)
+
+    assert removed == {"jobs": 0, "events": 3}
+    assert [event["event"] for event in queue.get_events(job_id)] == [EVENT_DONE]
+    assert queue.get(job_id)["result"] == {"response": "汇总"}
+
+
+def test_migrates_finished_jobs_from_old_databases(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    queue = PlanJobQueue(db_path)
+    job_id = queue.enqueue("conv", ["任务一"], "问题")["job_id"]
+    queue.finish(job_id, PLAN_JOB_SUCCESS, {"response": "汇总"})
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP INDEX idx_plan_jobs_finished")
+        conn.execute("ALTER TABLE plan_jobs DROP COLUMN finished_at")
+
+    queue = PlanJobQueue(db_path)
+
+    assert queue.get(job_id)["finished_at"] is not None
+    assert queue.purge_finished(retention_seconds=3600)["jobs"] == 0
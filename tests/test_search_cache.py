@@ -0,0 +1,63 @@
+"""搜索缓存：跨进程查询锁合并相同查询，以及磁盘缓存清理"""
+import asyncio
+import os
+import time
+
+from utils import search_cache
+from utils.search_cache import SearchCache
+
+
+def counting_fetcher(calls, delay=0.0, value="results"):
+    async def fetch():
+        calls.append(time.monotonic())
+        await asyncio.sleep(delay)
+        return value
+    return fetch
+
+
+def test_coalesces_identical_queries_across_processes(tmp_path):
+    # 两个实例共用缓存目录，相当于两个MCP服务器进程
+    first, second = SearchCache(str(tmp_path)), SearchCache(str(tmp_path))
+    calls = []
+
+    async def run():
+        return await asyncio.gather(
+            first.get_or_fetch("杭州 旅游", "noLimit", counting_fetcher(calls, delay=0.3)),
+            second.get_or_fetch("杭州  旅游", "noLimit", counting_fetcher(calls, delay=0.3)),
+        )
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ["coalesced", "network"]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".lock")]
+
+
+def test_does_not_release_lock_held_by_another_process(tmp_path, monkeypatch):
+    owner, other = SearchCache(str(tmp_path)), SearchCache(str(tmp_path))
+    key = SearchCache.make_key("快手 财报", "noLimit")
+    assert owner._try_acquire_lock(key)
+
+    async def gave_up_waiting(key):
+        return None
+
+    # 等待超时后不持有锁直接查询
+    monkeypatch.setattr(other, "_wait_for_other_process", gave_up_waiting)
+    calls = []
+    value, source = asyncio.run(other.get_or_fetch("快手 财报", "noLimit", counting_fetcher(calls)))
+
+    assert (value, source) == ("results", "network")
+    assert os.path.exists(owner._lock_path(key))
+
+
+def test_prunes_expired_and_excess_disk_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_cache, "DISK_PRUNE_EVERY", 4)
+    cache = SearchCache(str(tmp_path), max_disk_items=2)
+    cache.set(SearchCache.make_key("expired", "pastDay"), "old", ttl=-1)
+    for i, ttl in enumerate((100, 200, 300)):
+        cache.set(SearchCache.make_key(f"query{i}", "noLimit"), i, ttl=ttl)
+
+    files = sorted(name for name in os.listdir(tmp_path) if name.endswith(".json"))
+    assert files == sorted(f"{SearchCache.make_key(f'query{i}', 'noLimit')}.json" for i in (1, 2))
+    # 已写入的缓存仍可从磁盘读取
+    assert SearchCache(str(tmp_path)).get(SearchCache.make_key("query2", "noLimit")) == 2
@@ -0,0 +1,54 @@
+"""任务分配：截止时间到达或取消后不再等待任务分类和依赖分析"""
+import asyncio
+import threading
+import time
+
+from task_dispatcher import TaskDispatcher
+from utils.deadline import Deadline, TASK_CANCELLED, TASK_TIMEOUT
+
+
+def blocked_dispatcher(monkeypatch, release):
+    dispatcher = TaskDispatcher()
+    calls = []
+
+    def slow_model_call(*args):
+        calls.append(args[-1].timeout_kwargs())
+        release.wait(5)
+        return "web_search"
+    monkeypatch.setattr(dispatcher, "classify_todo_item", slow_model_call)
+    monkeypatch.setattr(dispatcher, "infer_dependencies", slow_model_call)
+    return dispatcher, calls
+
+
+def dispatch(dispatcher, deadline):
+    async def run():
+        # 在协程内计时：asyncio.run退出时还会等待仍在运行的模型调用线程
+        started = time.monotonic()
+        cache_key = await dispatcher.dispatch_and_execute_tasks("问题", "1. 搜索财报\n2. 分析财报", deadline=deadline)
+        return dispatcher.task_cache.get(cache_key)["results"], time.monotonic() - started
+    return asyncio.run(run())
+
+
+def test_cancel_stops_waiting_for_classification(monkeypatch):
+    release = threading.Event()
+    dispatcher, _ = blocked_dispatcher(monkeypatch, release)
+    deadline = Deadline()
+    threading.Timer(0.2, deadline.cancel).start()
+
+    threading.Timer(3, release.set).start()
+    results, elapsed = dispatch(dispatcher, deadline)
+
+    assert elapsed < 1.5
+    assert [result["status"] for result in results] == [TASK_CANCELLED, TASK_CANCELLED]
+
+
+def test_expired_deadline_stops_waiting_and_bounds_model_timeout(monkeypatch):
+    release = threading.Event()
+    dispatcher, calls = blocked_dispatcher(monkeypatch, release)
+
+    threading.Timer(4, release.set).start()
+    results, elapsed = dispatch(dispatcher, Deadline(time.time() + 1.5))
+
+    assert elapsed < 3
+    assert [result["status"] for result in results] == [TASK_TIMEOUT, TASK_TIMEOUT]
+    assert calls and all(kwargs["timeout"] <= 1.5 for kwargs in calls)
@@ -1,7 +1,11 @@
 import requests
 import json
 from datetime import datetime
-from config import GAODE_API_KEY, GAODE_WEATHER_URL
+from config import GAODE_API_KEY, GAODE_WEATHER_URL, GAODE_TIMEOUT_SECONDS, SHARED_STATE_DB
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# 高德天气API的熔断器，超过3秒的调用视为慢调用
+weather_breaker = CircuitBreaker("gaode_weather", SHARED_STATE_DB, slow_call_seconds=3)
 
 # 定义工具函数规范
 tools = [
@@ -44,7 +48,9 @@ def get_current_weather(location):
         "extensions": "base"
     }
     try:
-        response = requests.get(GAODE_WEATHER_URL, params=params)
+        with weather_breaker.guard():
+            response = requests.get(GAODE_WEATHER_URL, params=params, timeout=GAODE_TIMEOUT_SECONDS)
+            response.raise_for_status()
         result = response.json()
         
         # 处理API响应
@@ -62,6 +68,8 @@ def get_current_weather(location):
         else:
             return json.dumps({"status": "error", "message": "未找到该城市天气信息"})
             
+    except CircuitOpenError as e:
+        return weather_breaker.error_response(e)
     except Exception as e:
         return json.dumps({"status": "error", "message": f"API请求失败: {str(e)}"})
 
@@ -0,0 +1,239 @@
+"""
+请求准入控制模块
+按优先级类别（聊天、任务规划）限制并发数：超过并发上限的请求排队等待，
+排队已满时立即拒绝（429），排队超时后拒绝（503）；
+空出的执行名额优先分配给高优先级类别，同一类别内按对话轮流分配，避免单个对话占满名额；
+线程（acquire）和事件循环中的协程（acquire_async）共用同一组名额
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+# 请求类别，按优先级从高到低排列
+CLASS_CHAT = "chat"
+CLASS_PLANNING = "planning"
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入，status_code为429（排队已满）或503（排队超时）"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+
+
+class _AsyncWaiter(_Waiter):
+    """事件循环中排队的请求：获得名额时从释放名额的线程通知事件循环"""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def grant(self):
+        super().grant()
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _RequestClass:
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        # 对话ID -> 该对话排队中的请求，按对话轮流出队
+        self.waiting: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+
+    def pop_next(self) -> _Waiter:
+        """取出下一个请求：轮到的对话出队一个请求后移到末尾"""
+        conversation_id, waiters = next(iter(self.waiting.items()))
+        waiter = waiters.popleft()
+        self.waiting.pop(conversation_id)
+        if waiters:
+            self.waiting[conversation_id] = waiters
+        self.queued -= 1
+        return waiter
+
+    def remove(self, conversation_id: str, waiter: _Waiter):
+        waiters = self.waiting.get(conversation_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self.queued -= 1
+            if not waiters:
+                self.waiting.pop(conversation_id)
+
+
+class AdmissionController:
+    """进程内的准入控制器，线程安全"""
+
+    def __init__(self, max_concurrent: int, classes: List[Dict[str, Any]]):
+        """
+        Args:
+            max_concurrent: 所有类别合计的最大并发数
+            classes: 按优先级从高到低排列的类别配置，包含name、limit、max_queue、queue_timeout
+        """
+        self.max_concurrent = max_concurrent
+        self._classes: "OrderedDict[str, _RequestClass]" = OrderedDict(
+            (config["name"], _RequestClass(**config)) for config in classes
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> int:
+        return sum(request_class.running for request_class in self._classes.values())
+
+    def _dispatch(self):
+        """把空出的名额按优先级分配给排队中的请求（需持有锁）"""
+        for request_class in self._classes.values():
+            while (request_class.waiting and request_class.running < request_class.limit
+                   and self.running < self.max_concurrent):
+                waiter = request_class.pop_next()
+                request_class.running += 1
+                waiter.grant()
+
+    def _enqueue(self, request_class: _RequestClass, conversation_id: str, waiter: _Waiter) -> bool:
+        """有空闲名额时直接占用并返回True，否则把请求加入排队
+
+        Raises:
+            AdmissionRejected: 排队已满
+        """
+        with self._lock:
+            # 没有人排队且有空闲名额时直接执行
+            if (not request_class.waiting and request_class.running < request_class.limit
+                    and self.running < self.max_concurrent):
+                request_class.running += 1
+                request_class.admitted += 1
+                return True
+            if request_class.queued >= request_class.max_queue:
+                request_class.rejected += 1
+                raise AdmissionRejected("当前请求较多，请稍后再试", 429, 1)
+            request_class.waiting.setdefault(conversation_id, deque()).append(waiter)
+            request_class.queued += 1
+            return False
+
+    def _settle(self, request_class: _RequestClass, conversation_id: str, waiter: _Waiter, started: float):
+        """排队结束：已获得名额时记录等待时间，否则移出排队
+
+        Raises:
+            AdmissionRejected: 排队超时
+        """
+        with self._lock:
+            if not waiter.granted:
+                request_class.remove(conversation_id, waiter)
+                request_class.timed_out += 1
+                raise AdmissionRejected("服务繁忙，请稍后再试", 503, int(request_class.queue_timeout))
+            request_class.admitted += 1
+            request_class.total_wait_seconds += time.monotonic() - started
+
+    def acquire(self, class_name: str, conversation_id: Optional[str] = None):
+        """
+        获取执行名额，需排队时阻塞等待
+
+        Args:
+            class_name: 请求类别
+            conversation_id: 对话ID，用于同一类别内按对话公平分配
+
+        Raises:
+            AdmissionRejected: 排队已满或排队超时
+        """
+        request_class = self._classes[class_name]
+        conversation_id = conversation_id or ""
+        started = time.monotonic()
+        waiter = _Waiter()
+        if self._enqueue(request_class, conversation_id, waiter):
+            return
+        waiter.event.wait(request_class.queue_timeout)
+        self._settle(request_class, conversation_id, waiter, started)
+
+    async def acquire_async(self, class_name: str, conversation_id: Optional[str] = None):
+        """
+        获取执行名额，需排队时在事件循环中等待，不占用线程；参数和异常同acquire
+        """
+        request_class = self._classes[class_name]
+        conversation_id = conversation_id or ""
+        started = time.monotonic()
+        waiter = _AsyncWaiter()
+        if self._enqueue(request_class, conversation_id, waiter):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), request_class.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 等待中被取消：移出排队，已分配的名额归还
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    request_class.remove(conversation_id, waiter)
+            if granted:
+                self.release(class_name)
+            raise
+        self._settle(request_class, conversation_id, waiter, started)
+
+    def release(self, class_name: str):
+        with self._lock:
+            self._classes[class_name].running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, class_name: str, conversation_id: Optional[str] = None) -> Iterator[None]:
+        """在获得执行名额后执行代码块，结束后释放名额"""
+        self.acquire(class_name, conversation_id)
+        try:
+            yield
+        finally:
+            self.release(class_name)
+
+    @asynccontextmanager
+    async def admit_async(self, class_name: str, conversation_id: Optional[str] = None) -> AsyncIterator[None]:
+        """admit的异步版本，供ASGI部署的事件循环使用"""
+        await self.acquire_async(class_name, conversation_id)
+        try:
+            yield
+        finally:
+            self.release(class_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """各类别的执行、排队和拒绝情况"""
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": self.running,
+                "classes": {
+                    name: {
+                        "limit": request_class.limit,
+                        "running": request_class.running,
+                        "queued": request_class.queued,
+                        "admitted": request_class.admitted,
+                        "rejected": request_class.rejected,
+                        "timed_out": request_class.timed_out,
+                        "avg_wait_seconds": round(request_class.total_wait_seconds / request_class.admitted, 3)
+                        if request_class.admitted else 0.0
+                    }
+                    for name, request_class in self._classes.items()
+                }
+            }
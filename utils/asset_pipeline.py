@@ -0,0 +1,175 @@
+"""
+静态资源处理模块
+为静态文件生成带内容哈希的副本、预压缩的gzip/brotli版本，并将较大的图片转换为WebP，
+生成manifest.json供页面引用
+
+用法: python -m utils.asset_pipeline
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只生成gzip版本
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装Pillow时跳过WebP转换
+    Image = None
+
+STATIC_DIR = "static"
+DIST_DIR_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+# 不参与处理的目录（运行时生成的内容）
+EXCLUDED_DIRS = {DIST_DIR_NAME, "generated_images"}
+# 需要预压缩的文本类资源
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".html", ".svg", ".json", ".txt"}
+# 超过该大小的PNG/JPEG会额外生成WebP版本
+WEBP_MIN_BYTES = 64 * 1024
+WEBP_QUALITY = 82
+HASH_LENGTH = 10
+
+_manifest_cache: Dict[str, Any] = {"mtime": None, "data": {}}
+
+
+def _file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _atomic_write_bytes(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _precompress(path: str):
+    """生成.gz和.br预压缩版本（仅在压缩后更小时保留）"""
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", lambda d: brotli.compress(d, quality=11)))
+    for suffix, compress in variants:
+        target = path + suffix
+        if os.path.exists(target):
+            continue
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            _atomic_write_bytes(target, compressed)
+
+
+def _convert_to_webp(path: str, target: str) -> bool:
+    """将图片转换为WebP，成功返回True"""
+    if Image is None:
+        return False
+    if os.path.exists(target):
+        return True
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with Image.open(path) as image:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+    # 转换后更大则放弃WebP版本
+    if os.path.getsize(tmp_path) >= os.path.getsize(path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, target)
+    return True
+
+
+def build_assets(static_dir: str = STATIC_DIR) -> Dict[str, Dict[str, str]]:
+    """
+    处理静态资源目录，输出到static/dist并写入manifest.json
+
+    Args:
+        static_dir: 静态资源目录
+
+    Returns:
+        Dict[str, Dict[str, str]]: manifest，逻辑路径 -> {"path": 带哈希的路径, "webp": WebP路径}
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR_NAME)
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if not (root == static_dir and d in EXCLUDED_DIRS)]
+        for name in files:
+            if name.startswith("."):
+                continue
+            source = os.path.join(root, name)
+            logical_path = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            stem, extension = os.path.splitext(logical_path)
+            digest = _file_hash(source)[:HASH_LENGTH]
+
+            hashed_path = f"{stem}.{digest}{extension}"
+            target = os.path.join(dist_dir, hashed_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+
+            entry = {"path": f"{DIST_DIR_NAME}/{hashed_path}"}
+            extension = extension.lower()
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                _precompress(target)
+            elif extension in (".png", ".jpg", ".jpeg") and os.path.getsize(source) >= WEBP_MIN_BYTES:
+                webp_path = f"{stem}.{digest}.webp"
+                if _convert_to_webp(source, os.path.join(dist_dir, webp_path)):
+                    entry["webp"] = f"{DIST_DIR_NAME}/{webp_path}"
+            manifest[logical_path] = entry
+
+    _atomic_write_bytes(os.path.join(dist_dir, MANIFEST_NAME),
+                        json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    _manifest_cache["mtime"] = None
+    return manifest
+
+
+def load_manifest(static_dir: str = STATIC_DIR) -> Dict[str, Dict[str, str]]:
+    """读取manifest，文件未变化时使用缓存"""
+    path = os.path.join(static_dir, DIST_DIR_NAME, MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if _manifest_cache["mtime"] != mtime:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _manifest_cache["data"] = json.load(f)
+            _manifest_cache["mtime"] = mtime
+        except (OSError, ValueError):
+            return {}
+    return _manifest_cache["data"]
+
+
+def asset_url(filename: str, variant: Optional[str] = None, static_dir: str = STATIC_DIR) -> str:
+    """
+    获取静态资源的访问地址，已处理的资源返回带哈希的地址
+
+    Args:
+        filename: 相对static目录的路径，如'style.css'
+        variant: 可选的变体，如'webp'，变体不存在时返回空字符串
+        static_dir: 静态资源目录
+
+    Returns:
+        str: 资源URL
+    """
+    entry = load_manifest(static_dir).get(filename)
+    if not entry:
+        return "" if variant else f"/static/{filename}"
+    if variant:
+        return f"/static/{entry[variant]}" if variant in entry else ""
+    return f"/static/{entry['path']}"
+
+
+if __name__ == "__main__":
+    result = build_assets()
+    print(f"✅ 静态资源处理完成，共 {len(result)} 个文件")
@@ -0,0 +1,183 @@
+"""
+外部依赖熔断模块
+每个外部API（高德天气、博查搜索、豆包文生图）一个熔断器：记录最近调用的成败和延迟，
+失败或慢调用比例过高时打开熔断，之后的调用立即返回错误而不再等待超时；
+打开一段时间后进入半开状态，只放行一个探测请求，成功则恢复，失败则继续熔断。
+熔断状态保存在共享的SQLite数据库中，Web进程、MCP服务器进程和图片生成进程看到的状态一致
+"""
+import json
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .shared_state import SharedDict
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 统计窗口：最多保留的调用数和调用记录有效期（秒）
+WINDOW_SIZE = 20
+WINDOW_SECONDS = 60
+# 打开熔断所需的最少调用数，以及失败（含慢调用）比例阈值
+MIN_CALLS = 5
+FAILURE_RATE_THRESHOLD = 0.5
+# 熔断打开后等待多久（秒）进入半开状态
+OPEN_SECONDS = 30
+# 探测请求超过该时间（秒）仍未结束时视为丢失，允许发起新的探测
+PROBE_TIMEOUT_SECONDS = 60
+
+_NAMESPACE = "circuit_breakers"
+
+
+class CircuitOpenError(Exception):
+    """熔断打开，调用被拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} 服务暂时不可用，请约 {max(1, int(retry_after))} 秒后再试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _initial_state() -> Dict[str, Any]:
+    return {"state": STATE_CLOSED, "calls": [], "opened_at": None, "probe_started_at": None,
+            "rejected": 0, "opened_count": 0}
+
+
+class CircuitBreaker:
+    """单个外部依赖的熔断器，线程安全、进程间共享"""
+
+    def __init__(self, name: str, db_path: str, slow_call_seconds: float,
+                 is_failure: Optional[Callable[[BaseException], bool]] = None):
+        """
+        Args:
+            name: 依赖名称
+            db_path: 保存熔断状态的SQLite数据库
+            slow_call_seconds: 超过该耗时的调用视为失败
+            is_failure: 判断异常是否计为依赖故障，默认所有异常都计为故障
+        """
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.is_failure = is_failure or (lambda error: True)
+        self._store = SharedDict(db_path, _NAMESPACE)
+
+    def acquire(self):
+        """
+        调用依赖前检查熔断状态，半开状态下占用探测名额
+
+        Raises:
+            CircuitOpenError: 熔断打开，或半开状态下已有探测请求
+        """
+        admitted = False
+
+        def update(state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            nonlocal admitted
+            state = state or _initial_state()
+            now = time.time()
+            if state["state"] == STATE_OPEN and now - state["opened_at"] >= OPEN_SECONDS:
+                state.update(state=STATE_HALF_OPEN, probe_started_at=None)
+            probe_started_at = state["probe_started_at"]
+            if state["state"] == STATE_CLOSED:
+                admitted = True
+            elif (state["state"] == STATE_HALF_OPEN
+                  and (probe_started_at is None or now - probe_started_at >= PROBE_TIMEOUT_SECONDS)):
+                admitted = True
+                state["probe_started_at"] = now
+            else:
+                admitted = False
+                state["rejected"] += 1
+            return state
+
+        state = self._store.transform(self.name, update)
+        if not admitted:
+            retry_after = OPEN_SECONDS - (time.time() - state["opened_at"]) if state["state"] == STATE_OPEN else 1
+            raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, latency: float, failed: bool):
+        """记录一次调用结果，更新熔断状态"""
+        failed = failed or latency >= self.slow_call_seconds
+
+        def update(state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            state = state or _initial_state()
+            now = time.time()
+            if state["state"] == STATE_HALF_OPEN:
+                # 探测请求的结果决定恢复还是继续熔断
+                state["probe_started_at"] = None
+                if failed:
+                    state.update(state=STATE_OPEN, opened_at=now)
+                    state["opened_count"] += 1
+                else:
+                    state.update(state=STATE_CLOSED, calls=[], opened_at=None)
+                return state
+            calls = [call for call in state["calls"] if now - call[0] < WINDOW_SECONDS]
+            calls = (calls + [[now, round(latency, 3), failed]])[-WINDOW_SIZE:]
+            state["calls"] = calls
+            failures = sum(1 for call in calls if call[2])
+            if (state["state"] == STATE_CLOSED and len(calls) >= MIN_CALLS
+                    and failures / len(calls) >= FAILURE_RATE_THRESHOLD):
+                state.update(state=STATE_OPEN, opened_at=now)
+                state["opened_count"] += 1
+            return state
+
+        self._store.transform(self.name, update)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        在熔断器保护下执行代码块，按执行结果和耗时更新熔断状态
+
+        Raises:
+            CircuitOpenError: 熔断打开时不执行代码块，立即抛出
+        """
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.record(time.monotonic() - started, isinstance(e, Exception) and self.is_failure(e))
+            raise
+        self.record(time.monotonic() - started, False)
+
+    def check(self):
+        """
+        只检查熔断是否打开、不占用探测名额，用于提交后台任务前快速检查
+
+        Raises:
+            CircuitOpenError: 熔断打开
+        """
+        state = self._store.get(self.name)
+        if state and state["state"] == STATE_OPEN:
+            retry_after = OPEN_SECONDS - (time.time() - state["opened_at"])
+            if retry_after > 0:
+                raise CircuitOpenError(self.name, retry_after)
+
+    def error_response(self, error: CircuitOpenError) -> str:
+        """熔断时返回给任务的JSON错误，格式与工具的其他错误一致"""
+        return json.dumps({
+            "status": "error",
+            "message": str(error),
+            "circuit": self.name,
+            "retry_after": round(error.retry_after, 1)
+        }, ensure_ascii=False)
+
+
+def get_breaker_states(db_path: str) -> Dict[str, Dict[str, Any]]:
+    """所有熔断器的当前状态，以及统计窗口内的调用数、失败率和延迟"""
+    now = time.time()
+    states = {}
+    for name, state in SharedDict(db_path, _NAMESPACE).items():
+        calls = [call for call in state["calls"] if now - call[0] < WINDOW_SECONDS]
+        latencies = sorted(call[1] for call in calls)
+        current = state["state"]
+        if current == STATE_OPEN and now - state["opened_at"] >= OPEN_SECONDS:
+            current = STATE_HALF_OPEN
+        states[name] = {
+            "state": current,
+            "calls": len(calls),
+            "failure_rate": round(sum(1 for call in calls if call[2]) / len(calls), 3) if calls else 0.0,
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            "opened_at": state["opened_at"],
+            "opened_count": state["opened_count"],
+            "rejected": state["rejected"]
+        }
+    return states
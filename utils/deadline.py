@@ -0,0 +1,102 @@
+"""
+请求截止时间模块
+一次任务规划请求的截止时间贯穿拆解后的各个阶段：任务分类、子任务执行（模型调用、MCP工具调用）和汇总，
+超过截止时间或客户端取消时，正在进行的调用被取消，已完成的子任务结果照常返回
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+# 子任务被截止时间或取消中断时的状态
+TASK_TIMEOUT = "timeout"
+TASK_CANCELLED = "cancelled"
+
+# 等待协程期间检查取消标记的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+# 传给模型调用的最短超时（秒）
+MIN_CALL_TIMEOUT = 1.0
+
+
+class DeadlineExceeded(Exception):
+    """超过截止时间或请求已取消，reason为TASK_TIMEOUT或TASK_CANCELLED"""
+
+    def __init__(self, reason: str):
+        super().__init__("请求已取消" if reason == TASK_CANCELLED else "超过截止时间")
+        self.reason = reason
+
+
+class Deadline:
+    """请求的截止时间和取消标记，线程安全；expires_at为时间戳（time.time()），None表示不限制时间"""
+
+    def __init__(self, expires_at: Optional[float] = None, cancelled: Optional[threading.Event] = None):
+        self.expires_at = expires_at
+        self._cancelled = cancelled or threading.Event()
+
+    def child(self, seconds: Optional[float]) -> "Deadline":
+        """派生不晚于当前截止时间、最多seconds秒的截止时间，与当前截止时间共用取消标记"""
+        if seconds is None:
+            return Deadline(self.expires_at, self._cancelled)
+        expires_at = time.time() + seconds
+        if self.expires_at is not None:
+            expires_at = min(expires_at, self.expires_at)
+        return Deadline(expires_at, self._cancelled)
+
+    def cancel(self):
+        """取消请求（可在其他线程中调用）"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数，不限制时间时返回None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def timeout_kwargs(self) -> Dict[str, float]:
+        """模型调用的超时参数，使HTTP请求在截止时间到达时结束；不限制时间时为空"""
+        remaining = self.remaining()
+        return {} if remaining is None else {"timeout": max(remaining, MIN_CALL_TIMEOUT)}
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or self.remaining() == 0.0
+
+    def check(self):
+        """
+        Raises:
+            DeadlineExceeded: 已超过截止时间或请求已取消
+        """
+        if self.cancelled:
+            raise DeadlineExceeded(TASK_CANCELLED)
+        if self.remaining() == 0.0:
+            raise DeadlineExceeded(TASK_TIMEOUT)
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        """
+        在截止时间内等待协程完成，超时或取消时取消协程（关闭其中的模型、MCP和HTTP调用）
+
+        Raises:
+            DeadlineExceeded: 已超过截止时间或请求已取消
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                try:
+                    self.check()
+                except DeadlineExceeded:
+                    task.cancel()
+                    # 等待协程完成清理（如关闭MCP会话），清理中的异常不再关心
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+                remaining = self.remaining()
+                timeout = CANCEL_POLL_INTERVAL if remaining is None else min(remaining, CANCEL_POLL_INTERVAL)
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if done:
+                    return task.result()
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
@@ -0,0 +1,235 @@
+"""
+请求幂等模块
+双击、客户端重试或多个标签页会重复提交同一条消息或同一个计划。每个请求有一个幂等键（客户端通过Idempotency-Key指定，
+或由对话ID和请求内容的哈希生成）：第一个请求负责执行，执行期间到达的重复请求等待其结果，
+执行完成后的重复请求在有效期内直接返回保存的响应。每条记录保存请求内容的哈希，相同的键用于不同的请求内容时拒绝执行。
+记录保存在共享的SQLite数据库中，多个工作进程看到的状态一致
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .shared_state import SharedDict
+
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+
+# 执行中的记录超过该时间（秒）仍未完成时视为执行的进程已退出，重复请求可以接手执行
+LEASE_SECONDS = 300
+# 等待其他请求执行结果时检查的间隔（秒）
+POLL_INTERVAL = 0.2
+# 每保存多少个响应清理一次过期记录
+PRUNE_EVERY = 100
+
+_NAMESPACE = "idempotency"
+
+
+class IdempotencyConflict(Exception):
+    """相同的请求仍在执行中，等待超时"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("相同的请求正在处理中，请稍后再试")
+        self.retry_after = retry_after
+
+
+class IdempotencyKeyMismatch(Exception):
+    """相同的幂等键已用于内容不同的请求"""
+
+    def __init__(self):
+        super().__init__("该Idempotency-Key已用于内容不同的请求，请使用新的键")
+
+
+def fingerprint(*parts: Any) -> str:
+    """请求内容的哈希（按规范化的JSON计算）"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def derive_key(scope: str, *parts: Any) -> str:
+    """由请求内容生成幂等键，scope区分不同的接口"""
+    return f"{scope}:auto:{fingerprint(*parts)[:32]}"
+
+
+def client_key(scope: str, key: str) -> str:
+    """客户端指定的幂等键，加上接口前缀避免不同接口之间冲突"""
+    return f"{scope}:client:{key.strip()}"
+
+
+class IdempotencyStore:
+    """幂等键到执行状态和响应的映射，线程安全、进程间共享"""
+
+    def __init__(self, db_path: str, ttl: float, wait_seconds: float):
+        """
+        Args:
+            db_path: 保存记录的SQLite数据库
+            ttl: 执行完成后保存响应的默认有效期（秒）
+            wait_seconds: 重复请求等待执行结果的最长时间（秒）
+        """
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self._store = SharedDict(db_path, _NAMESPACE)
+        self._lock = threading.Lock()
+        self._saved = 0
+        # 统计数据（当前进程）
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self.mismatches = 0
+
+    def _claim(self, key: str, owner: str, request_hash: Optional[str]) -> Dict[str, Any]:
+        """没有记录、记录已过期或执行者已退出时占用该键（记录请求内容的哈希），返回最新的记录"""
+
+        def update(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            now = time.time()
+            if (record is None
+                    or (record["state"] == STATE_DONE and record["expires_at"] <= now)
+                    or (record["state"] == STATE_RUNNING and now - record["started_at"] >= LEASE_SECONDS)):
+                return {"state": STATE_RUNNING, "owner": owner, "started_at": now, "request_hash": request_hash}
+            return record
+
+        return self._store.transform(key, update)
+
+    def _poll(self, key: str, owner: str, request_hash: Optional[str], waited: bool,
+              waited_until: float) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Dict[str, Any], int, bool]]]:
+        """尝试占用该键：返回（当前请求占用的记录, None），已完成时返回（None, 保存的响应），需要继续等待时返回（None, None）"""
+        record = self._claim(key, owner, request_hash)
+        if record["state"] == STATE_RUNNING and record["owner"] == owner:
+            with self._lock:
+                self.executed += 1
+            return record, None
+        if request_hash is not None and record.get("request_hash") not in (None, request_hash):
+            with self._lock:
+                self.mismatches += 1
+            raise IdempotencyKeyMismatch()
+        if record["state"] == STATE_DONE:
+            with self._lock:
+                if waited:
+                    self.coalesced += 1
+                else:
+                    self.replayed += 1
+            return None, (record["result"], record["status"], True)
+        if time.monotonic() >= waited_until:
+            with self._lock:
+                self.conflicts += 1
+            raise IdempotencyConflict(max(1.0, LEASE_SECONDS - (time.time() - record["started_at"])))
+        # 执行者失败时会删除记录，之后的循环中由当前请求接手执行
+        return None, None
+
+    def _finish(self, key: str, owner: str, record: Dict[str, Any], request_hash: Optional[str],
+                ttl: Optional[float], result: Dict[str, Any], status: int):
+        """保存成功的响应，失败时删除记录"""
+        if 200 <= status < 300:
+            self._store[key] = {"state": STATE_DONE, "owner": owner, "started_at": record["started_at"],
+                                "request_hash": request_hash,
+                                "expires_at": time.time() + (self.ttl if ttl is None else ttl),
+                                "result": result, "status": status}
+            self._maybe_prune()
+        else:
+            self._release(key, owner)
+
+    def run(self, key: str, compute: Callable[[], Tuple[Dict[str, Any], int]],
+            ttl: Optional[float] = None, request_hash: Optional[str] = None) -> Tuple[Dict[str, Any], int, bool]:
+        """
+        按幂等键执行请求：没有相同的请求时调用compute，相同的请求执行中时等待其结果，已完成时直接返回保存的响应。
+        只保存成功（2xx）的响应，失败的请求可以重试
+
+        Args:
+            key: 幂等键
+            compute: 执行请求，返回（响应数据, HTTP状态码）
+            ttl: 保存响应的有效期（秒），默认使用初始化时的ttl
+            request_hash: 请求内容的哈希（见fingerprint），与该键已有记录的哈希不同时拒绝执行
+
+        Returns:
+            Tuple[Dict[str, Any], int, bool]: （响应数据, HTTP状态码, 是否为重复请求）
+
+        Raises:
+            IdempotencyConflict: 相同的请求执行中，等待超过wait_seconds仍未完成
+            IdempotencyKeyMismatch: 该键已用于内容不同的请求
+        """
+        owner = uuid.uuid4().hex
+        waited_until = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            record, saved = self._poll(key, owner, request_hash, waited, waited_until)
+            if saved is not None:
+                return saved
+            if record is not None:
+                break
+            waited = True
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            result, status = compute()
+        except BaseException:
+            self._release(key, owner)
+            raise
+        self._finish(key, owner, record, request_hash, ttl, result, status)
+        return result, status, False
+
+    async def run_async(self, key: str, compute: Callable[[], Awaitable[Tuple[Dict[str, Any], int]]],
+                        ttl: Optional[float] = None,
+                        request_hash: Optional[str] = None) -> Tuple[Dict[str, Any], int, bool]:
+        """
+        run的异步版本，compute为协程函数；数据库读写放到线程池中执行，等待其他请求的结果时不占用线程。
+        参数、返回值和异常同run
+        """
+        owner = uuid.uuid4().hex
+        waited_until = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            record, saved = await asyncio.to_thread(self._poll, key, owner, request_hash, waited, waited_until)
+            if saved is not None:
+                return saved
+            if record is not None:
+                break
+            waited = True
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            result, status = await compute()
+        except BaseException:
+            # 请求被取消时不能再等待线程池，直接删除记录
+            self._release(key, owner)
+            raise
+        await asyncio.to_thread(self._finish, key, owner, record, request_hash, ttl, result, status)
+        return result, status, False
+
+    def _release(self, key: str, owner: str):
+        """执行失败时删除记录（记录已被其他请求接手时保留）"""
+        record = self._store.get(key)
+        if record and record["owner"] == owner:
+            self._discard(key)
+
+    def _discard(self, key: str):
+        try:
+            del self._store[key]
+        except KeyError:  # 已被其他进程删除
+            pass
+
+    def _maybe_prune(self):
+        with self._lock:
+            self._saved += 1
+            prune = self._saved % PRUNE_EVERY == 0
+        if not prune:
+            return
+        now = time.time()
+        for key in list(self._store):
+            record = self._store.get(key)
+            if record and record["state"] == STATE_DONE and record["expires_at"] <= now:
+                self._discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """执行、直接返回保存的响应、等待执行中请求、幂等键与请求内容不符的次数（当前进程）"""
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "executed": self.executed,
+                "replayed": self.replayed,
+                "coalesced": self.coalesced,
+                "conflicts": self.conflicts,
+                "mismatches": self.mismatches
+            }
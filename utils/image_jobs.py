@@ -0,0 +1,98 @@
+"""
+图片生成任务模块
+以JSON文件记录图片生成任务的状态，供MCP服务器的后台进程写入、Web服务查询
+"""
+import json
+import os
+import re
+import uuid
+from typing import Any, Dict, Optional
+
+from .timestamp_utils import get_current_timestamp
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCESS = "success"
+JOB_ERROR = "error"
+FINISHED_STATUSES = (JOB_SUCCESS, JOB_ERROR)
+
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def job_image_url(job_id: str) -> str:
+    """任务图片的占位地址，图片生成完成后会重定向到实际文件"""
+    return f"/api/image-jobs/{job_id}/image"
+
+
+def job_status_url(job_id: str) -> str:
+    """任务状态查询地址"""
+    return f"/api/image-jobs/{job_id}"
+
+
+class ImageJobStore:
+    """图片生成任务存储，每个任务对应一个JSON文件"""
+
+    def __init__(self, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    @staticmethod
+    def is_valid_job_id(job_id: str) -> bool:
+        """校验任务ID格式，避免路径穿越"""
+        return bool(job_id and _JOB_ID_PATTERN.match(job_id))
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _write(self, job: Dict[str, Any]):
+        path = self._job_path(job["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def create(self, prompt: str, **params) -> Dict[str, Any]:
+        """
+        创建新的图片生成任务
+
+        Args:
+            prompt: 图片描述
+            **params: 其他生成参数
+
+        Returns:
+            Dict[str, Any]: 任务信息
+        """
+        now = get_current_timestamp()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": JOB_QUEUED,
+            "progress": 0.0,
+            "message": "任务已提交",
+            "prompt": prompt,
+            "params": params,
+            "created_at": now,
+            "updated_at": now
+        }
+        self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务信息，不存在时返回None"""
+        if not self.is_valid_job_id(job_id):
+            return None
+        try:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """更新任务字段并返回更新后的任务信息"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        job["updated_at"] = get_current_timestamp()
+        self._write(job)
+        return job
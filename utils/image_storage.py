@@ -0,0 +1,141 @@
+"""
+生成图片存储模块
+流式解码Base64图片写入临时文件，按内容哈希命名并原子落盘，相同图片只保存一份，
+并在线程池中生成缩略图
+"""
+import base64
+import hashlib
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装Pillow时跳过缩略图生成
+    Image = None
+
+# 每次解码的Base64字符数（必须是4的倍数）
+DECODE_CHUNK_CHARS = 256 * 1024
+# 文件名中保留的哈希长度
+HASH_NAME_LENGTH = 32
+# 缩略图配置
+THUMBNAIL_DIR_NAME = "thumbs"
+THUMBNAIL_MAX_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", 512))
+THUMBNAIL_FORMATS = (("webp", "WEBP", {"quality": 80, "method": 4}),
+                     ("jpg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}))
+
+_thumbnail_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnail")
+
+
+def _detect_extension(header: bytes) -> str:
+    """根据文件头判断图片格式"""
+    if header.startswith(b"\x89PNG"):
+        return "png"
+    if header.startswith(b"\xff\xd8"):
+        return "jpg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
+def content_filename(content_hash: str, extension: str) -> str:
+    """按内容哈希生成文件名"""
+    return f"{content_hash[:HASH_NAME_LENGTH]}.{extension}"
+
+
+def thumbnail_filename(filename: str, extension: str = "webp") -> str:
+    """原图对应的缩略图文件名"""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}.{extension}"
+
+
+def store_base64_image(b64_data: str, images_dir: str) -> Dict[str, Any]:
+    """
+    分块解码Base64图片数据并按内容哈希保存，已存在相同内容时直接复用
+
+    Args:
+        b64_data: Base64编码的图片数据
+        images_dir: 图片保存目录
+
+    Returns:
+        Dict[str, Any]: 包含filename、filepath、content_hash、size、deduplicated的字典
+    """
+    os.makedirs(images_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    header = b""
+
+    # 临时文件与目标文件位于同一目录，保证os.replace是原子操作
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", suffix=".tmp", dir=images_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for start in range(0, len(b64_data), DECODE_CHUNK_CHARS):
+                chunk = base64.b64decode(b64_data[start:start + DECODE_CHUNK_CHARS])
+                if not header:
+                    header = chunk[:16]
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        content_hash = hasher.hexdigest()
+        filename = content_filename(content_hash, _detect_extension(header))
+        filepath = os.path.join(images_dir, filename)
+        deduplicated = os.path.exists(filepath)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {
+        "filename": filename,
+        "filepath": filepath,
+        "content_hash": content_hash,
+        "size": size,
+        "deduplicated": deduplicated
+    }
+
+
+def _write_thumbnails(filepath: str) -> List[str]:
+    """生成WebP和JPEG缩略图，返回生成的文件路径"""
+    thumbs_dir = os.path.join(os.path.dirname(filepath), THUMBNAIL_DIR_NAME)
+    os.makedirs(thumbs_dir, exist_ok=True)
+    filename = os.path.basename(filepath)
+
+    written = []
+    with Image.open(filepath) as image:
+        image.draft("RGB", (THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        for extension, image_format, options in THUMBNAIL_FORMATS:
+            target = os.path.join(thumbs_dir, thumbnail_filename(filename, extension))
+            if os.path.exists(target):
+                written.append(target)
+                continue
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            thumbnail.save(tmp_path, image_format, **options)
+            os.replace(tmp_path, target)
+            written.append(target)
+    return written
+
+
+def generate_thumbnails(filepath: str) -> Optional[Future]:
+    """
+    提交缩略图生成任务到线程池
+
+    Args:
+        filepath: 原图路径
+
+    Returns:
+        Optional[Future]: 缩略图任务，未安装Pillow时返回None
+    """
+    if Image is None:
+        return None
+    return _thumbnail_pool.submit(_write_thumbnails, filepath)
@@ -0,0 +1,320 @@
+"""
+大模型响应缓存模块
+问题类型判断、对话标题、任务分类等低温度、短输出的调用经常收到相同的输入，
+按（模型、归一化后的消息、影响输出的参数）缓存响应，命中时不再请求模型；
+内存中按LRU淘汰并设置有效期，可选的磁盘缓存供多个工作进程共享。
+流式、带工具、高温度、未限制输出长度的调用不缓存；与当前时间相关的自由文本回答也不缓存
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+# 温度不超过该值的调用才缓存
+MAX_CACHEABLE_TEMPERATURE = 0.3
+# max_tokens不超过该值的调用才缓存（短输出）
+MAX_CACHEABLE_OUTPUT_TOKENS = 500
+# max_tokens不超过该值或以json_schema约束输出的调用视为标签类输出，不随时间变化
+LABEL_MAX_TOKENS = 20
+# 参与缓存键计算的参数
+KEY_PARAMS = ("temperature", "top_p", "max_tokens", "response_format", "stop", "seed",
+              "presence_penalty", "frequency_penalty")
+# 磁盘缓存每写入多少条清理一次
+DISK_PRUNE_EVERY = 100
+
+# 与当前时间相关的提示词：相对时间用语，或提示词中嵌入了具体的日期时间
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"现在|今天|今日|明天|昨天|今年|本周|这周|目前|当前|最新|实时|刚刚|几点|几号|星期几|天气|新闻|"
+    r"\d{4}[-/年]\d{1,2}[-/月]\d{1,2}|\d{1,2}:\d{2}|"
+    r"\b(?:now|today|tonight|tomorrow|yesterday|current|latest|weather|news)\b",
+    re.IGNORECASE
+)
+
+# 归一化时去掉的结尾标点和语气符号
+_TRAILING_PUNCTUATION = "。.！!？?～~…,，、 "
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化消息文本：全半角统一、合并空白、去掉结尾的标点，使"你好！"与"你好"命中同一缓存
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        str: 归一化后的文本
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, sort_keys=True)
+
+
+def bypass_reason(kwargs: Dict[str, Any]) -> Optional[str]:
+    """
+    判断调用是否不应缓存
+
+    Returns:
+        Optional[str]: 不缓存的原因，可以缓存时返回None
+    """
+    if kwargs.get("stream"):
+        return "stream"
+    if kwargs.get("tools") or kwargs.get("functions"):
+        return "tools"
+    if (kwargs.get("n") or 1) > 1:
+        return "multiple_choices"
+    if kwargs.get("temperature") is None or kwargs["temperature"] > MAX_CACHEABLE_TEMPERATURE:
+        return "temperature"
+    max_tokens = kwargs.get("max_tokens")
+    if max_tokens is None or max_tokens > MAX_CACHEABLE_OUTPUT_TOKENS:
+        return "output_length"
+    # 标签类输出（分类、标题）与调用时间无关，自由文本回答中提到当前时间时不缓存
+    response_format = kwargs.get("response_format") or {}
+    is_label = max_tokens <= LABEL_MAX_TOKENS or response_format.get("type") == "json_schema"
+    if not is_label and any(TIME_SENSITIVE_PATTERN.search(_content_text(message.get("content")))
+                            for message in kwargs.get("messages", [])):
+        return "time_sensitive"
+    return None
+
+
+class LLMResponseCache:
+    """大模型响应的两级缓存（内存LRU + 可选磁盘），线程安全"""
+
+    def __init__(self, max_entries: int, ttl: float, cache_dir: Optional[str] = None,
+                 max_disk_entries: int = 20000, normalize: Callable[[str], str] = normalize_text):
+        """
+        Args:
+            max_entries: 内存中最多保存的响应数
+            ttl: 缓存有效期（秒）
+            cache_dir: 磁盘缓存目录，None表示只使用内存
+            max_disk_entries: 磁盘中最多保存的响应数
+            normalize: 计算缓存键前对消息文本的归一化函数
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.normalize = normalize
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()  # key -> (过期时间, 响应)
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 统计数据
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed: Dict[str, int] = {}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, kwargs: Dict[str, Any]) -> str:
+        """按模型、归一化后的消息和影响输出的参数生成缓存键"""
+        messages = [
+            {"role": message.get("role"), "content": self.normalize(_content_text(message.get("content")))}
+            for message in kwargs.get("messages", [])
+        ]
+        raw = json.dumps({
+            "model": kwargs.get("model"),
+            "messages": messages,
+            "params": {name: kwargs[name] for name in KEY_PARAMS if kwargs.get(name) is not None}
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的响应，依次查询内存和磁盘"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("expires_at", 0) > now:
+                    self._remember(key, data["expires_at"], data["response"])
+                    with self._lock:
+                        self.disk_hits += 1
+                    return data["response"]
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, response: Dict[str, Any]):
+        """写入响应，磁盘写入使用临时文件+重命名保证原子性"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, response)
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "response": response}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % DISK_PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk()
+
+    def _remember(self, key: str, expires_at: float, response: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = (expires_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def _prune_disk(self):
+        """删除磁盘中过期的响应，数量仍超过上限时删除最早写入的"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue
+            if modified + self.ttl <= now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                entries.append((modified, path))
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def record_bypass(self, reason: str):
+        with self._lock:
+            self.bypassed[reason] = self.bypassed.get(reason, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计数据（当前进程）"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": bool(self.cache_dir),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "bypassed": dict(self.bypassed)
+            }
+
+
+class _CachedCompletions:
+    def __init__(self, completions, cache: LLMResponseCache):
+        self._completions = completions
+        self._cache = cache
+
+    def _lookup(self, cache: Optional[bool], kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[ChatCompletion]]:
+        """返回（缓存键, 缓存的响应），不使用缓存时缓存键为None"""
+        reason = "disabled" if cache is False else bypass_reason(kwargs)
+        if reason:
+            self._cache.record_bypass(reason)
+            return None, None
+        key = self._cache.make_key(kwargs)
+        cached = self._cache.get(key)
+        return key, ChatCompletion.model_validate(cached) if cached is not None else None
+
+    def _store(self, key: str, kwargs: Dict[str, Any], response):
+        # 路由切换到等价服务商时，响应来自其他模型，不能作为所请求模型的结果缓存
+        routed_model = getattr(response, "routed_model", None)
+        if routed_model is not None and routed_model != kwargs.get("model"):
+            self._cache.record_bypass("failover")
+            return
+        # 只缓存正常结束的响应，被截断或内容为空的响应下次重新请求
+        choice = response.choices[0] if response.choices else None
+        if choice is not None and choice.finish_reason == "stop" and choice.message.content:
+            self._cache.set(key, response.model_dump(mode="json", exclude={"routed_provider", "routed_model"}))
+
+    def create(self, cache: Optional[bool] = None, **kwargs):
+        """与OpenAI的create相同，cache=False时跳过缓存，不指定时按调用参数自动判断"""
+        key, cached = self._lookup(cache, kwargs)
+        if cached is not None:
+            return cached
+        response = self._completions.create(**kwargs)
+        if key is not None:
+            self._store(key, kwargs, response)
+        return response
+
+
+class _AsyncCachedCompletions(_CachedCompletions):
+    async def create(self, cache: Optional[bool] = None, **kwargs):
+        """与同步版本相同，未命中时await异步客户端"""
+        key, cached = self._lookup(cache, kwargs)
+        if cached is not None:
+            return cached
+        response = await self._completions.create(**kwargs)
+        if key is not None:
+            self._store(key, kwargs, response)
+        return response
+
+
+class _CachedChat:
+    def __init__(self, chat, cache: LLMResponseCache):
+        self.completions = _CachedCompletions(chat.completions, cache)
+
+
+class _AsyncCachedChat:
+    def __init__(self, chat, cache: LLMResponseCache):
+        self.completions = _AsyncCachedCompletions(chat.completions, cache)
+
+
+class CachedClient:
+    """包装OpenAI客户端：chat.completions.create先查询响应缓存，其余属性直接使用原客户端"""
+
+    def __init__(self, client, cache: LLMResponseCache):
+        self._client = client
+        self.cache = cache
+        self.chat = _CachedChat(client.chat, cache)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+class AsyncCachedClient(CachedClient):
+    """包装异步客户端，与CachedClient相同，chat.completions.create为协程；缓存读写只涉及内存和小文件，直接在事件循环中执行"""
+
+    def __init__(self, client, cache: LLMResponseCache):
+        self._client = client
+        self.cache = cache
+        self.chat = _AsyncCachedChat(client.chat, cache)
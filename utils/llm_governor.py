@@ -0,0 +1,379 @@
+"""
+大模型调用限流模块
+每个模型服务商一个限流器：按每分钟请求数和每分钟token数（令牌桶）限速，并限制同时进行的请求数；
+收到429时按Retry-After暂停并降低速率，之后逐步恢复。同一服务商的同步和异步OpenAI客户端共用一个限流器
+"""
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from .token_utils import estimate_tokens
+
+# 未指定max_tokens时按该输出token数预估
+DEFAULT_OUTPUT_TOKENS = 1000
+# 收到429后的最大重试次数，以及连接错误、服务端错误的最大重试次数
+MAX_RATE_LIMIT_RETRIES = 4
+MAX_ERROR_RETRIES = 2
+# 没有Retry-After时的退避时间（秒），按重试次数翻倍
+BASE_BACKOFF_SECONDS = 1.0
+# 异步调用等待空闲请求名额时的检查间隔（秒）
+SLOT_POLL_INTERVAL = 0.02
+# 收到429后速率乘以该系数，之后每次成功恢复一点，速率不低于配置的MIN_RATE_FACTOR倍
+RATE_DECREASE_FACTOR = 0.5
+RATE_RECOVERY_STEP = 0.05
+MIN_RATE_FACTOR = 0.1
+
+
+class TokenBucket:
+    """令牌桶：按每分钟的配额匀速补充，预约的令牌可以透支，调用方按返回的时间等待"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float, rate_factor: float):
+        rate = self.per_minute * rate_factor / 60
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float, rate_factor: float) -> float:
+        """预约amount个令牌，返回需要等待的秒数"""
+        self._refill(now, rate_factor)
+        # 单次请求超过桶容量时按容量计算，避免永远等不到
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / (self.per_minute * rate_factor / 60)
+
+    def refund(self, amount: float):
+        """退还预约后未使用的令牌"""
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class GovernorTimeoutError(APITimeoutError):
+    """在限流器中排队超过了调用的时间预算；按超时处理，路由会切换到等价服务商"""
+
+    def __init__(self, provider: str):
+        APIConnectionError.__init__(self, message=f"{provider} 限流排队超过调用的时间预算",
+                                    request=httpx.Request("POST", f"http://{provider}.governor/"))
+
+
+class ProviderGovernor:
+    """单个模型服务商的限流器，线程安全"""
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, max_in_flight: int):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.rate_factor = 1.0
+        self._paused_until = 0.0
+        # 统计数据
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_requests = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def acquire(self, estimated_tokens: int, expires_at: Optional[float] = None):
+        """
+        等待并占用一个请求名额，按预估token数扣减配额
+
+        Args:
+            estimated_tokens: 预估的token数
+            expires_at: 调用的截止时间（time.monotonic()），None表示不限制
+
+        Raises:
+            GovernorTimeoutError: 截止时间前等不到名额或配额
+        """
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            timeout = None if expires_at is None else max(expires_at - started, 0)
+            if not self._slots.acquire(timeout=timeout):
+                raise GovernorTimeoutError(self.name)
+            delay = self._reserve(estimated_tokens, expires_at)
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        self._admitted(started)
+
+    async def acquire_async(self, estimated_tokens: int, expires_at: Optional[float] = None):
+        """与acquire相同，等待期间不占用线程；被取消时归还已占用的名额"""
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not self._slots.acquire(blocking=False):
+                if expires_at is not None and time.monotonic() >= expires_at:
+                    raise GovernorTimeoutError(self.name)
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+            delay = self._reserve(estimated_tokens, expires_at)
+            if delay > 0:
+                try:
+                    await asyncio.sleep(delay)
+                except BaseException:
+                    self._slots.release()
+                    raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        self._admitted(started)
+
+    def _reserve(self, estimated_tokens: int, expires_at: Optional[float]) -> float:
+        """
+        已占用名额后按预估token数扣减配额，返回发起请求前需要等待的秒数
+
+        Raises:
+            GovernorTimeoutError: 等待配额后已超过截止时间（已退还配额和名额）
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._requests.reserve(1, now, self.rate_factor),
+                        self._tokens.reserve(estimated_tokens, now, self.rate_factor),
+                        self._paused_until - now)
+            # 等待配额后已超过截止时间：退还预约的配额，不再发起请求
+            if expires_at is not None and now + delay >= expires_at:
+                self._requests.refund(1)
+                self._tokens.refund(estimated_tokens)
+                self._slots.release()
+                raise GovernorTimeoutError(self.name)
+        return delay
+
+    def _admitted(self, started: float):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.in_flight += 1
+            self.total_requests += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def on_success(self):
+        with self._lock:
+            self.rate_factor = min(1.0, self.rate_factor + RATE_RECOVERY_STEP)
+
+    def on_rate_limited(self, retry_after: Optional[float]):
+        """收到429：暂停到Retry-After指定的时间，并降低速率"""
+        with self._lock:
+            self.rate_limited += 1
+            self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor * RATE_DECREASE_FACTOR)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "waiting": self.waiting,
+                "rate_factor": round(self.rate_factor, 2),
+                "total_requests": self.total_requests,
+                "rate_limited": self.rate_limited,
+                "avg_wait_seconds": round(self.total_wait_seconds / self.total_requests, 3)
+                if self.total_requests else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 3)
+            }
+
+
+_governors: Dict[str, ProviderGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name: str, requests_per_minute: int, tokens_per_minute: int, max_in_flight: int) -> ProviderGovernor:
+    """获取服务商的限流器，同一进程中每个服务商只创建一次"""
+    with _governors_lock:
+        if name not in _governors:
+            _governors[name] = ProviderGovernor(name, requests_per_minute, tokens_per_minute, max_in_flight)
+        return _governors[name]
+
+
+def get_governor_stats() -> Dict[str, Dict[str, Any]]:
+    """所有服务商限流器的统计数据"""
+    with _governors_lock:
+        governors = list(_governors.values())
+    return {governor.name: governor.stats() for governor in governors}
+
+
+def _estimate_request_tokens(kwargs: Dict[str, Any]) -> int:
+    prompt_tokens = sum(estimate_tokens(message.get("content") or "")
+                        if isinstance(message.get("content"), str) else DEFAULT_OUTPUT_TOKENS
+                        for message in kwargs.get("messages", []))
+    return prompt_tokens + (kwargs.get("max_tokens") or DEFAULT_OUTPUT_TOKENS)
+
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _within_budget(expires_at: Optional[float], wait_seconds: float) -> bool:
+    """等待wait_seconds后是否还有时间重试，expires_at为None表示不限制时间"""
+    return expires_at is None or time.monotonic() + wait_seconds < expires_at
+
+
+def _retry_wait(governor: ProviderGovernor, error: BaseException, retries: Dict[str, int],
+                expires_at: Optional[float], retry_rate_limits: bool) -> Optional[float]:
+    """
+    请求失败后决定是否重试，同步和异步客户端共用
+
+    Args:
+        governor: 服务商的限流器，收到429时暂停并降低速率
+        error: 请求抛出的异常
+        retries: 已重试的次数（rate_limit、error），重试时累加
+        expires_at: 调用的截止时间，None表示不限制
+        retry_rate_limits: 收到429时是否重试
+
+    Returns:
+        Optional[float]: 重试前需要等待的秒数，不重试时返回None
+    """
+    if isinstance(error, RateLimitError):
+        retry_after = _retry_after(error)
+        governor.on_rate_limited(retry_after)
+        backoff = BASE_BACKOFF_SECONDS * 2 ** retries["rate_limit"]
+        if (not retry_rate_limits or retries["rate_limit"] >= MAX_RATE_LIMIT_RETRIES
+                or not _within_budget(expires_at, retry_after or backoff)):
+            return None
+        retries["rate_limit"] += 1
+        # 有Retry-After时由限流器统一暂停，否则按次数退避
+        return 0.0 if retry_after else backoff
+    if isinstance(error, APITimeoutError):
+        # 超时说明时间预算已用完，重试只会超出调用方的截止时间
+        return None
+    if isinstance(error, (APIConnectionError, InternalServerError)):
+        backoff = BASE_BACKOFF_SECONDS * 2 ** retries["error"]
+        if retries["error"] >= MAX_ERROR_RETRIES or not _within_budget(expires_at, backoff):
+            return None
+        retries["error"] += 1
+        return backoff
+    return None
+
+
+class _GovernedCompletions:
+    def __init__(self, completions, governor: ProviderGovernor):
+        self._completions = completions
+        self._governor = governor
+
+    def _stream(self, response) -> Iterator[Any]:
+        """流式响应读取完后才释放请求名额"""
+        try:
+            yield from response
+        finally:
+            self._governor.release()
+
+    def create(self, retry_rate_limits: bool = True, **kwargs):
+        """
+        与OpenAI的create相同，经过限流器并重试429、连接错误和服务端错误
+
+        超时不重试；kwargs中的timeout（秒）视为整个调用的时间预算，限流排队、重试的等待和之后的请求都不超过剩余时间，
+        排队超过预算时抛出GovernorTimeoutError。
+        retry_rate_limits为False时收到429直接抛出，由路由切换到等价服务商
+        """
+        estimated_tokens = _estimate_request_tokens(kwargs)
+        timeout = kwargs.get("timeout")
+        expires_at = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+        retries = {"rate_limit": 0, "error": 0}
+        while True:
+            self._governor.acquire(estimated_tokens, expires_at)
+            if expires_at is not None:
+                kwargs["timeout"] = max(expires_at - time.monotonic(), 0.001)
+            try:
+                response = self._completions.create(**kwargs)
+            except BaseException as e:
+                self._governor.release()
+                wait = _retry_wait(self._governor, e, retries, expires_at, retry_rate_limits)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+                continue
+
+            self._governor.on_success()
+            if kwargs.get("stream"):
+                return self._stream(response)
+            self._governor.release()
+            return response
+
+
+class _GovernedChat:
+    def __init__(self, chat, governor: ProviderGovernor):
+        self.completions = _GovernedCompletions(chat.completions, governor)
+
+
+class _AsyncGovernedCompletions(_GovernedCompletions):
+    async def _astream(self, response) -> AsyncIterator[Any]:
+        """流式响应读取完后才释放请求名额"""
+        try:
+            async for chunk in response:
+                yield chunk
+        finally:
+            self._governor.release()
+
+    async def create(self, retry_rate_limits: bool = True, **kwargs):
+        """与同步版本相同，排队、退避和请求期间不占用线程"""
+        estimated_tokens = _estimate_request_tokens(kwargs)
+        timeout = kwargs.get("timeout")
+        expires_at = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+        retries = {"rate_limit": 0, "error": 0}
+        while True:
+            await self._governor.acquire_async(estimated_tokens, expires_at)
+            if expires_at is not None:
+                kwargs["timeout"] = max(expires_at - time.monotonic(), 0.001)
+            try:
+                response = await self._completions.create(**kwargs)
+            except BaseException as e:
+                self._governor.release()
+                wait = _retry_wait(self._governor, e, retries, expires_at, retry_rate_limits)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+                continue
+
+            self._governor.on_success()
+            if kwargs.get("stream"):
+                return self._astream(response)
+            self._governor.release()
+            return response
+
+
+class _AsyncGovernedChat:
+    def __init__(self, chat, governor: ProviderGovernor):
+        self.completions = _AsyncGovernedCompletions(chat.completions, governor)
+
+
+class GovernedClient:
+    """包装OpenAI客户端：chat.completions.create经过限流器，其余属性直接使用原客户端"""
+
+    def __init__(self, client, governor: ProviderGovernor):
+        self._client = client
+        self.governor = governor
+        self.chat = _GovernedChat(client.chat, governor)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+class AsyncGovernedClient(GovernedClient):
+    """包装AsyncOpenAI客户端，与GovernedClient相同，chat.completions.create为协程"""
+
+    def __init__(self, client, governor: ProviderGovernor):
+        self._client = client
+        self.governor = governor
+        self.chat = _AsyncGovernedChat(client.chat, governor)
@@ -1,25 +1,43 @@
 """
 实时日志管理模块
-捕获所有print输出并同步到前端
+捕获所有print输出并同步到前端；配置了共享日志缓冲区时，
+各进程的日志由后台线程批量写入缓冲区，任何一个进程都能读到全部日志
 """
+import os
+import socket
 import sys
 import threading
 import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from queue import Queue, Empty
 import json
 
+# 日志写入共享缓冲区的间隔（秒）
+LOG_SHIP_INTERVAL = 0.2
+# 等待新日志时查询共享缓冲区的间隔（秒）
+LOG_POLL_INTERVAL = 0.1
+
 class LogCapture:
     """日志捕获类，重定向print输出"""
     
-    def __init__(self):
+    def __init__(self, ring=None, worker: Optional[str] = None):
         self.logs = []
         self.log_queue = Queue()
         self.original_stdout = sys.stdout
         self.lock = threading.Lock()
         self.max_logs = 1000  # 最多保存1000条日志
         
+        # 共享日志缓冲区（utils.shared_state.LogRing）
+        self.ring = ring
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self._outbox = []
+        self._ship_lock = threading.Lock()
+        self._cursor = 0
+        if self.ring is not None:
+            self._cursor = self.ring.last_id()
+            threading.Thread(target=self._ship_loop, name="log-shipper", daemon=True).start()
+        
     def write(self, text):
         """重写write方法，捕获print输出"""
         # 写入原始输出
@@ -44,8 +62,29 @@ class LogCapture:
                 if len(self.logs) > self.max_logs:
                     self.logs.pop(0)
                 
-                # 添加到队列供实时获取
-                self.log_queue.put(log_entry)
+                # 使用共享缓冲区时由后台线程写入缓冲区，否则添加到队列供实时获取
+                if self.ring is not None:
+                    self._outbox.append(log_entry)
+                else:
+                    self.log_queue.put(log_entry)
+    
+    def _ship_loop(self):
+        while True:
+            time.sleep(LOG_SHIP_INTERVAL)
+            self.ship()
+    
+    def ship(self):
+        """将尚未写入的日志批量写入共享缓冲区"""
+        if self.ring is None:
+            return
+        with self._ship_lock:
+            with self.lock:
+                entries, self._outbox = self._outbox, []
+            try:
+                self.ring.append(entries, self.worker)
+            except Exception as e:
+                # 写入失败时不能再print，避免递归
+                self.original_stdout.write(f"日志写入共享缓冲区失败: {e}\n")
     
     def flush(self):
         """flush方法，保持兼容性"""
@@ -53,11 +92,22 @@ class LogCapture:
     
     def get_recent_logs(self, limit: int = 50) -> List[Dict[str, Any]]:
         """获取最近的日志"""
+        if self.ring is not None:
+            self.ship()
+            return self.ring.recent(limit)
         with self.lock:
             return self.logs[-limit:] if len(self.logs) > limit else self.logs.copy()
     
-    def get_new_logs(self, timeout: float = 1.0) -> List[Dict[str, Any]]:
-        """获取新的日志（阻塞式）"""
+    def get_new_logs(self, timeout: float = 1.0, after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """获取新的日志（阻塞式），使用共享缓冲区时返回after_id之后的日志"""
+        if self.ring is not None:
+            deadline = time.time() + timeout
+            while True:
+                new_logs = self.drain_new_logs(after_id)
+                if new_logs or time.time() >= deadline:
+                    return new_logs
+                time.sleep(LOG_POLL_INTERVAL)
+        
         new_logs = []
         start_time = time.time()
         
@@ -72,8 +122,28 @@ class LogCapture:
         
         return new_logs
     
+    def drain_new_logs(self, after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """取出已产生的新日志（不阻塞），使用共享缓冲区时返回after_id之后的日志"""
+        if self.ring is not None:
+            # 未指定after_id时使用本进程记录的读取位置
+            new_logs = self.ring.after(self._cursor if after_id is None else after_id)
+            if new_logs and after_id is None:
+                self._cursor = new_logs[-1]["id"]
+            return new_logs
+        
+        new_logs = []
+        while True:
+            try:
+                new_logs.append(self.log_queue.get_nowait())
+            except Empty:
+                return new_logs
+    
     def clear_logs(self):
         """清空日志"""
+        if self.ring is not None:
+            with self.lock:
+                self._outbox.clear()
+            self.ring.clear()
         with self.lock:
             self.logs.clear()
             # 清空队列
@@ -86,11 +156,11 @@ class LogCapture:
 # 全局日志捕获实例
 _log_capture = None
 
-def init_log_capture():
-    """初始化日志捕获"""
+def init_log_capture(ring=None, worker: Optional[str] = None):
+    """初始化日志捕获，传入ring时日志同时写入多进程共享的日志缓冲区"""
     global _log_capture
     if _log_capture is None:
-        _log_capture = LogCapture()
+        _log_capture = LogCapture(ring, worker)
         sys.stdout = _log_capture
         print("🚀 日志捕获系统已启动")
     return _log_capture
@@ -0,0 +1,404 @@
+"""
+大模型路由模块
+记录每个服务商、每个模型最近一段时间的延迟和错误率，首选服务商出错或性能下降时切换到配置的等价服务商；
+对延迟敏感的调用可开启对冲：首选请求超过其p95延迟仍未返回时，向备选服务商再发一次请求，取先返回的结果；
+请求中的timeout（秒）是整个调用的时间预算，切换后的服务商只使用剩余的时间。
+配置了异步客户端时，acreate在事件循环中完成同样的路由，对冲时取消未返回的请求
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Collection, Deque, Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from .llm_governor import GovernedClient
+from .log_manager import log_info, log_error
+
+# 统计窗口：最多保留的样本数和样本有效期（秒），过期后性能下降的服务商会重新被尝试
+STATS_WINDOW_SIZE = 50
+STATS_WINDOW_SECONDS = 300
+# 判断服务商性能下降所需的最少样本数、错误率阈值
+MIN_SAMPLES = 5
+DEGRADED_ERROR_RATE = 0.5
+# 样本不足时对冲请求的等待时间（秒），以及等待时间的下限
+DEFAULT_HEDGE_DELAY = 3.0
+MIN_HEDGE_DELAY = 0.5
+# 对冲请求使用的线程数
+HEDGE_WORKERS = 16
+
+
+def _should_failover(error: Exception) -> bool:
+    """连接错误、超时、429和服务端错误时切换服务商，请求本身有误（4xx）时不切换"""
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _expires_at(kwargs: Dict[str, Any]) -> Optional[float]:
+    """kwargs中的timeout（秒）对应的截止时间，未指定数值时返回None"""
+    timeout = kwargs.get("timeout")
+    return time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+
+
+def _with_remaining_time(kwargs: Dict[str, Any], expires_at: Optional[float]) -> Optional[Dict[str, Any]]:
+    """把timeout换成剩余的时间预算，预算已用完时返回None"""
+    if expires_at is None:
+        return kwargs
+    remaining = expires_at - time.monotonic()
+    if remaining <= 0:
+        return None
+    return {**kwargs, "timeout": remaining}
+
+
+def _tag_route(response: Any, route: Tuple[str, str]) -> Any:
+    """在响应上记录实际应答的服务商和模型（routed_provider、routed_model），响应缓存据此判断是否切换过服务商"""
+    try:
+        response.routed_provider, response.routed_model = route
+    except (AttributeError, TypeError, ValueError):  # 不支持设置属性的响应
+        pass
+    return response
+
+
+class RouteStats:
+    """单个服务商和模型的滚动延迟、错误统计，线程安全"""
+
+    def __init__(self, window_size: int = STATS_WINDOW_SIZE, window_seconds: float = STATS_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window_size)  # (时间, 延迟, 是否出错)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: bool):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, error))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            return [sample for sample in self._samples if sample[0] >= cutoff]
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = self._recent()
+        latencies = sorted(latency for _, latency, error in samples if not error)
+        errors = sum(1 for _, _, error in samples if error)
+        return {
+            "samples": len(samples),
+            "error_rate": round(errors / len(samples), 3) if samples else 0.0,
+            "p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None
+        }
+
+
+class ModelRouter:
+    """按服务商路由大模型调用，支持故障切换和对冲请求"""
+
+    def __init__(self, providers: Dict[str, Tuple[Callable[[], Any], str]], failover: Dict[str, List[str]],
+                 degraded_p95_seconds: float, json_schema_providers: Optional[Collection[str]] = None,
+                 async_providers: Optional[Dict[str, Callable[[], Any]]] = None):
+        """
+        Args:
+            providers: 服务商名称 -> (创建客户端的函数, 默认模型)，只包含可用（配置了API Key）的服务商
+            failover: 服务商名称 -> 按顺序排列的等价服务商，不可用的服务商会被跳过
+            degraded_p95_seconds: p95延迟超过该值时视为性能下降
+            json_schema_providers: 支持response_format为json_schema的服务商，None表示都支持；
+                其他服务商收到json_schema请求时改用json_object，并在系统提示中给出schema
+            async_providers: 服务商名称 -> 创建异步客户端（AsyncOpenAI）的函数，供acreate使用；
+                异步客户端绑定创建时的事件循环，只能在同一个长期运行的事件循环中使用
+        """
+        self.providers = providers
+        self.failover = failover
+        self.degraded_p95_seconds = degraded_p95_seconds
+        self.json_schema_providers = None if json_schema_providers is None else set(json_schema_providers)
+        self.async_providers = async_providers or {}
+        self._clients: Dict[str, Any] = {}
+        self._async_clients: Dict[str, Any] = {}
+        self._stats: Dict[Tuple[str, str], RouteStats] = {}
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+    def _client(self, provider: str):
+        with self._lock:
+            if provider not in self._clients:
+                self._clients[provider] = self.providers[provider][0]()
+            return self._clients[provider]
+
+    def _async_client(self, provider: str):
+        with self._lock:
+            if provider not in self._async_clients:
+                self._async_clients[provider] = self.async_providers[provider]()
+            return self._async_clients[provider]
+
+    def stats_for(self, provider: str, model: str) -> RouteStats:
+        with self._lock:
+            return self._stats.setdefault((provider, model), RouteStats())
+
+    def is_degraded(self, provider: str, model: str) -> bool:
+        snapshot = self.stats_for(provider, model).snapshot()
+        if snapshot["samples"] < MIN_SAMPLES:
+            return False
+        return (snapshot["error_rate"] >= DEGRADED_ERROR_RATE
+                or (snapshot["p95"] is not None and snapshot["p95"] >= self.degraded_p95_seconds))
+
+    def supports(self, provider: str, kwargs: Dict[str, Any]) -> bool:
+        """服务商能否处理该请求的response_format（json_schema只有部分服务商支持）"""
+        response_format = kwargs.get("response_format") or {}
+        if response_format.get("type") != "json_schema" or self.json_schema_providers is None:
+            return True
+        return provider in self.json_schema_providers
+
+    def adapt_request(self, provider: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """服务商不支持json_schema时，改用json_object，并把schema追加到系统提示中"""
+        if self.supports(provider, kwargs):
+            return kwargs
+        schema = kwargs["response_format"].get("json_schema", {}).get("schema", {})
+        instruction = "请只输出一个JSON对象，严格符合以下JSON Schema：\n" + json.dumps(schema, ensure_ascii=False)
+        messages = list(kwargs.get("messages") or [])
+        if messages and messages[0].get("role") == "system":
+            messages[0] = {**messages[0], "content": f"{messages[0]['content']}\n\n{instruction}"}
+        else:
+            messages.insert(0, {"role": "system", "content": instruction})
+        return {**kwargs, "messages": messages, "response_format": {"type": "json_object"}}
+
+    def candidates(self, primary: str, kwargs: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """
+        首选服务商及其等价服务商，性能下降的排在最后；跳过不可用的服务商
+
+        Raises:
+            ValueError: 首选服务商和等价服务商都不可用
+        """
+        routes = []
+        if primary in self.providers:
+            routes.append((primary, kwargs.get("model") or self.providers[primary][1]))
+        routes += [(name, self.providers[name][1]) for name in self.failover.get(primary, [])
+                   if name in self.providers and name != primary]
+        if not routes:
+            raise ValueError(f"没有可用的模型服务商：{primary} 及其等价服务商均未配置API Key")
+        return sorted(routes, key=lambda route: self.is_degraded(*route))
+
+    def _request_kwargs(self, route: Tuple[str, str], kwargs: Dict[str, Any], client: Any, last: bool) -> Dict[str, Any]:
+        """单个服务商的请求参数；还有等价服务商可切换时（last为False），收到429不在限流器中重试，直接切换"""
+        provider, model = route
+        create_kwargs = {**self.adapt_request(provider, kwargs), "model": model}
+        # 只有限流器（包括异步限流器）支持retry_rate_limits参数
+        if not last and isinstance(client, GovernedClient):
+            create_kwargs["retry_rate_limits"] = False
+        return create_kwargs
+
+    def _record(self, route: Tuple[str, str], started: float, error: Optional[Exception] = None):
+        """记录调用的延迟；只有需要切换服务商的错误计入错误率"""
+        if error is None or _should_failover(error):
+            self.stats_for(*route).record(time.monotonic() - started, error is not None)
+
+    def _call(self, route: Tuple[str, str], kwargs: Dict[str, Any], last: bool = True):
+        """调用单个服务商"""
+        client = self._client(route[0])
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(**self._request_kwargs(route, kwargs, client, last))
+        except Exception as e:
+            self._record(route, started, e)
+            raise
+        self._record(route, started)
+        return _tag_route(response, route)
+
+    async def _acall(self, route: Tuple[str, str], kwargs: Dict[str, Any], last: bool = True):
+        """通过异步客户端调用单个服务商"""
+        client = self._async_client(route[0])
+        started = time.monotonic()
+        try:
+            response = await client.chat.completions.create(**self._request_kwargs(route, kwargs, client, last))
+        except Exception as e:
+            self._record(route, started, e)
+            raise
+        self._record(route, started)
+        return _tag_route(response, route)
+
+    def create(self, primary: str, kwargs: Dict[str, Any], hedge: bool = False):
+        """按路由发起chat.completions.create调用，切换服务商时只使用剩余的时间预算，预算用完后不再切换"""
+        routes = self.candidates(primary, kwargs)
+        expires_at = _expires_at(kwargs)
+        if hedge and len(routes) > 1 and not kwargs.get("stream"):
+            return self._create_hedged(routes, kwargs, expires_at)
+
+        last_error = None
+        for i, route in enumerate(routes):
+            route_kwargs = _with_remaining_time(kwargs, expires_at) if i else kwargs
+            if route_kwargs is None:
+                log_error(f"模型调用的时间预算已用完，不再切换到 {route[0]}/{route[1]}")
+                break
+            try:
+                return self._call(route, route_kwargs, last=i == len(routes) - 1)
+            except Exception as e:
+                if not _should_failover(e):
+                    raise
+                log_error(f"模型调用失败（{route[0]}/{route[1]}），切换服务商: {e}")
+                last_error = e
+        raise last_error
+
+    def _hedge_delay(self, route: Tuple[str, str]) -> float:
+        snapshot = self.stats_for(*route).snapshot()
+        if snapshot["samples"] < MIN_SAMPLES or snapshot["p95"] is None:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, snapshot["p95"])
+
+    def _create_hedged(self, routes: List[Tuple[str, str]], kwargs: Dict[str, Any], expires_at: Optional[float]):
+        """
+        首选请求超过p95延迟仍未返回时向下一个服务商发起对冲请求，取最先成功的结果；
+        某个请求失败时继续等待其他未完成的请求，全部失败后才抛出异常（优先抛出不需要切换服务商的错误）；
+        对冲和切换的请求只使用剩余的时间预算
+        """
+        pending = {self._hedge_executor.submit(self._call, routes[0], kwargs, len(routes) == 1): routes[0]}
+        remaining = list(routes[1:])
+        delay: Optional[float] = self._hedge_delay(routes[0])
+        last_error = fatal_error = None
+        while pending:
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            delay = None
+            can_failover = False
+            for future in done:
+                route = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    log_error(f"模型调用失败（{route[0]}/{route[1]}）: {e}")
+                    if _should_failover(e):
+                        last_error = e
+                        can_failover = True
+                    else:
+                        fatal_error = fatal_error or e
+            # 首选请求超时未返回，或所有请求都失败且可以切换服务商时，启用下一个服务商
+            if remaining and (not done or (not pending and can_failover)):
+                route_kwargs = _with_remaining_time(kwargs, expires_at)
+                if route_kwargs is None:
+                    remaining = []
+                    continue
+                route = remaining.pop(0)
+                if not done:
+                    log_info(f"模型调用超过 {self._hedge_delay(routes[0])}s 未返回，对冲请求 {route[0]}/{route[1]}")
+                pending[self._hedge_executor.submit(self._call, route, route_kwargs, not remaining)] = route
+        raise fatal_error or last_error
+
+    async def acreate(self, primary: str, kwargs: Dict[str, Any], hedge: bool = False):
+        """与create相同，通过异步客户端调用，只使用配置了异步客户端的服务商"""
+        routes = [route for route in self.candidates(primary, kwargs) if route[0] in self.async_providers]
+        if not routes:
+            raise ValueError(f"没有可用的模型服务商：{primary} 及其等价服务商均未配置异步客户端")
+        expires_at = _expires_at(kwargs)
+        if hedge and len(routes) > 1 and not kwargs.get("stream"):
+            return await self._acreate_hedged(routes, kwargs, expires_at)
+
+        last_error = None
+        for i, route in enumerate(routes):
+            route_kwargs = _with_remaining_time(kwargs, expires_at) if i else kwargs
+            if route_kwargs is None:
+                log_error(f"模型调用的时间预算已用完，不再切换到 {route[0]}/{route[1]}")
+                break
+            try:
+                return await self._acall(route, route_kwargs, last=i == len(routes) - 1)
+            except Exception as e:
+                if not _should_failover(e):
+                    raise
+                log_error(f"模型调用失败（{route[0]}/{route[1]}），切换服务商: {e}")
+                last_error = e
+        raise last_error
+
+    async def _acreate_hedged(self, routes: List[Tuple[str, str]], kwargs: Dict[str, Any],
+                              expires_at: Optional[float]):
+        """与_create_hedged相同，得到结果或全部失败后取消其余未返回的请求"""
+        pending = {asyncio.ensure_future(self._acall(routes[0], kwargs, len(routes) == 1)): routes[0]}
+        remaining = list(routes[1:])
+        delay: Optional[float] = self._hedge_delay(routes[0])
+        last_error = fatal_error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                delay = None
+                can_failover = False
+                for future in done:
+                    route = pending.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        log_error(f"模型调用失败（{route[0]}/{route[1]}）: {e}")
+                        if _should_failover(e):
+                            last_error = e
+                            can_failover = True
+                        else:
+                            fatal_error = fatal_error or e
+                if remaining and (not done or (not pending and can_failover)):
+                    route_kwargs = _with_remaining_time(kwargs, expires_at)
+                    if route_kwargs is None:
+                        remaining = []
+                        continue
+                    route = remaining.pop(0)
+                    if not done:
+                        log_info(f"模型调用超过 {self._hedge_delay(routes[0])}s 未返回，对冲请求 {route[0]}/{route[1]}")
+                    pending[asyncio.ensure_future(self._acall(route, route_kwargs, not remaining))] = route
+            raise fatal_error or last_error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = list(self._stats.items())
+        return {
+            f"{provider}/{model}": {**stats.snapshot(), "degraded": self.is_degraded(provider, model)}
+            for (provider, model), stats in routes
+        }
+
+
+class _RoutedCompletions:
+    def __init__(self, router: ModelRouter, primary: str, hedge: bool):
+        self._router = router
+        self._primary = primary
+        self._hedge = hedge
+
+    def create(self, **kwargs):
+        return self._router.create(self._primary, kwargs, self._hedge)
+
+
+class _RoutedChat:
+    def __init__(self, router: ModelRouter, primary: str, hedge: bool):
+        self.completions = _RoutedCompletions(router, primary, hedge)
+
+
+class RoutedClient:
+    """与OpenAI客户端接口相同：chat.completions.create经过路由，传入的model用于首选服务商"""
+
+    def __init__(self, router: ModelRouter, primary: str, hedge: bool = False):
+        self._router = router
+        self._primary = primary
+        self.chat = _RoutedChat(router, primary, hedge)
+
+    def __getattr__(self, name: str):
+        provider = self._router.candidates(self._primary, {})[0][0]
+        return getattr(self._router._client(provider), name)
+
+
+class _AsyncRoutedCompletions(_RoutedCompletions):
+    async def create(self, **kwargs):
+        return await self._router.acreate(self._primary, kwargs, self._hedge)
+
+
+class _AsyncRoutedChat:
+    def __init__(self, router: ModelRouter, primary: str, hedge: bool):
+        self.completions = _AsyncRoutedCompletions(router, primary, hedge)
+
+
+class AsyncRoutedClient(RoutedClient):
+    """与AsyncOpenAI客户端接口相同：chat.completions.create为协程，经过路由"""
+
+    def __init__(self, router: ModelRouter, primary: str, hedge: bool = False):
+        self._router = router
+        self._primary = primary
+        self.chat = _AsyncRoutedChat(router, primary, hedge)
+
+    def __getattr__(self, name: str):
+        provider = self._router.candidates(self._primary, {})[0][0]
+        return getattr(self._router._async_client(provider), name)
@@ -0,0 +1,406 @@
+"""
+网页正文抓取模块
+并发抓取搜索结果页面、提取可读正文，并写入按内容寻址的磁盘缓存。
+搜索结果中的URL不可信：每次请求（包括每一跳重定向）前解析域名，拒绝回环、内网、链路本地等非公网地址
+"""
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+# 抓取限制
+DEFAULT_CONCURRENCY = 6          # 全局最大并发数
+DEFAULT_PER_HOST_LIMIT = 2       # 单个站点最大并发数
+DEFAULT_DEADLINE = 8.0           # 整个抓取阶段的总时限（秒）
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024  # 单个页面最多下载的字节数
+DEFAULT_MAX_CHARS = 4000         # 单个页面最多保留的正文字符数
+PAGE_CACHE_TTL = 24 * 60 * 60    # 页面缓存有效期（秒）
+PAGE_CACHE_MAX_ENTRIES = 5000    # 页面缓存最多保存的URL数
+PAGE_CACHE_PRUNE_EVERY = 100     # 每写入多少个页面清理一次缓存
+MAX_REDIRECTS = 5                # 最多跟随的重定向次数
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; WynnaBot/1.0)",
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.5",
+}
+
+# 不计入正文的标签
+SKIP_TAGS = {"script", "style", "noscript", "nav", "footer", "header", "aside",
+             "form", "iframe", "svg", "button", "select", "template"}
+# 块级标签，用于切分文本段落
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "br", "dd", "dt"}
+# 过短的段落通常是导航、按钮等噪音
+MIN_BLOCK_CHARS = 20
+
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+class UnsafeURLError(Exception):
+    """URL指向非公网地址或重定向次数过多，拒绝抓取"""
+
+
+def is_public_address(address: IPAddress) -> bool:
+    """是否为公网地址（排除回环、内网、链路本地、保留和组播地址）"""
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+async def resolve_host(host: str, port: int) -> List[IPAddress]:
+    """解析域名的全部地址，host本身是IP时直接返回"""
+    try:
+        return [ipaddress.ip_address(host)]
+    except ValueError:
+        pass
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+
+
+class _MainTextParser(HTMLParser):
+    """提取HTML中的标题和正文段落"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.blocks: List[Dict[str, Any]] = []
+        self._skip_depth = 0
+        self._in_title = False
+        self._in_link = 0
+        self._text: List[str] = []
+        self._link_chars = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "a":
+            self._in_link += 1
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title":
+            self._in_title = False
+        elif tag == "a" and self._in_link:
+            self._in_link -= 1
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+            return
+        if self._skip_depth:
+            return
+        self._text.append(data)
+        if self._in_link:
+            self._link_chars += len(data.strip())
+
+    def _flush(self):
+        text = re.sub(r"\s+", " ", "".join(self._text)).strip()
+        if text:
+            self.blocks.append({"text": text, "link_chars": self._link_chars})
+        self._text = []
+        self._link_chars = 0
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def extract_main_text(html: str, max_chars: int = DEFAULT_MAX_CHARS) -> Dict[str, str]:
+    """
+    从HTML中提取标题和可读正文
+
+    Args:
+        html: 页面HTML
+        max_chars: 正文最多保留的字符数
+
+    Returns:
+        Dict[str, str]: 包含title和text的字典
+    """
+    parser = _MainTextParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # HTML格式异常时尽量保留已解析的部分
+        pass
+
+    paragraphs = []
+    total = 0
+    for block in parser.blocks:
+        text = block["text"]
+        # 跳过过短的段落以及以链接文字为主的段落（导航、推荐列表等）
+        if len(text) < MIN_BLOCK_CHARS or block["link_chars"] > len(text) * 0.5:
+            continue
+        if paragraphs and paragraphs[-1] == text:
+            continue
+        paragraphs.append(text)
+        total += len(text) + 1
+        if total >= max_chars:
+            break
+
+    return {
+        "title": re.sub(r"\s+", " ", parser.title).strip(),
+        "text": "\n".join(paragraphs)[:max_chars]
+    }
+
+
+def _decode_html(raw: bytes, declared_encoding: Optional[str]) -> str:
+    """根据响应头或meta标签中的编码解码HTML"""
+    encoding = declared_encoding
+    if not encoding:
+        match = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', raw[:4096], re.IGNORECASE)
+        if match:
+            encoding = match.group(1).decode("ascii", "ignore")
+    try:
+        return raw.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+class PageCache:
+    """按内容寻址的页面缓存：正文按sha256存储，URL索引指向正文哈希"""
+
+    def __init__(self, cache_dir: str, ttl: int = PAGE_CACHE_TTL, max_entries: int = PAGE_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_dir = os.path.join(cache_dir, "index")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self.index_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.blob_dir, content_hash + ".txt")
+
+    @staticmethod
+    def _atomic_write(path: str, content: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """读取URL对应的未过期页面"""
+        try:
+            with open(self._index_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry.get("fetched_at", 0) + self.ttl <= time.time():
+                return None
+            with open(self._blob_path(entry["content_hash"]), "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return {"url": url, "title": entry.get("title", ""), "text": text,
+                "content_hash": entry["content_hash"]}
+
+    def put(self, url: str, title: str, text: str) -> str:
+        """保存页面正文，相同内容只存储一份，返回内容哈希"""
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        try:
+            blob_path = self._blob_path(content_hash)
+            if os.path.exists(blob_path):
+                # 正文被再次引用时更新修改时间，清理时按最近一次引用判断是否过期
+                os.utime(blob_path)
+            else:
+                self._atomic_write(blob_path, text)
+            self._atomic_write(self._index_path(url), json.dumps({
+                "url": url,
+                "title": title,
+                "content_hash": content_hash,
+                "fetched_at": time.time()
+            }, ensure_ascii=False))
+        except OSError:
+            pass
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PAGE_CACHE_PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return content_hash
+
+    @staticmethod
+    def _list_files(directory: str, suffix: str) -> List[tuple]:
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """删除过期的URL索引和正文，URL数量仍超过上限时删除最早写入的索引"""
+        expires_before = time.time() - self.ttl
+        index_entries = []
+        for modified, path in self._list_files(self.index_dir, ".json"):
+            if modified <= expires_before:
+                self._remove(path)
+            else:
+                index_entries.append((modified, path))
+        for _, path in sorted(index_entries)[:max(0, len(index_entries) - self.max_entries)]:
+            self._remove(path)
+        # 正文在最近一次被引用后超过有效期，说明引用它的索引都已过期
+        for modified, path in self._list_files(self.blob_dir, ".txt"):
+            if modified <= expires_before:
+                self._remove(path)
+
+
+class PageFetcher:
+    """并发抓取页面正文，受全局并发、单站点并发和总时限约束"""
+
+    def __init__(self, client: httpx.AsyncClient, cache: Optional[PageCache] = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_chars: int = DEFAULT_MAX_CHARS,
+                 max_redirects: int = MAX_REDIRECTS,
+                 is_allowed_address: Callable[[IPAddress], bool] = is_public_address):
+        self.client = client
+        self.cache = cache
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.max_redirects = max_redirects
+        self.is_allowed_address = is_allowed_address
+
+    async def _check_url(self, url: str):
+        """
+        检查URL的协议，并确认域名解析到的所有地址都允许访问
+
+        Raises:
+            UnsafeURLError: 不是http(s)协议，或解析到非公网地址
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise UnsafeURLError(f"不支持的URL: {url}")
+        try:
+            addresses = await resolve_host(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+        except (OSError, ValueError) as e:
+            raise UnsafeURLError(f"无法解析域名 {parsed.hostname}: {e}")
+        if not addresses or not all(self.is_allowed_address(address) for address in addresses):
+            raise UnsafeURLError(f"不允许访问非公网地址: {parsed.hostname}")
+
+    async def _download(self, url: str) -> Optional[str]:
+        """
+        下载页面HTML，超过大小上限的部分直接丢弃；
+        重定向由这里逐跳跟随，每一跳请求前都检查目标地址
+
+        Raises:
+            UnsafeURLError: URL或重定向目标指向非公网地址，或重定向次数超过上限
+        """
+        for _ in range(self.max_redirects + 1):
+            await self._check_url(url)
+            async with self.client.stream("GET", url, headers=FETCH_HEADERS, follow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(str(response.url), response.headers["location"])
+                    continue
+                return await self._read_html(response)
+        raise UnsafeURLError(f"重定向次数超过 {self.max_redirects} 次")
+
+    async def _read_html(self, response: httpx.Response) -> Optional[str]:
+        if response.status_code != 200:
+            return None
+        content_type = response.headers.get("content-type", "")
+        if content_type and "html" not in content_type and "text" not in content_type:
+            return None
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_bytes:
+                break
+        return _decode_html(b"".join(chunks)[:self.max_bytes], response.charset_encoding)
+
+    async def fetch_one(self, url: str, global_limit: asyncio.Semaphore,
+                        host_limits: Dict[str, asyncio.Semaphore]) -> Dict[str, Any]:
+        """抓取单个页面，优先读取缓存"""
+        if self.cache:
+            cached = self.cache.get(url)
+            if cached:
+                cached["status"] = "cached"
+                return cached
+
+        host = urlparse(url).netloc.lower()
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        try:
+            async with global_limit, host_limit:
+                html = await self._download(url)
+        except (httpx.HTTPError, UnsafeURLError) as e:
+            return {"url": url, "status": "error", "message": str(e)}
+
+        if not html:
+            return {"url": url, "status": "error", "message": "页面不可用或不是HTML"}
+
+        page = extract_main_text(html, self.max_chars)
+        if not page["text"]:
+            return {"url": url, "status": "error", "message": "未提取到正文"}
+        content_hash = self.cache.put(url, page["title"], page["text"]) if self.cache else ""
+        return {"url": url, "status": "fetched", "title": page["title"], "text": page["text"],
+                "content_hash": content_hash}
+
+    async def fetch_all(self, urls: List[str], deadline: float = DEFAULT_DEADLINE) -> Dict[str, Dict[str, Any]]:
+        """
+        并发抓取多个页面，超过总时限仍未完成的页面会被取消
+
+        Args:
+            urls: 页面URL列表
+            deadline: 总时限（秒）
+
+        Returns:
+            Dict[str, Dict[str, Any]]: URL到抓取结果的映射
+        """
+        urls = [url for url in dict.fromkeys(urls) if url and url.startswith(("http://", "https://"))]
+        if not urls:
+            return {}
+
+        global_limit = asyncio.Semaphore(self.concurrency)
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+        tasks = {asyncio.ensure_future(self.fetch_one(url, global_limit, host_limits)): url for url in urls}
+
+        done, pending = await asyncio.wait(tasks.keys(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        pages = {}
+        for task, url in tasks.items():
+            if task in done and not task.cancelled() and task.exception() is None:
+                pages[url] = task.result()
+            elif task in done and not task.cancelled():
+                pages[url] = {"url": url, "status": "error", "message": str(task.exception())}
+            else:
+                pages[url] = {"url": url, "status": "timeout", "message": "超过抓取时限"}
+        return pages
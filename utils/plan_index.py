@@ -0,0 +1,220 @@
+"""
+相似计划索引模块
+用户确认（或编辑后确认）的任务计划按原始问题保存到索引中，新的规划问题与某个已确认计划的问题足够相似时，
+直接把该计划作为建议返回，不再等待模型拆解。
+相似度为归一化问题的字符n-gram集合的Jaccard系数：先用MinHash签名的LSH分桶快速找出候选，再精确计算相似度。
+索引保存在SQLite中，多个工作进程共享
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from .search_cache import normalize_query
+
+# 字符n-gram的长度（中文问题用二元组效果较好）
+NGRAM_SIZE = 2
+# MinHash签名长度，以及LSH的分段数（每段NUM_PERM // LSH_BANDS个哈希值）；
+# 16段×4行时，相似度0.8的问题几乎总能成为候选，相似度0.3的问题很少成为候选
+NUM_PERM = 64
+LSH_BANDS = 16
+# 索引最多保存的计划数量，超过后删除最久未被确认的计划
+MAX_INDEXED_PLANS = 5000
+
+# MinHash使用的通用哈希函数 h(x) = (a * x + b) mod p，参数由固定种子生成，各进程一致
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20240801)
+_HASH_PARAMS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+                for _ in range(NUM_PERM)]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_index (
+    plan_id TEXT PRIMARY KEY,
+    normalized TEXT NOT NULL UNIQUE,
+    question TEXT NOT NULL,
+    markdown TEXT NOT NULL,
+    accepted_count INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plan_index_updated ON plan_index (updated_at);
+CREATE TABLE IF NOT EXISTS plan_index_bands (
+    band TEXT NOT NULL,
+    plan_id TEXT NOT NULL,
+    PRIMARY KEY (band, plan_id)
+);
+CREATE INDEX IF NOT EXISTS idx_plan_index_bands_plan ON plan_index_bands (plan_id);
+"""
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题：在搜索关键词归一化的基础上去掉标点和空白，只比较文字内容"""
+    return re.sub(r"[\W_]+", "", normalize_query(question))
+
+
+def shingles(normalized: str) -> Set[str]:
+    """归一化问题的字符n-gram集合，不足n个字符时整体作为一个元素"""
+    if len(normalized) <= NGRAM_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + NGRAM_SIZE] for i in range(len(normalized) - NGRAM_SIZE + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(items: Set[str]) -> List[int]:
+    """集合的MinHash签名，两个签名中相同位置相等的比例是Jaccard系数的估计"""
+    values = [struct.unpack("<Q", hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest())[0]
+              for item in items]
+    return [min((a * value + b) % _MERSENNE_PRIME for value in values) for a, b in _HASH_PARAMS]
+
+
+def lsh_bands(signature: List[int]) -> List[str]:
+    """把签名分段后各段的桶标识，两个问题只要有一段完全相同就成为候选"""
+    rows = len(signature) // LSH_BANDS
+    return [
+        f"{band}:" + hashlib.sha1(json.dumps(signature[band * rows:(band + 1) * rows]).encode("utf-8")).hexdigest()[:16]
+        for band in range(LSH_BANDS)
+    ]
+
+
+class PlanIndex:
+    """已确认计划的相似问题索引，线程安全、进程间共享"""
+
+    def __init__(self, db_path: str, threshold: float, max_plans: int = MAX_INDEXED_PLANS):
+        """
+        Args:
+            db_path: 保存索引的SQLite数据库
+            threshold: 相似度（0-1）不低于该值时返回已确认的计划
+            max_plans: 最多保存的计划数量
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_plans = max_plans
+        self._lock = threading.Lock()
+        # 统计数据（当前进程）
+        self.lookups = 0
+        self.hits = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """每次操作使用独立连接，保证多线程、多进程下安全"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, question: str, markdown: str):
+        """
+        保存用户确认的计划，同一问题再次确认时用最新（可能经过编辑）的计划替换
+
+        Args:
+            question: 原始问题
+            markdown: 确认后的TODO内容
+        """
+        normalized = normalize_question(question)
+        if not normalized or not (markdown or "").strip():
+            return
+        items = shingles(normalized)
+        now = time.time()
+        plan_id = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE plan_index SET question = ?, markdown = ?, accepted_count = accepted_count + 1, "
+                    "updated_at = ? WHERE plan_id = ?",
+                    (question, markdown.strip(), now, plan_id)
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        "INSERT INTO plan_index (plan_id, normalized, question, markdown, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (plan_id, normalized, question, markdown.strip(), now, now)
+                    )
+                    conn.executemany("INSERT OR IGNORE INTO plan_index_bands (band, plan_id) VALUES (?, ?)",
+                                     [(band, plan_id) for band in lsh_bands(minhash(items))])
+                    self._prune(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _prune(self, conn: sqlite3.Connection):
+        """计划数量超过上限时删除最久未被确认的计划"""
+        count = conn.execute("SELECT COUNT(*) FROM plan_index").fetchone()[0]
+        if count <= self.max_plans:
+            return
+        stale = [row["plan_id"] for row in conn.execute(
+            "SELECT plan_id FROM plan_index ORDER BY updated_at LIMIT ?", (count - self.max_plans,))]
+        conn.executemany("DELETE FROM plan_index WHERE plan_id = ?", [(plan_id,) for plan_id in stale])
+        conn.executemany("DELETE FROM plan_index_bands WHERE plan_id = ?", [(plan_id,) for plan_id in stale])
+
+    def find(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        查找与问题最相似的已确认计划
+
+        Args:
+            question: 用户的问题
+
+        Returns:
+            Optional[Dict[str, Any]]: 相似度不低于阈值时返回计划（question、markdown、similarity、accepted_count），
+                否则返回None
+        """
+        normalized = normalize_question(question)
+        items = shingles(normalized)
+        best = None
+        if items:
+            bands = lsh_bands(minhash(items))
+            with self._connect() as conn:
+                rows = conn.execute(
+                    f"SELECT * FROM plan_index WHERE plan_id IN (SELECT plan_id FROM plan_index_bands "
+                    f"WHERE band IN ({','.join('?' * len(bands))}))",
+                    bands
+                ).fetchall()
+            # LSH只负责筛选候选，最终按精确的Jaccard系数判断，相同时优先被确认次数多的计划
+            for row in rows:
+                similarity = 1.0 if row["normalized"] == normalized else jaccard(items, shingles(row["normalized"]))
+                if similarity >= self.threshold and (
+                        best is None or (similarity, row["accepted_count"]) > (best["similarity"], best["accepted_count"])):
+                    best = {
+                        "question": row["question"],
+                        "markdown": row["markdown"],
+                        "similarity": round(similarity, 3),
+                        "accepted_count": row["accepted_count"]
+                    }
+        with self._lock:
+            self.lookups += 1
+            self.hits += best is not None
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        """索引的计划数量和当前进程的命中率"""
+        with self._connect() as conn:
+            plans = conn.execute("SELECT COUNT(*) FROM plan_index").fetchone()[0]
+        with self._lock:
+            return {
+                "plans": plans,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0
+            }
@@ -0,0 +1,369 @@
+"""
+任务规划执行队列模块
+基于SQLite的持久化队列：Web服务写入执行任务，后台工作进程领取执行，
+每个子任务完成后保存检查点，进程崩溃后由其他工作进程接手并从检查点继续
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .task_events import EVENT_SUMMARY_DELTA
+from .timestamp_utils import get_current_timestamp
+
+# 任务状态
+PLAN_JOB_QUEUED = "queued"
+PLAN_JOB_RUNNING = "running"
+PLAN_JOB_SUCCESS = "success"
+PLAN_JOB_ERROR = "error"
+PLAN_JOB_FINISHED_STATUSES = (PLAN_JOB_SUCCESS, PLAN_JOB_ERROR)
+
+# 工作进程超过该时间（秒）未发送心跳，视为已崩溃，任务可被其他进程接手
+PLAN_JOB_LEASE_SECONDS = 60
+# 单个任务最多执行次数（包括崩溃后的重试）
+PLAN_JOB_MAX_ATTEMPTS = 3
+# 任务结束后等待后台汇总完成（summary_ready事件）的最长时间（秒）
+PLAN_JOB_SUMMARY_WAIT_SECONDS = 300
+# 已结束任务的保留时间（秒），超过后删除任务及其检查点和进度事件
+PLAN_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_jobs (
+    job_id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    original_question TEXT NOT NULL,
+    tasks TEXT NOT NULL,
+    modified_todo_content TEXT,
+    force_refresh INTEGER NOT NULL DEFAULT 0,
+    deadline_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    heartbeat_at REAL,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plan_jobs_status ON plan_jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS plan_job_tasks (
+    job_id TEXT NOT NULL,
+    task_number INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (job_id, task_number)
+);
+CREATE TABLE IF NOT EXISTS plan_job_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plan_job_events_job ON plan_job_events (job_id, event_id);
+"""
+
+
+class PlanJobQueue:
+    """任务规划执行队列，所有状态保存在SQLite中，可被多个进程同时访问"""
+
+    def __init__(self, db_path: str, lease_seconds: int = PLAN_JOB_LEASE_SECONDS,
+                 max_attempts: int = PLAN_JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # 兼容旧版本创建的数据库
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(plan_jobs)")}
+            if "force_refresh" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN force_refresh INTEGER NOT NULL DEFAULT 0")
+            if "deadline_at" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN deadline_at REAL")
+            if "cancel_requested" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            if "finished_at" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN finished_at REAL")
+                # 旧数据库中已结束的任务从现在开始计算保留时间
+                conn.execute("UPDATE plan_jobs SET finished_at = ? WHERE status IN (?, ?)",
+                             (time.time(), *PLAN_JOB_FINISHED_STATUSES))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_plan_jobs_finished ON plan_jobs (finished_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """每次操作使用独立连接，保证多线程、多进程下安全"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["tasks"] = json.loads(job["tasks"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["force_refresh"] = bool(job["force_refresh"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def enqueue(self, conversation_id: str, tasks: List[str], original_question: str,
+                modified_todo_content: Optional[str] = None, force_refresh: bool = False,
+                deadline_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        提交新的执行任务
+
+        Args:
+            conversation_id: 对话ID
+            tasks: 用户确认的任务列表
+            original_question: 原始问题
+            modified_todo_content: 用户修改后的TODO内容
+            force_refresh: 是否忽略之前的执行结果，全部重新执行
+            deadline_at: 请求的截止时间（时间戳），None表示不限制
+
+        Returns:
+            Dict[str, Any]: 任务信息
+        """
+        now = get_current_timestamp()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO plan_jobs (job_id, conversation_id, original_question, tasks, modified_todo_content, "
+                "force_refresh, deadline_at, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, conversation_id, original_question, json.dumps(tasks, ensure_ascii=False),
+                 modified_todo_content, int(force_refresh), deadline_at, PLAN_JOB_QUEUED, now, now)
+            )
+        return self.get(job_id)
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        领取一个待执行的任务：排队中的任务，或工作进程心跳已超时的任务
+
+        Args:
+            worker_id: 工作进程标识
+
+        Returns:
+            Optional[Dict[str, Any]]: 领取到的任务，没有可执行的任务时返回None
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # 立即加写锁，保证同一任务只会被一个进程领取
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 多次崩溃的任务不再重试
+                conn.execute(
+                    "UPDATE plan_jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+                    "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                    (PLAN_JOB_ERROR, "工作进程多次异常退出，任务已终止", now, get_current_timestamp(),
+                     PLAN_JOB_RUNNING, now - self.lease_seconds, self.max_attempts)
+                )
+                # 优先领取正在执行的任务最少的对话，避免单个对话的多个任务占满工作进程
+                row = conn.execute(
+                    "SELECT job_id FROM plan_jobs AS candidate "
+                    "WHERE status = ? OR (status = ? AND heartbeat_at < ?) "
+                    "ORDER BY (SELECT COUNT(*) FROM plan_jobs AS active WHERE active.conversation_id = "
+                    "candidate.conversation_id AND active.status = ? AND active.heartbeat_at >= ?), created_at LIMIT 1",
+                    (PLAN_JOB_QUEUED, PLAN_JOB_RUNNING, now - self.lease_seconds,
+                     PLAN_JOB_RUNNING, now - self.lease_seconds)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE plan_jobs SET status = ?, worker_id = ?, heartbeat_at = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (PLAN_JOB_RUNNING, worker_id, now, get_current_timestamp(), row["job_id"])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["job_id"])
+
+    def count_active(self, conversation_id: Optional[str] = None) -> int:
+        """排队中和执行中的任务数量，指定conversation_id时只统计该对话"""
+        query = "SELECT COUNT(*) AS count FROM plan_jobs WHERE status IN (?, ?)"
+        params: List[Any] = [PLAN_JOB_QUEUED, PLAN_JOB_RUNNING]
+        if conversation_id is not None:
+            query += " AND conversation_id = ?"
+            params.append(conversation_id)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()["count"]
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """刷新任务心跳，任务已被其他进程接手时返回False"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE plan_jobs SET heartbeat_at = ? WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (time.time(), job_id, worker_id, PLAN_JOB_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def request_cancel(self, job_id: str) -> bool:
+        """请求取消任务（执行中的任务由工作进程停止，排队中的任务开始执行后立即结束），任务已结束时返回False"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE plan_jobs SET cancel_requested = 1, updated_at = ? WHERE job_id = ? AND status IN (?, ?)",
+                (get_current_timestamp(), job_id, PLAN_JOB_QUEUED, PLAN_JOB_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM plan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def save_task_result(self, job_id: str, task_number: int, result: Dict[str, Any]):
+        """保存单个子任务的执行结果（检查点）"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plan_job_tasks (job_id, task_number, result, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, task_number, json.dumps(result, ensure_ascii=False), get_current_timestamp())
+            )
+
+    def get_task_results(self, job_id: str) -> Dict[int, Dict[str, Any]]:
+        """读取任务已保存的子任务结果，按任务序号索引"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT task_number, result FROM plan_job_tasks WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {row["task_number"]: json.loads(row["result"]) for row in rows}
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None):
+        """记录任务最终状态"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE plan_jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), get_current_timestamp(), job_id)
+            )
+
+    def purge_finished(self, retention_seconds: float = PLAN_JOB_RETENTION_SECONDS,
+                       compact_after_seconds: float = PLAN_JOB_SUMMARY_WAIT_SECONDS) -> Dict[str, int]:
+        """
+        清理已结束的任务，避免队列数据库无限增长
+
+        Args:
+            retention_seconds: 结束超过该时间（秒）的任务连同检查点和进度事件一起删除
+            compact_after_seconds: 结束超过该时间（秒）的任务删除逐段的汇总事件（summary_delta），
+                完整的汇总内容已保存在任务结果和done/summary_ready事件中
+
+        Returns:
+            Dict[str, int]: 删除的任务数量和进度事件数量
+        """
+        now = time.time()
+        finished_before = "SELECT job_id FROM plan_jobs WHERE finished_at < ?"
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                events = conn.execute(
+                    f"DELETE FROM plan_job_events WHERE job_id IN ({finished_before})", (now - retention_seconds,)
+                ).rowcount
+                conn.execute(f"DELETE FROM plan_job_tasks WHERE job_id IN ({finished_before})",
+                             (now - retention_seconds,))
+                jobs = conn.execute("DELETE FROM plan_jobs WHERE finished_at < ?", (now - retention_seconds,)).rowcount
+                events += conn.execute(
+                    f"DELETE FROM plan_job_events WHERE event = ? AND job_id IN ({finished_before})",
+                    (EVENT_SUMMARY_DELTA, now - compact_after_seconds)
+                ).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return {"jobs": jobs, "events": events}
+
+    def update_result(self, job_id: str, changes: Dict[str, Any]) -> bool:
+        """合并更新已结束任务的结果（如后台完成的汇总内容），任务没有结果时返回False"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT result FROM plan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None or not row["result"]:
+                    conn.execute("COMMIT")
+                    return False
+                result = {**json.loads(row["result"]), **changes}
+                conn.execute(
+                    "UPDATE plan_jobs SET result = ?, updated_at = ? WHERE job_id = ?",
+                    (json.dumps(result, ensure_ascii=False), get_current_timestamp(), job_id)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务信息，不存在时返回None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM plan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def add_event(self, job_id: str, event: str, data: Dict[str, Any]):
+        """追加一条执行进度事件"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO plan_job_events (job_id, event, data) VALUES (?, ?, ?)",
+                (job_id, event, json.dumps(data, ensure_ascii=False))
+            )
+
+    def get_events(self, job_id: str, after_id: int = 0, limit: int = 200) -> List[Dict[str, Any]]:
+        """读取event_id大于after_id的进度事件"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT event_id, event, data FROM plan_job_events WHERE job_id = ? AND event_id > ? "
+                "ORDER BY event_id LIMIT ?",
+                (job_id, after_id, limit)
+            ).fetchall()
+        return [{"event_id": row["event_id"], "event": row["event"], "data": json.loads(row["data"])}
+                for row in rows]
+
+
+class PlanJobEventCursor:
+    """按顺序读取任务的进度事件，记录读取位置，供同步或异步的SSE推送共用"""
+
+    def __init__(self, queue: PlanJobQueue, job_id: str, after_id: int = 0,
+                 summary_wait_seconds: float = PLAN_JOB_SUMMARY_WAIT_SECONDS):
+        self.queue = queue
+        self.job_id = job_id
+        self.last_id = after_id
+        self.summary_wait_seconds = summary_wait_seconds
+        self._finished_at: Optional[float] = None
+
+    def poll(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        读取新事件（不阻塞）
+
+        Returns:
+            Tuple[List[Dict[str, Any]], bool]: 新事件，以及事件是否已全部读完（任务已结束）
+        """
+        events = self.queue.get_events(self.job_id, self.last_id)
+        if events:
+            self.last_id = events[-1]["event_id"]
+            return events, False
+
+        job = self.queue.get(self.job_id)
+        if job is None:
+            return [], True
+        if job["status"] not in PLAN_JOB_FINISHED_STATUSES:
+            return [], False
+        # 汇总超时先返回了备用格式时，继续等待后台汇总完成
+        if (job["result"] or {}).get("summary_pending"):
+            self._finished_at = self._finished_at or time.monotonic()
+            if time.monotonic() - self._finished_at < self.summary_wait_seconds:
+                return [], False
+        # 任务结束后再读一次，避免遗漏最后写入的事件
+        events = self.queue.get_events(self.job_id, self.last_id)
+        if events:
+            self.last_id = events[-1]["event_id"]
+        return events, not events
@@ -0,0 +1,111 @@
+"""
+任务规划记忆模块
+按对话保存每个子任务的分类、依赖关系和执行结果，用户修改计划后重新提交时，
+未改变的任务直接复用结果，只执行修改过或新增的任务
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from .search_cache import normalize_query
+
+# 每个对话最多保留的任务结果数量，超过后删除最早的结果
+MAX_REMEMBERED_RESULTS = 50
+MAX_REMEMBERED_PLANS = 10
+MAX_REMEMBERED_CLASSIFICATIONS = 200
+
+
+def normalize_todo(todo: str) -> str:
+    """归一化任务文本：去掉编号和列表标记，统一全半角、大小写和空白"""
+    todo = re.sub(r"^\s*(?:\d+[.、)）]|[-*])\s*", "", todo or "")
+    return normalize_query(todo)
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+
+def _remember(mapping: Dict[str, Any], key: str, value: Any, limit: int):
+    """写入并移到末尾，超过数量上限时删除最早写入的条目"""
+    mapping.pop(key, None)
+    mapping[key] = value
+    while len(mapping) > limit:
+        mapping.pop(next(iter(mapping)))
+
+
+def todo_key(original_question: str, todo: str) -> str:
+    """任务文本的键，用于复用任务分类"""
+    return _digest(normalize_query(original_question), normalize_todo(todo))
+
+
+def plan_key(original_question: str, todo_items: List[str]) -> str:
+    """整个计划的键，用于复用任务依赖关系"""
+    return _digest(normalize_query(original_question), [normalize_todo(todo) for todo in todo_items])
+
+
+def compute_fingerprints(original_question: str, todo_items: List[str], agent_types: List[str],
+                         dependencies: List[List[int]]) -> List[str]:
+    """
+    计算每个任务的指纹：原始问题、归一化的任务文本、Agent类型以及上游任务的指纹，
+    上游任务改变时下游任务的指纹也随之改变
+
+    Args:
+        original_question: 原始问题
+        todo_items: 任务列表
+        agent_types: 与任务一一对应的Agent类型
+        dependencies: 每个任务依赖的前置任务序号（从0开始，只能指向更早的任务）
+
+    Returns:
+        List[str]: 与任务一一对应的指纹
+    """
+    question = normalize_query(original_question)
+    fingerprints: List[str] = []
+    for i, (todo, agent_type) in enumerate(zip(todo_items, agent_types)):
+        upstream = sorted(fingerprints[d] for d in dependencies[i] if d < i)
+        fingerprints.append(_digest(question, normalize_todo(todo), agent_type, upstream))
+    return fingerprints
+
+
+class PlanMemory:
+    """单个对话的任务规划记忆，数据以字典形式随对话一起保存"""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.classifications: Dict[str, str] = dict(data.get("classifications", {}))
+        self.dependencies: Dict[str, List[List[int]]] = dict(data.get("dependencies", {}))
+        self.results: Dict[str, Dict[str, Any]] = dict(data.get("results", {}))
+
+    def get_agent_type(self, original_question: str, todo: str) -> Optional[str]:
+        return self.classifications.get(todo_key(original_question, todo))
+
+    def set_agent_type(self, original_question: str, todo: str, agent_type: str):
+        _remember(self.classifications, todo_key(original_question, todo), agent_type,
+                  MAX_REMEMBERED_CLASSIFICATIONS)
+
+    def get_dependencies(self, original_question: str, todo_items: List[str]) -> Optional[List[List[int]]]:
+        dependencies = self.dependencies.get(plan_key(original_question, todo_items))
+        if dependencies is not None and len(dependencies) == len(todo_items):
+            return dependencies
+        return None
+
+    def set_dependencies(self, original_question: str, todo_items: List[str], dependencies: List[List[int]]):
+        _remember(self.dependencies, plan_key(original_question, todo_items), dependencies,
+                  MAX_REMEMBERED_PLANS)
+
+    def get_result(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        return self.results.get(fingerprint)
+
+    def set_result(self, fingerprint: str, result: Dict[str, Any]):
+        """只记住执行成功的结果"""
+        if result.get("status") != "success":
+            self.results.pop(fingerprint, None)
+            return
+        _remember(self.results, fingerprint, result, MAX_REMEMBERED_RESULTS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "classifications": self.classifications,
+            "dependencies": self.dependencies,
+            "results": self.results
+        }
@@ -0,0 +1,125 @@
+"""
+提示词编码模块
+将任务执行结果渲染为紧凑的结构化文本，只保留报告需要的字段，并按每个任务的token预算截断
+"""
+from typing import Any, Dict, List, Tuple
+
+from .deadline import TASK_CANCELLED, TASK_TIMEOUT
+from .token_utils import estimate_tokens, truncate_to_tokens
+
+DEFAULT_TASK_TOKENS = 2000
+# 任务结果正文至少保留的token数，其余预算留给工具结果
+MIN_CONTENT_TOKENS = 200
+# 单条搜索结果最多占用的token数
+MAX_SEARCH_ITEM_TOKENS = 300
+
+
+def _format_weather(data: Dict[str, Any]) -> str:
+    parts = [data.get("location", ""), data.get("weather", "")]
+    if data.get("temperature"):
+        parts.append(f"{data['temperature']}℃")
+    parts.append(data.get("wind", ""))
+    if data.get("humidity"):
+        parts.append(f"湿度{data['humidity']}")
+    text = " ".join(part for part in parts if part)
+    if data.get("report_time"):
+        text += f"（发布于{data['report_time']}）"
+    return f"天气: {text}"
+
+
+def _format_time(data: Dict[str, Any]) -> str:
+    parts = [data.get("date", ""), data.get("time", ""), data.get("weekday", "")]
+    return "时间: " + " ".join(part for part in parts if part)
+
+
+def _format_data(tool_name: str, data: Dict[str, Any]) -> str:
+    if tool_name == "get_weather":
+        return _format_weather(data)
+    if tool_name == "get_current_time":
+        return _format_time(data)
+    fields = "; ".join(f"{key}={value}" for key, value in data.items() if key != "status" and value not in ("", None))
+    return f"{tool_name}: {fields}"
+
+
+def _format_search_item(index: int, item: Dict[str, Any]) -> str:
+    """单条搜索结果：标题、来源和正文（优先使用网页正文，其次摘要）"""
+    source = " ".join(part for part in (item.get("site_name") or "", item.get("date_published") or "") if part)
+    header = f"{index}. {item.get('title', '')}" + (f"（{source}）" if source else "")
+    body = item.get("page_content") or item.get("summary") or item.get("snippet") or ""
+    return truncate_to_tokens(f"{header} {body}".strip(), MAX_SEARCH_ITEM_TOKENS)
+
+
+def _tool_lines(tool_results: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """将工具结果渲染为文本行，返回（必须保留的图片行，可截断的其他行）"""
+    image_lines, other_lines = [], []
+    for tool_result in tool_results:
+        result_type = tool_result.get("type")
+        if result_type == "image":
+            if tool_result.get("path"):
+                image_lines.append(f"图片: ![{tool_result.get('description', '')}]({tool_result['path']})")
+        elif result_type == "data":
+            other_lines.append(_format_data(tool_result.get("tool_name", ""), tool_result.get("data", {})))
+        elif result_type == "web_search":
+            data = tool_result.get("data", {})
+            other_lines.append(f"搜索「{data.get('query', '')}」:")
+            other_lines.extend(_format_search_item(i, item) for i, item in enumerate(data.get("results", []), 1))
+        elif result_type == "text" and tool_result.get("content"):
+            other_lines.append(f"{tool_result.get('tool_name', '工具')}输出: {tool_result['content']}")
+    return image_lines, other_lines
+
+
+def encode_task(task: Dict[str, Any], max_tokens: int = DEFAULT_TASK_TOKENS) -> str:
+    """
+    将单个任务的整理结果编码为紧凑文本
+
+    Args:
+        task: TaskSummarizer.format_results_for_display返回的单个任务数据
+        max_tokens: 该任务的token预算，图片行总会保留
+
+    Returns:
+        str: 编码后的文本
+    """
+    lines = [f"【任务{task.get('task_number', '')}】{task.get('todo', '')}"]
+    if task.get("status") == "error":
+        lines.append(f"状态: 失败（{task.get('error_message') or '未知错误'}）")
+        return truncate_to_tokens("\n".join(lines), max_tokens)
+    if task.get("status") in (TASK_TIMEOUT, TASK_CANCELLED):
+        lines.append(f"状态: 未完成（{task.get('error_message')}）")
+        return truncate_to_tokens("\n".join(lines), max_tokens)
+
+    image_lines, other_lines = _tool_lines(task.get("tool_results", []))
+    remaining = max_tokens - sum(estimate_tokens(line) + 1 for line in lines + image_lines)
+
+    content = (task.get("ai_content") or "").strip()
+    if content:
+        # 正文和工具结果分摊剩余预算，工具结果用不完的部分留给正文
+        other_tokens = sum(estimate_tokens(line) + 1 for line in other_lines)
+        content_budget = max(remaining - other_tokens, min(remaining, MIN_CONTENT_TOKENS), remaining // 2)
+        content_line = truncate_to_tokens(f"结果: {content}", content_budget)
+        lines.append(content_line)
+        remaining -= estimate_tokens(content_line) + 1
+
+    for line in other_lines:
+        if remaining <= 0:
+            break
+        line = truncate_to_tokens(line, remaining)
+        lines.append(line)
+        remaining -= estimate_tokens(line) + 1
+
+    lines.extend(image_lines)
+    return "\n".join(line for line in lines if line)
+
+
+def encode_tasks(tasks: List[Dict[str, Any]], max_tokens_per_task: int = DEFAULT_TASK_TOKENS) -> Tuple[List[str], int]:
+    """
+    编码多个任务
+
+    Args:
+        tasks: 任务数据列表
+        max_tokens_per_task: 每个任务的token预算
+
+    Returns:
+        Tuple[List[str], int]: 每个任务编码后的文本，以及估算的总token数
+    """
+    blocks = [encode_task(task, max_tokens_per_task) for task in tasks]
+    return blocks, sum(estimate_tokens(block) for block in blocks)
@@ -0,0 +1,176 @@
+"""
+任务结果存储模块
+按键保存任务执行结果：内存中按字节大小做LRU淘汰，条目带过期时间，
+被淘汰的条目可写入磁盘，读取时再加载回内存
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 内存中最多保存的结果大小
+DEFAULT_TTL = 60 * 60                  # 结果有效期（秒）
+# 两次清理磁盘过期文件之间的最小间隔（秒）
+SWEEP_INTERVAL = 10 * 60
+
+
+class ResultStore:
+    """容量和有效期受限的结果存储，线程安全"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: int = DEFAULT_TTL,
+                 spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir or None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def new_key(prefix: str = "task") -> str:
+        """生成唯一的键：时间戳便于排查，随机后缀保证同一秒内也不会冲突"""
+        return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}"
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def put(self, value: Dict[str, Any], key: Optional[str] = None) -> str:
+        """
+        保存结果
+
+        Args:
+            value: 可JSON序列化的结果
+            key: 指定的键，不指定时自动生成
+
+        Returns:
+            str: 结果对应的键
+        """
+        key = key or self.new_key()
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {"value": value, "size": size,
+                                  "expires_at": time.time() + self.ttl}
+            self._total_bytes += self._entries[key]["size"]
+            self._purge_expired()
+            self._evict()
+        self._sweep_spilled()
+        return key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取结果，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires_at"] <= time.time():
+                    self._remove(key)
+                    return None
+                self._entries.move_to_end(key)
+                return entry["value"]
+        return self._load_spilled(key)
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取并删除结果"""
+        value = self.get(key)
+        with self._lock:
+            self._remove(key)
+        spill_path = self._spill_path(key)
+        if spill_path and os.path.exists(spill_path):
+            try:
+                os.remove(spill_path)
+            except OSError:
+                pass
+        return value
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry["size"]
+
+    def _purge_expired(self):
+        """删除内存中已过期的条目"""
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry["expires_at"] <= now]:
+            self._remove(key)
+
+    def _evict(self):
+        """超过容量时按最近最少使用淘汰，可写入磁盘的条目先落盘"""
+        now = time.time()
+        while self._entries and self._total_bytes > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry["size"]
+            if entry["expires_at"] > now:
+                self._spill(key, entry)
+
+    def _spill_path(self, key: str) -> Optional[str]:
+        if not self.spill_dir or not key.replace("_", "").isalnum():
+            return None
+        return os.path.join(self.spill_dir, f"{key}.json")
+
+    def _spill(self, key: str, entry: Dict[str, Any]):
+        path = self._spill_path(key)
+        if not path:
+            return
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry["value"], f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            # 用文件修改时间记录过期时间
+            os.utime(path, (entry["expires_at"], entry["expires_at"]))
+        except OSError:
+            pass
+
+    def _load_spilled(self, key: str) -> Optional[Dict[str, Any]]:
+        """从磁盘读取被淘汰的结果并重新放入内存"""
+        path = self._spill_path(key)
+        if not path:
+            return None
+        try:
+            expires_at = os.path.getmtime(path)
+            if expires_at <= time.time():
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError):
+            return None
+
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._entries[key] = {"value": value, "size": size, "expires_at": expires_at}
+            self._total_bytes += self._entries[key]["size"]
+            self._evict()
+        return value
+
+    def _sweep_spilled(self):
+        """定期删除磁盘上已过期的结果"""
+        now = time.time()
+        if not self.spill_dir or now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                try:
+                    if name.endswith(".json") and os.path.getmtime(path) <= now:
+                        os.remove(path)
+                except OSError:
+                    continue
+        except OSError:
+            pass
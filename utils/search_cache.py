@@ -0,0 +1,254 @@
+"""
+搜索结果缓存模块
+为网页搜索提供按时效性区分TTL的内存+磁盘两级缓存，并合并相同的并发查询
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# 不同时效性对应的缓存有效期（秒），时效性要求越高缓存越短
+FRESHNESS_TTLS = {
+    "pastDay": 10 * 60,
+    "pastWeek": 60 * 60,
+    "pastMonth": 6 * 60 * 60,
+    "pastYear": 24 * 60 * 60,
+    "noLimit": 24 * 60 * 60,
+}
+DEFAULT_TTL = 60 * 60
+
+# 等待其他进程完成同一查询的最长时间，超过后自行请求
+LOCK_WAIT_TIMEOUT = 35.0
+LOCK_POLL_INTERVAL = 0.2
+
+# 磁盘缓存最多保存的查询数，以及每写入多少次清理一次
+DEFAULT_MAX_DISK_ITEMS = 10000
+DISK_PRUNE_EVERY = 100
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化搜索关键词：全半角统一、大小写统一、合并空白
+
+    Args:
+        query: 原始搜索关键词
+
+    Returns:
+        str: 归一化后的关键词
+    """
+    query = unicodedata.normalize("NFKC", query or "")
+    query = re.sub(r"\s+", " ", query).strip().lower()
+    return query
+
+
+def get_ttl(freshness: str) -> int:
+    """获取指定时效性的缓存有效期（秒）"""
+    return FRESHNESS_TTLS.get(freshness, DEFAULT_TTL)
+
+
+class SearchCache:
+    """搜索结果缓存，键为(归一化关键词, 时效性)"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_items: int = 256,
+                 max_disk_items: int = DEFAULT_MAX_DISK_ITEMS):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self._writes = 0
+        self._memory: Dict[str, Tuple[float, Any]] = {}  # key -> (过期时间, 数据)
+        self._inflight: Dict[str, asyncio.Future] = {}  # 正在进行中的查询
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(query: str, freshness: str) -> str:
+        """生成缓存键"""
+        raw = f"{normalize_query(query)}\x00{freshness}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.lock")
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的缓存，依次查询内存和磁盘"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry:
+            expires_at, value = entry
+            if expires_at > now:
+                return value
+            del self._memory[key]
+
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("expires_at", 0) <= now:
+            return None
+        self._remember(key, data["expires_at"], data["value"])
+        return data["value"]
+
+    def set(self, key: str, value: Any, ttl: int):
+        """写入缓存，磁盘写入使用临时文件+重命名保证原子性"""
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, value)
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._disk_path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            # 文件的修改时间设为过期时间，清理时不需要读取文件内容
+            os.utime(tmp_path, (expires_at, expires_at))
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        self._writes += 1
+        if self._writes % DISK_PRUNE_EVERY == 0:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """删除磁盘中过期的缓存和遗留的锁、临时文件，数量仍超过上限时删除最早过期的缓存"""
+        if not self.cache_dir:
+            return
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue
+            if name.endswith(".json"):
+                if modified <= now:
+                    self._remove(path)
+                else:
+                    entries.append((modified, path))
+            elif name.endswith((".lock", ".tmp")) and now - modified > LOCK_WAIT_TIMEOUT:
+                self._remove(path)
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_disk_items)]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._memory[key] = (expires_at, value)
+        if len(self._memory) > self.max_memory_items:
+            # 淘汰最早过期的条目
+            oldest_key = min(self._memory, key=lambda k: self._memory[k][0])
+            del self._memory[oldest_key]
+
+    def _try_acquire_lock(self, key: str) -> bool:
+        """尝试获取跨进程查询锁，失败说明其他进程正在执行同一查询"""
+        if not self.cache_dir:
+            return True
+        lock_path = self._lock_path(key)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            return True
+        except FileExistsError:
+            # 清理异常退出遗留的过期锁
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_WAIT_TIMEOUT:
+                    os.remove(lock_path)
+                    return self._try_acquire_lock(key)
+            except OSError:
+                pass
+            return False
+
+    def _release_lock(self, key: str):
+        if not self.cache_dir:
+            return
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
+
+    async def _wait_for_other_process(self, key: str) -> Optional[Any]:
+        """等待其他进程完成同一查询并读取其写入的缓存"""
+        deadline = time.time() + LOCK_WAIT_TIMEOUT
+        while time.time() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            value = self.get(key)
+            if value is not None:
+                return value
+            if not os.path.exists(self._lock_path(key)):
+                # 对方已结束但没有写入缓存（例如请求失败）
+                return None
+        return None
+
+    async def get_or_fetch(self, query: str, freshness: str,
+                           fetcher: Callable[[], Awaitable[Optional[Any]]]) -> Tuple[Optional[Any], str]:
+        """
+        读取缓存，未命中时执行查询；相同的并发查询只会真正请求一次
+
+        Args:
+            query: 搜索关键词
+            freshness: 时效性
+            fetcher: 实际执行查询的协程函数，返回None表示结果不可缓存
+
+        Returns:
+            Tuple[Optional[Any], str]: (结果, 来源)，来源为 cache / coalesced / network
+        """
+        key = self.make_key(query, freshness)
+        value = self.get(key)
+        if value is not None:
+            return value, "cache"
+
+        # 同一进程内的并发查询直接等待进行中的结果
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight), "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            acquired = self._try_acquire_lock(key)
+            if not acquired:
+                value = await self._wait_for_other_process(key)
+                if value is not None:
+                    future.set_result(value)
+                    return value, "coalesced"
+                # 对方失败或超时：再尝试获取锁，仍失败时不持有锁直接查询
+                acquired = self._try_acquire_lock(key)
+            try:
+                value = await fetcher()
+                if value is not None:
+                    self.set(key, value, get_ttl(freshness))
+            finally:
+                # 只释放自己持有的锁，不能删除其他进程的锁
+                if acquired:
+                    self._release_lock(key)
+            future.set_result(value)
+            return value, "network"
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # 避免无人等待时出现 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,212 @@
+"""
+搜索结果后处理模块
+基于BM25的相关性重排、基于MinHash的近重复去除，以及按字符/token预算裁剪搜索结果
+"""
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from .token_utils import estimate_tokens
+
+# BM25参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 近重复检测参数
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+DUPLICATE_THRESHOLD = 0.8
+
+# 参与打分和截断的文本字段
+TEXT_FIELDS = ("snippet", "summary", "page_content")
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切分文本：英文数字按单词切分，中文按单字和相邻双字切分
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        List[str]: 词项列表
+    """
+    terms = []
+    for word in _WORD_PATTERN.findall((text or "").lower()):
+        if word[0].isascii():
+            terms.append(word)
+        else:
+            terms.extend(word)
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def bm25_scores(query: str, documents: List[str]) -> List[float]:
+    """
+    计算每个文档相对查询的BM25得分
+
+    Args:
+        query: 查询文本
+        documents: 文档文本列表
+
+    Returns:
+        List[float]: 与documents一一对应的得分
+    """
+    query_terms = set(tokenize(query))
+    doc_terms = [Counter(tokenize(doc)) for doc in documents]
+    if not query_terms or not doc_terms:
+        return [0.0] * len(documents)
+
+    doc_count = len(doc_terms)
+    avg_length = sum(sum(terms.values()) for terms in doc_terms) / doc_count or 1.0
+    doc_freq = {term: sum(1 for terms in doc_terms if term in terms) for term in query_terms}
+
+    scores = []
+    for terms in doc_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            tf = terms.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (doc_count - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+        scores.append(score)
+    return scores
+
+
+def _shingles(text: str) -> set:
+    text = re.sub(r"\s+", "", (text or "").lower())
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+# 固定种子的哈希参数，保证不同进程之间签名一致
+_HASH_PARAMS = [((i * 0x9E3779B1 + 1) % _MERSENNE_PRIME, (i * 0x85EBCA77 + 7) % _MERSENNE_PRIME)
+                for i in range(1, MINHASH_PERMUTATIONS + 1)]
+
+
+def minhash_signature(text: str) -> Optional[List[int]]:
+    """
+    计算文本字符shingle集合的MinHash签名
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        Optional[List[int]]: 签名，文本为空时返回None
+    """
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in _shingles(text)]
+    if not hashes:
+        return None
+    return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _HASH_PARAMS]
+
+
+def estimate_similarity(signature_a: List[int], signature_b: List[int]) -> float:
+    """根据MinHash签名估算Jaccard相似度"""
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a)
+
+
+def _result_text(result: Dict[str, Any]) -> str:
+    return " ".join(str(result.get(field) or "") for field in ("title",) + TEXT_FIELDS)
+
+
+def rerank_results(query: str, results: List[Dict[str, Any]],
+                   duplicate_threshold: float = DUPLICATE_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    按BM25得分重排搜索结果，并去除摘要近似重复的结果（保留得分更高的一条）
+
+    Args:
+        query: 搜索查询
+        results: 搜索结果列表
+        duplicate_threshold: 判定为近重复的相似度阈值
+
+    Returns:
+        List[Dict[str, Any]]: 重排去重后的结果列表
+    """
+    if not results:
+        return []
+
+    scores = bm25_scores(query, [_result_text(result) for result in results])
+    # 得分相同时保持搜索引擎原有顺序
+    order = sorted(range(len(results)), key=lambda i: (-scores[i], i))
+
+    kept = []
+    kept_signatures = []
+    seen_urls = set()
+    for i in order:
+        result = results[i]
+        url = result.get("url")
+        if url and url in seen_urls:
+            continue
+        signature = minhash_signature(result.get("snippet") or result.get("summary") or "")
+        if signature and any(estimate_similarity(signature, other) >= duplicate_threshold
+                             for other in kept_signatures):
+            continue
+        if url:
+            seen_urls.add(url)
+        if signature:
+            kept_signatures.append(signature)
+        kept.append(result)
+    return kept
+
+
+def apply_budget(results: List[Dict[str, Any]], max_chars: int) -> List[Dict[str, Any]]:
+    """
+    按字符预算裁剪搜索结果：依次保留结果并截断其文本字段，预算用尽后丢弃剩余结果
+
+    Args:
+        results: 已按相关性排序的搜索结果
+        max_chars: 文本字段的总字符预算
+
+    Returns:
+        List[Dict[str, Any]]: 裁剪后的结果列表（不修改原始数据）
+    """
+    budgeted = []
+    remaining = max_chars
+    for result in results:
+        if remaining <= 0:
+            break
+        trimmed = dict(result)
+        # summary通常是snippet的扩展版本，两者都存在且内容重叠时只保留summary
+        snippet, summary = trimmed.get("snippet") or "", trimmed.get("summary") or ""
+        if snippet and summary and snippet[:50] in summary:
+            trimmed.pop("snippet")
+        for field in TEXT_FIELDS:
+            value = trimmed.get(field)
+            if not value:
+                continue
+            if remaining <= 0:
+                trimmed.pop(field)
+            elif len(value) > remaining:
+                trimmed[field] = value[:remaining] + "…"
+                remaining = 0
+            else:
+                remaining -= len(value)
+        budgeted.append(trimmed)
+    return budgeted
+
+
+def budget_to_chars(max_tokens: int, sample_text: str = "") -> int:
+    """
+    将token预算换算为字符预算，按样本文本的字符/token比例换算，无样本时按中文1:1估算
+
+    Args:
+        max_tokens: token预算
+        sample_text: 用于估算比例的样本文本
+
+    Returns:
+        int: 字符预算
+    """
+    tokens = estimate_tokens(sample_text)
+    if not tokens:
+        return max_tokens
+    return int(max_tokens * len(sample_text) / tokens)
@@ -0,0 +1,175 @@
+"""
+进程间共享状态模块
+多个Web工作进程部署时，原本保存在进程内的状态（对话标题缓存、日志）改为保存在同一个SQLite数据库中，
+保证请求落到任何一个工作进程时行为一致
+"""
+import json
+import os
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+
+# 日志环形缓冲区最多保留的日志数量
+LOG_RING_MAX_ENTRIES = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS log_ring (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    message TEXT NOT NULL,
+    level TEXT NOT NULL,
+    worker TEXT NOT NULL
+);
+"""
+
+_initialized_paths = set()
+
+
+@contextmanager
+def _connect(db_path: str) -> Iterator[sqlite3.Connection]:
+    """每次操作使用独立连接，保证多线程、多进程下安全"""
+    if db_path not in _initialized_paths:
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        _initialized_paths.add(db_path)
+
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+class SharedDict(MutableMapping):
+    """保存在SQLite中的字典，值需可JSON序列化，可被多个进程同时读写"""
+
+    def __init__(self, db_path: str, namespace: str):
+        self.db_path = db_path
+        self.namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT value FROM shared_kv WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row["value"])
+
+    def __setitem__(self, key: str, value: Any):
+        with _connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+
+    def __delitem__(self, key: str):
+        with _connect(self.db_path) as conn:
+            cursor = conn.execute("DELETE FROM shared_kv WHERE namespace = ? AND key = ?", (self.namespace, key))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT 1 FROM shared_kv WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT key FROM shared_kv WHERE namespace = ?", (self.namespace,)).fetchall()
+        return iter([row["key"] for row in rows])
+
+    def transform(self, key: str, func: Callable[[Any], Any], default: Any = None) -> Any:
+        """在同一个写事务中读取key的值、用func计算新值并写回，返回新值；多个进程同时调用时依次执行"""
+        with _connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value FROM shared_kv WHERE namespace = ? AND key = ?",
+                                   (self.namespace, key)).fetchone()
+                value = func(json.loads(row["value"]) if row else default)
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared_kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), time.time())
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def __len__(self) -> int:
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT COUNT(*) AS count FROM shared_kv WHERE namespace = ?",
+                               (self.namespace,)).fetchone()
+        return row["count"]
+
+
+class LogRing:
+    """所有工作进程共用的日志环形缓冲区，超过数量上限时删除最早的日志"""
+
+    def __init__(self, db_path: str, max_entries: int = LOG_RING_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+
+    def append(self, entries: List[Dict[str, Any]], worker: str):
+        """批量写入日志"""
+        if not entries:
+            return
+        with _connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = None
+                for entry in entries:
+                    cursor = conn.execute(
+                        "INSERT INTO log_ring (timestamp, message, level, worker) VALUES (?, ?, ?, ?)",
+                        (entry["timestamp"], entry["message"], entry.get("level", "INFO"), worker)
+                    )
+                conn.execute("DELETE FROM log_ring WHERE log_id <= ?", (cursor.lastrowid - self.max_entries,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        return {"id": row["log_id"], "timestamp": row["timestamp"], "message": row["message"],
+                "level": row["level"], "worker": row["worker"]}
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的日志，按时间顺序排列"""
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM log_ring ORDER BY log_id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_entry(row) for row in reversed(rows)]
+
+    def after(self, log_id: int, limit: int = 200) -> List[Dict[str, Any]]:
+        """log_id之后的日志"""
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM log_ring WHERE log_id > ? ORDER BY log_id LIMIT ?",
+                                (log_id, limit)).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def last_id(self) -> int:
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT MAX(log_id) AS log_id FROM log_ring").fetchone()
+        return row["log_id"] or 0
+
+    def clear(self):
+        with _connect(self.db_path) as conn:
+            conn.execute("DELETE FROM log_ring")
@@ -0,0 +1,125 @@
+"""
+任务执行事件流模块
+任务执行过程中产生的事件写入线程安全的队列，由Web服务以SSE格式推送给前端
+"""
+import json
+import queue
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .timestamp_utils import get_current_timestamp
+
+# 事件类型
+EVENT_TASK_CLASSIFIED = "task_classified"
+EVENT_TASK_STARTED = "task_started"
+EVENT_TOOL_CALLED = "tool_called"
+EVENT_TOOL_PROGRESS = "tool_progress"
+EVENT_TASK_FINISHED = "task_finished"
+EVENT_SUMMARY_DELTA = "summary_delta"
+EVENT_SUMMARY_READY = "summary_ready"
+EVENT_HEARTBEAT = "heartbeat"
+EVENT_JOB_QUEUED = "job_queued"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+
+# 没有新事件时发送心跳的间隔（秒），心跳中包含正在执行的任务及已用时间
+HEARTBEAT_INTERVAL = 5.0
+# task_finished事件中携带的部分内容的最大字符数
+PARTIAL_CONTENT_MAX_CHARS = 800
+
+# 事件回调类型：on_event(事件类型, 事件数据)
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def format_sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """将事件格式化为SSE文本，带event_id时客户端可通过Last-Event-ID断点续传"""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def emit_event(on_event: Optional[EventCallback], event: str, **data):
+    """发送事件，未设置回调或回调出错时不影响任务执行"""
+    if on_event is None:
+        return
+    try:
+        on_event(event, data)
+    except Exception:
+        pass
+
+
+def partial_content(content: Optional[str]) -> str:
+    """截取任务结果的前一部分用于进度展示"""
+    content = (content or "").strip()
+    if len(content) > PARTIAL_CONTENT_MAX_CHARS:
+        return content[:PARTIAL_CONTENT_MAX_CHARS] + "…"
+    return content
+
+
+class RunningTasks:
+    """根据已推送的事件记录正在执行的任务，用于心跳中展示耗时较长的任务"""
+
+    def __init__(self):
+        self._running: Dict[int, Dict[str, Any]] = {}
+
+    def track(self, event: str, data: Dict[str, Any]):
+        task_number = data.get("task_number")
+        if task_number is None:
+            return
+        if event == EVENT_TASK_STARTED:
+            self._running[task_number] = {"task_number": task_number, "todo": data.get("todo", ""),
+                                          "started_at": time.monotonic()}
+        elif event == EVENT_TASK_FINISHED:
+            self._running.pop(task_number, None)
+
+    def heartbeat(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "timestamp": get_current_timestamp(),
+            "running_tasks": [
+                {"task_number": task["task_number"], "todo": task["todo"],
+                 "elapsed_seconds": round(now - task["started_at"], 1)}
+                for task in sorted(self._running.values(), key=lambda t: t["task_number"])
+            ]
+        }
+
+
+class TaskEventStream:
+    """任务事件队列：执行线程写入事件，HTTP响应线程读取并推送"""
+
+    def __init__(self, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.heartbeat_interval = heartbeat_interval
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._running = RunningTasks()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def emit(self, event: str, data: Dict[str, Any], event_id: Optional[int] = None):
+        """写入事件（线程安全）"""
+        if self._closed:
+            return
+        self._queue.put((event, {**data, "timestamp": data.get("timestamp") or get_current_timestamp()}, event_id))
+
+    def close(self):
+        """执行结束后关闭事件流"""
+        self._closed = True
+        self._queue.put(None)
+
+    def iter_sse(self) -> Iterator[str]:
+        """逐条输出SSE文本，直到事件流关闭（客户端断开时同样关闭事件流）"""
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield format_sse(EVENT_HEARTBEAT, self._running.heartbeat())
+                    continue
+                if item is None:
+                    return
+                event, data, event_id = item
+                self._running.track(event, data)
+                yield format_sse(event, data, event_id)
+        finally:
+            self._closed = True
@@ -0,0 +1,50 @@
+"""
+Token估算工具模块
+在不依赖分词器的情况下粗略估算文本的token数量
+"""
+import re
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量：中日韩字符按1个token计，其他字符按4个字符1个token计
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        int: 估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    按估算token数截断文本，超出部分以省略号结尾
+
+    Args:
+        text: 文本内容
+        max_tokens: 最大token数
+
+    Returns:
+        str: 截断后的文本
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分查找满足token预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens - 1:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"